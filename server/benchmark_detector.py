@@ -0,0 +1,41 @@
+"""
+Throughput benchmark for the inventory detection backend.
+
+Usage:
+    python benchmark_detector.py --model models/inventory_detector.onnx --batch-sizes 1 8 32
+
+Reports images/sec and latency per batch so the inventory-scanning fleet can be sized.
+"""
+import argparse
+
+from inventory_api import (
+    SmartInventoryDetector, load_detection_backend, load_detector_labels, benchmark_detector,
+    DETECTOR_MODEL_PATH, DETECTOR_THREADS, DETECTOR_INPUT_SIZE
+)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the inventory detector on CPU")
+    parser.add_argument('--model', default=DETECTOR_MODEL_PATH)
+    parser.add_argument('--threads', type=int, default=DETECTOR_THREADS)
+    parser.add_argument('--input-size', type=int, default=DETECTOR_INPUT_SIZE)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    args = parser.parse_args()
+
+    backend = load_detection_backend(args.model, args.threads)
+    if backend is None:
+        raise SystemExit(f"Could not load a detection model from {args.model}")
+
+    detector = SmartInventoryDetector(backend=backend, labels=load_detector_labels(args.model),
+                                      input_size=args.input_size)
+    results = benchmark_detector(detector, tuple(args.batch_sizes), args.iterations, (args.width, args.height))
+
+    print(f"Backend: {backend.name}  threads: {args.threads}  input: {args.input_size}px")
+    print(f"{'batch':>6} {'images/sec':>12} {'ms/batch':>10}")
+    for row in results:
+        print(f"{row['batch_size']:>6} {row['images_per_sec']:>12.1f} {row['latency_ms_per_batch']:>10.1f}")
+
+if __name__ == '__main__':
+    main()
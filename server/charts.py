@@ -0,0 +1,494 @@
+"""
+Chart rendering for the inventory API.
+
+Charts are rendered on a thread pool: Agg releases most of the GIL while it
+rasterizes, and spawned pool processes re-ran the server script, rebuilding the
+detector, model watcher and stores that inventory_api creates at import time. The
+renderers therefore draw on their own Figure objects instead of pyplot's global state
+and never modify the frames they are given.
+"""
+import base64
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from io import BytesIO
+from typing import Dict, Optional, Tuple, Union
+
+import matplotlib
+matplotlib.use("Agg")
+from matplotlib.figure import Figure
+import numpy as np
+import pandas as pd
+import seaborn as sns
+
+logger = logging.getLogger(__name__)
+
+CHART_CACHE_SIZE = 256  # Rendered chart images kept in memory
+CHART_RENDER_WORKERS = 2
+CHART_MAX_POINTS = 500  # Default LTTB target for client-side chart series
+
+def generate_price_trend_plot(market_data: pd.DataFrame, title: str = "Price Trends") -> str:
+    """Generate price trend visualization and return as base64 image"""
+    try:
+        if market_data.empty or not set(['Min Price', 'Modal Price', 'Max Price']).issubset(market_data.columns):
+            # Generate empty plot with message
+            fig = Figure(figsize=(10, 6))
+            ax = fig.subplots()
+            ax.text(0.5, 0.5, "No data available for visualization", 
+                    horizontalalignment='center', verticalalignment='center', transform=ax.transAxes)
+            ax.set_title(title)
+            
+            # Convert to base64
+            buf = BytesIO()
+            fig.savefig(buf, format='png')
+            buf.seek(0)
+            img_str = base64.b64encode(buf.getvalue()).decode('utf-8')
+            return img_str
+            
+        # Create plot with market data
+        fig = Figure(figsize=(10, 6))
+        ax = fig.subplots()
+        
+        # Sort by market for better visualization
+        market_data_sorted = market_data.sort_values('Market')
+        
+        # Plot min, modal, and max prices
+        x = range(len(market_data_sorted))
+        markets = market_data_sorted['Market'].tolist()
+        
+        ax.plot(x, market_data_sorted['Min Price'], 'b-o', label='Min Price')
+        ax.plot(x, market_data_sorted['Modal Price'], 'g-o', label='Modal Price')
+        ax.plot(x, market_data_sorted['Max Price'], 'r-o', label='Max Price')
+        
+        # Set x-ticks to market names
+        ax.set_xticks(x)
+        ax.set_xticklabels(markets, rotation=45, ha='right')
+        
+        # Add labels and title
+        ax.set_xlabel('Market')
+        ax.set_ylabel('Price (₹/kg)')
+        ax.set_title(title)
+        ax.legend()
+        
+        # Adjust layout
+        fig.tight_layout()
+        
+        # Convert to base64
+        buf = BytesIO()
+        fig.savefig(buf, format='png')
+        buf.seek(0)
+        img_str = base64.b64encode(buf.getvalue()).decode('utf-8')
+        
+        return img_str
+    except Exception as e:
+        logger.error(f"Error generating price trend plot: {str(e)}")
+        return ""
+
+def generate_price_distribution_plot(market_data: pd.DataFrame, title: str = "Price Distribution") -> str:
+    """Generate price distribution visualization and return as base64 image"""
+    try:
+        if market_data.empty or 'Modal Price' not in market_data.columns:
+            # Generate empty plot with message
+            fig = Figure(figsize=(10, 6))
+            ax = fig.subplots()
+            ax.text(0.5, 0.5, "No data available for visualization", 
+                    horizontalalignment='center', verticalalignment='center', transform=ax.transAxes)
+            ax.set_title(title)
+            
+            # Convert to base64
+            buf = BytesIO()
+            fig.savefig(buf, format='png')
+            buf.seek(0)
+            img_str = base64.b64encode(buf.getvalue()).decode('utf-8')
+            return img_str
+            
+        # Create box plot
+        fig = Figure(figsize=(10, 6))
+        ax = fig.subplots()
+        
+        # Create data for boxplot
+        price_columns = [col for col in ['Min Price', 'Modal Price', 'Max Price'] if col in market_data.columns]
+        data = [market_data[col] for col in price_columns]
+        
+        # Generate boxplot
+        bp = ax.boxplot(data, patch_artist=True, labels=price_columns)
+        
+        # Add some styling
+        colors = ['lightblue', 'lightgreen', 'salmon']
+        for patch, color in zip(bp['boxes'], colors[:len(price_columns)]):
+            patch.set_facecolor(color)
+            
+        # Add scatter points for individual data points
+        for i, col in enumerate(price_columns):
+            y = market_data[col]
+            x = np.random.normal(i+1, 0.04, size=len(y))
+            ax.scatter(x, y, alpha=0.3, s=20)
+            
+        # Add labels and title
+        ax.set_xlabel('Price Type')
+        ax.set_ylabel('Price (₹/kg)')
+        ax.set_title(title)
+        
+        # Adjust layout
+        fig.tight_layout()
+        
+        # Convert to base64
+        buf = BytesIO()
+        fig.savefig(buf, format='png')
+        buf.seek(0)
+        img_str = base64.b64encode(buf.getvalue()).decode('utf-8')
+        
+        return img_str
+    except Exception as e:
+        logger.error(f"Error generating price distribution plot: {str(e)}")
+        return ""
+
+def generate_inventory_chart(current_stock: float, optimal_levels: Dict, title: str = "Inventory Status") -> str:
+    """Generate inventory status visualization and return as base64 image"""
+    try:
+        # Create plot
+        fig = Figure(figsize=(10, 6))
+        ax = fig.subplots()
+        
+        # Create bar for current stock
+        ax.bar(['Current Stock'], [current_stock], color='blue', alpha=0.6, label='Current Stock')
+        
+        # Add optimal level lines
+        stock_levels = [
+            ('Min Stock', optimal_levels.get('min_stock', 0), 'orange'),
+            ('Reorder Point', optimal_levels.get('reorder_point', 0), 'red'),
+            ('Max Stock', optimal_levels.get('max_stock', 0), 'green')
+        ]
+        
+        # Plot level lines
+        for name, value, color in stock_levels:
+            ax.axhline(y=value, linestyle='--', color=color, label=name)
+            
+        # Add labels and title
+        ax.set_ylabel('Stock Level (kg)')
+        ax.set_title(title)
+        ax.legend()
+        
+        # Adjust layout
+        fig.tight_layout()
+        
+        # Convert to base64
+        buf = BytesIO()
+        fig.savefig(buf, format='png')
+        buf.seek(0)
+        img_str = base64.b64encode(buf.getvalue()).decode('utf-8')
+        
+        return img_str
+    except Exception as e:
+        logger.error(f"Error generating inventory chart: {str(e)}")
+        return ""
+
+def generate_price_forecast_chart(historical_data: pd.DataFrame, forecast_data: pd.DataFrame, title: str = "Price Forecast") -> str:
+    """Generate price forecast visualization and return as base64 image"""
+    try:
+        if (historical_data.empty or 'Modal Price' not in historical_data.columns or 
+            'Date' not in historical_data.columns or forecast_data is None):
+            # Generate empty plot with message
+            fig = Figure(figsize=(10, 6))
+            ax = fig.subplots()
+            ax.text(0.5, 0.5, "No data available for price forecast", 
+                    horizontalalignment='center', verticalalignment='center', transform=ax.transAxes)
+            ax.set_title(title)
+            
+            # Convert to base64
+            buf = BytesIO()
+            fig.savefig(buf, format='png')
+            buf.seek(0)
+            img_str = base64.b64encode(buf.getvalue()).decode('utf-8')
+            return img_str
+            
+        # Ensure dates are in datetime format (on copies: the caller's frames are shared across render threads)
+        historical_data = historical_data.assign(Date=pd.to_datetime(historical_data['Date'])).sort_values('Date')
+        forecast_data = forecast_data.assign(
+            arrival_date=pd.to_datetime(forecast_data['arrival_date'])
+        ).sort_values('arrival_date')
+        
+        # Create plot
+        fig = Figure(figsize=(12, 6))
+        ax = fig.subplots()
+        
+        # Plot historical data
+        ax.plot(historical_data['Date'], historical_data['Modal Price'], 'b-', label='Historical Price')
+        
+        # Plot forecast data
+        ax.plot(forecast_data['arrival_date'], forecast_data['predicted_price'], 'r--', label='Forecast')
+        
+        # Add confidence interval
+        if 'confidence_upper' in forecast_data.columns and 'confidence_lower' in forecast_data.columns:
+            ax.fill_between(
+                forecast_data['arrival_date'],
+                forecast_data['confidence_lower'],
+                forecast_data['confidence_upper'],
+                color='red', alpha=0.2,
+                label='95% Confidence Interval'
+            )
+            
+        # Add labels and title
+        ax.set_xlabel('Date')
+        ax.set_ylabel('Price (₹/kg)')
+        ax.set_title(title)
+        ax.legend()
+        
+        # Format date axis
+        fig.autofmt_xdate()
+        
+        # Adjust layout
+        fig.tight_layout()
+        
+        # Convert to base64
+        buf = BytesIO()
+        fig.savefig(buf, format='png')
+        buf.seek(0)
+        img_str = base64.b64encode(buf.getvalue()).decode('utf-8')
+        
+        return img_str
+    except Exception as e:
+        logger.error(f"Error generating price forecast chart: {str(e)}")
+        return ""
+
+def generate_price_matrix_heatmap(matrix: Dict, title: str = "Market Price Heatmap") -> str:
+    """Render a market x date price matrix as a heatmap and return as base64 image"""
+    try:
+        values = np.array(matrix.get("values") or [], dtype=np.float64).reshape(
+            len(matrix.get("rows", [])), len(matrix.get("columns", []))
+        )
+        fig = Figure(figsize=(12, 8))
+        ax = fig.subplots()
+        
+        if values.size == 0:
+            # Simple text if not enough data
+            ax.text(0.5, 0.5, "No data available for heatmap visualization", 
+                    horizontalalignment='center', verticalalignment='center', transform=ax.transAxes)
+            ax.set_title(title)
+        elif values.shape[0] > 1 and values.shape[1] > 1:
+            # Use seaborn for heatmap
+            pivot_data = pd.DataFrame(values, index=matrix["rows"], columns=matrix["columns"])
+            sns.heatmap(pivot_data, annot=values.shape[1] <= 31, cmap="YlGnBu", ax=ax, fmt='.1f')
+            ax.set_title(title)
+            fig.tight_layout()
+        else:
+            # Not enough data for a heatmap, create bar chart instead
+            if values.shape[0] > 1:
+                labels, heights = matrix["rows"], np.nanmean(values, axis=1)
+                ax.set_xlabel('Market')
+            else:
+                labels, heights = matrix["columns"], values[0]
+                ax.set_xlabel('Date')
+            ax.bar(labels, heights, color='skyblue')
+            ax.tick_params(axis='x', labelrotation=45)
+            for label in ax.get_xticklabels():
+                label.set_horizontalalignment('right')
+            ax.set_ylabel('Price (₹/kg)')
+            ax.set_title(title)
+            fig.tight_layout()
+        
+        # Convert to base64
+        buf = BytesIO()
+        fig.savefig(buf, format='png')
+        buf.seek(0)
+        img_str = base64.b64encode(buf.getvalue()).decode('utf-8')
+        
+        return img_str
+    except Exception as e:
+        logger.error(f"Error generating market heatmap: {str(e)}")
+        return ""
+
+def generate_seasonal_chart(monthly_df: pd.DataFrame, title: str = "Seasonal Price Pattern") -> str:
+    """Generate the monthly seasonal price pattern chart and return as base64 image"""
+    try:
+        fig = Figure(figsize=(12, 6))
+        ax = fig.subplots()
+        
+        # Plot monthly prices
+        ax.plot(monthly_df['Month'], monthly_df['AvgPrice'], 'b-o', linewidth=2)
+        
+        # Highlight peak and low months
+        peak_month = monthly_df.loc[monthly_df['AvgPrice'].idxmax()]
+        low_month = monthly_df.loc[monthly_df['AvgPrice'].idxmin()]
+        ax.plot(peak_month['Month'], peak_month['AvgPrice'], 'ro', markersize=10, label='Peak Price')
+        ax.plot(low_month['Month'], low_month['AvgPrice'], 'go', markersize=10, label='Lowest Price')
+        
+        # Highlight current month
+        current_idx = datetime.now().month - 1
+        ax.axvline(x=current_idx, color='gray', linestyle='--', alpha=0.7)
+        ax.text(current_idx, 
+                ax.get_ylim()[0] + (ax.get_ylim()[1] - ax.get_ylim()[0])*0.05, 
+                'Current Month', rotation=90, alpha=0.7)
+        
+        # Add labels and title
+        ax.set_xlabel('Month')
+        ax.set_ylabel('Average Price (₹/kg)')
+        ax.set_title(title)
+        ax.legend()
+        
+        # Rotate x-axis labels for better readability
+        ax.tick_params(axis='x', labelrotation=45)
+        fig.tight_layout()
+        
+        # Convert to base64
+        buf = BytesIO()
+        fig.savefig(buf, format='png')
+        buf.seek(0)
+        img_str = base64.b64encode(buf.getvalue()).decode('utf-8')
+        return img_str
+    except Exception as e:
+        logger.error(f"Error generating seasonal chart: {str(e)}")
+        return ""
+
+def generate_yoy_chart(monthly_df: pd.DataFrame, title: str = "Year-over-Year Price Changes") -> str:
+    """Generate the year-over-year monthly change chart and return as base64 image"""
+    try:
+        fig = Figure(figsize=(12, 6))
+        ax = fig.subplots()
+        
+        # Create colormap for positive/negative values
+        changes = monthly_df['YoYChange'].fillna(0)
+        colors = ['red' if x < 0 else 'green' for x in changes]
+        
+        # Create bar chart
+        ax.bar(monthly_df['Month'], changes, color=colors)
+        
+        # Add horizontal line at y=0
+        ax.axhline(y=0, color='black', linestyle='-', alpha=0.3)
+        
+        # Add labels and title
+        ax.set_xlabel('Month')
+        ax.set_ylabel('Year-over-Year Change (%)')
+        ax.set_title(title)
+        
+        # Rotate x-axis labels for better readability
+        ax.tick_params(axis='x', labelrotation=45)
+        fig.tight_layout()
+        
+        # Convert to base64
+        buf = BytesIO()
+        fig.savefig(buf, format='png')
+        buf.seek(0)
+        img_str = base64.b64encode(buf.getvalue()).decode('utf-8')
+        return img_str
+    except Exception as e:
+        logger.error(f"Error generating YoY chart: {str(e)}")
+        return ""
+
+def _chart_fingerprint(value) -> bytes:
+    """Stable content fingerprint for a chart input"""
+    if isinstance(value, pd.DataFrame):
+        columns = ",".join(map(str, value.columns)).encode()
+        return columns + pd.util.hash_pandas_object(value, index=False).values.tobytes()
+    return json.dumps(value, sort_keys=True, default=str).encode()
+
+class ChartService:
+    """Renders charts in a thread pool and keeps the PNGs in an LRU cache keyed by content hash"""
+    def __init__(self, max_entries: int = CHART_CACHE_SIZE, workers: int = CHART_RENDER_WORKERS,
+                 data_builders: Optional[Dict] = None):
+        self.max_entries = max_entries
+        self.workers = workers
+        # Renderer name -> builder of the client-side series (format=data)
+        self.data_builders = data_builders if data_builders is not None else {}
+        self._images = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = None
+    
+    def _get_executor(self) -> Optional[ThreadPoolExecutor]:
+        """Lazily start the render pool"""
+        if self._executor is None and self.workers > 0:
+            try:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="chart-render")
+            except Exception as e:
+                logger.warning(f"Chart render pool unavailable, rendering inline: {str(e)}")
+                self.workers = 0
+        return self._executor
+    
+    def chart_id(self, renderer, *args) -> str:
+        """Content hash of the renderer and all of its inputs (data and title)"""
+        digest = hashlib.sha256(renderer.__name__.encode())
+        for arg in args:
+            digest.update(b"\x00")
+            digest.update(_chart_fingerprint(arg))
+        return digest.hexdigest()[:32]
+    
+    def get(self, chart_id: str) -> Optional[bytes]:
+        """Return a cached PNG, marking it as recently used"""
+        with self._lock:
+            image = self._images.get(chart_id)
+            if image is not None:
+                self._images.move_to_end(chart_id)
+            return image
+    
+    def _store(self, chart_id: str, image: bytes):
+        with self._lock:
+            self._images[chart_id] = image
+            self._images.move_to_end(chart_id)
+            while len(self._images) > self.max_entries:
+                self._images.popitem(last=False)
+    
+    def _render(self, renderer, *args) -> Tuple[str, Optional[bytes]]:
+        """Render a chart (or reuse the cached one), returning its id and PNG bytes"""
+        chart_id = self.chart_id(renderer, *args)
+        image = self.get(chart_id)
+        if image is not None:
+            return chart_id, image
+        
+        with self._lock:
+            future = self._pending.get(chart_id)
+            owner = future is None
+            if owner:
+                executor = self._get_executor()
+                if executor is not None:
+                    try:
+                        future = executor.submit(renderer, *args)
+                        self._pending[chart_id] = future
+                    except Exception as e:
+                        logger.warning(f"Chart render pool failed, rendering inline: {str(e)}")
+                        self._executor = None
+                        self.workers = 0
+        
+        try:
+            img_str = future.result() if future is not None else renderer(*args)
+        except Exception as e:
+            logger.error(f"Error rendering chart {renderer.__name__}: {str(e)}")
+            img_str = ""
+        finally:
+            if owner and future is not None:
+                with self._lock:
+                    self._pending.pop(chart_id, None)
+        
+        if not img_str:
+            return chart_id, None
+        image = base64.b64decode(img_str)
+        self._store(chart_id, image)
+        return chart_id, image
+    
+    def render(self, renderer, *args) -> Optional[str]:
+        """Render a chart and return its id, or None if rendering failed"""
+        chart_id, image = self._render(renderer, *args)
+        return chart_id if image is not None else None
+    
+    def render_for_response(self, renderer, *args, chart_format: str = "base64",
+                            max_points: int = CHART_MAX_POINTS) -> Union[str, Dict]:
+        """
+        Shape a chart for a JSON response: inline base64, a URL plus ETag, or (format=data)
+        the compact series so the frontend can draw it without any server-side rendering.
+        """
+        if chart_format == "data":
+            builder = self.data_builders.get(renderer.__name__)
+            try:
+                return builder(*args, max_points=max_points) if builder else {}
+            except Exception as e:
+                logger.error(f"Error building chart data for {renderer.__name__}: {str(e)}")
+                return {}
+        
+        chart_id, image = self._render(renderer, *args)
+        if chart_format == "url":
+            return {"url": f"/api/charts/{chart_id}", "etag": chart_id} if image is not None else {}
+        return base64.b64encode(image).decode('utf-8') if image is not None else ""
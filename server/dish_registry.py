@@ -0,0 +1,201 @@
+"""
+Registry of reference dishes for the waste API.
+
+Dishes live in an SQLite database in WAL mode instead of a JSON file that was
+rewritten on every registration. Ids come from an AUTOINCREMENT key allocated inside
+the registration transaction, so concurrent registrations (threads or worker
+processes) never share an id, and registering a dish writes one row however many
+dishes an outlet has. Dishes are indexed by outlet and case-insensitive name.
+"""
+import json
+import math
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from waste_history import DEFAULT_KITCHEN
+
+DISH_REGISTRY_DB = os.getenv("DISH_REGISTRY_DB", "dish_registry.db")
+LEGACY_DISH_DATABASE = "dish_database.json"
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS dishes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kitchen TEXT NOT NULL,
+        name TEXT NOT NULL,
+        name_key TEXT NOT NULL,
+        full_weight REAL NOT NULL,
+        reference_image TEXT NOT NULL,
+        timestamp TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_dishes_name_key ON dishes (name_key);
+    CREATE INDEX IF NOT EXISTS idx_dishes_kitchen_name_key ON dishes (kitchen, name_key);
+"""
+
+COLUMNS = "id, kitchen, name, full_weight, reference_image, timestamp"
+
+def name_key(name):
+    """Normalized dish name used by the name indexes"""
+    return " ".join(str(name).split()).casefold()
+
+def parse_dish_id(dish_id):
+    """Integer id of a dish id given as a string or number, or None if it is not one"""
+    try:
+        return int(str(dish_id).strip())
+    except (TypeError, ValueError):
+        return None
+
+class DishRegistry:
+    def __init__(self, path=DISH_REGISTRY_DB, legacy_path=LEGACY_DISH_DATABASE):
+        self.path = path
+        self.local = threading.local()
+
+        conn = self._connection()
+        with conn:
+            conn.executescript(SCHEMA)
+        self._import_legacy(legacy_path)
+
+    def _connect(self):
+        # Transactions are managed explicitly so ids are allocated under BEGIN IMMEDIATE
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _connection(self):
+        """Per-thread connection"""
+        if getattr(self.local, 'conn', None) is None or getattr(self.local, 'pid', None) != os.getpid():
+            self.local.conn = self._connect()
+            self.local.pid = os.getpid()
+        return self.local.conn
+
+    def _import_legacy(self, legacy_path):
+        """Import dish_database.json once, keeping its ids, if the registry is still empty"""
+        if not legacy_path or not os.path.exists(legacy_path):
+            return
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT EXISTS (SELECT 1 FROM dishes)").fetchone()[0]:
+                conn.execute("ROLLBACK")
+                return
+            with open(legacy_path, 'r') as f:
+                dishes = json.load(f)
+            conn.executemany(
+                "INSERT INTO dishes (id, kitchen, name, name_key, full_weight, reference_image, timestamp) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(int(dish_id), DEFAULT_KITCHEN, dish['name'], name_key(dish['name']), float(dish['full_weight']),
+                  dish['reference_image'], dish.get('timestamp') or datetime.now().isoformat())
+                 for dish_id, dish in dishes.items()]
+            )
+            conn.execute("COMMIT")
+            print(f"Imported {len(dishes)} dishes from {legacy_path}")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _as_dict(row):
+        return {
+            'id': str(row['id']),
+            'kitchen_id': row['kitchen'],
+            'name': row['name'],
+            'full_weight': row['full_weight'],
+            'reference_image': row['reference_image'],
+            'timestamp': row['timestamp']
+        }
+
+    def register(self, name, full_weight, save_reference, kitchen=DEFAULT_KITCHEN, discard_reference=None):
+        """
+        Add a dish under a newly allocated id.
+
+        Args:
+            save_reference: callable(dish_id) that stores the reference image and returns
+                            its filename; runs inside the transaction, so if it raises the
+                            dish is not registered and its id is not used up
+            discard_reference: optional callable(dish_id) that removes whatever
+                               save_reference stored; called before a failed registration
+                               is rolled back, while the id cannot yet be reallocated
+
+        Returns:
+            dict: the registered dish
+
+        Raises:
+            ValueError: if full_weight is not a positive, finite number
+        """
+        full_weight = float(full_weight)
+        if not (math.isfinite(full_weight) and full_weight > 0):
+            raise ValueError(f"Dish weight must be a positive number, got {full_weight}")
+        conn = self._connection()
+        dish_id = None
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = conn.execute(
+                "INSERT INTO dishes (kitchen, name, name_key, full_weight, reference_image, timestamp) "
+                "VALUES (?, ?, ?, ?, '', ?)",
+                (kitchen or DEFAULT_KITCHEN, name, name_key(name), full_weight, datetime.now().isoformat())
+            )
+            dish_id = cursor.lastrowid
+            reference_image = save_reference(str(dish_id))
+            conn.execute("UPDATE dishes SET reference_image = ? WHERE id = ?", (reference_image, dish_id))
+            row = conn.execute(f"SELECT {COLUMNS} FROM dishes WHERE id = ?", (dish_id,)).fetchone()
+            conn.execute("COMMIT")
+        except Exception:
+            try:
+                if discard_reference is not None and dish_id is not None:
+                    discard_reference(str(dish_id))
+            finally:
+                conn.execute("ROLLBACK")
+            raise
+        return self._as_dict(row)
+
+    def get(self, dish_id):
+        """A dish by id (string or number), or None"""
+        dish_id = parse_dish_id(dish_id)
+        if dish_id is None:
+            return None
+        row = self._connection().execute(f"SELECT {COLUMNS} FROM dishes WHERE id = ?", (dish_id,)).fetchone()
+        return self._as_dict(row) if row else None
+
+    def get_many(self, dish_ids):
+        """Dishes by id, as {id string: dish}; unknown ids are left out"""
+        ids = sorted({dish_id for dish_id in map(parse_dish_id, dish_ids) if dish_id is not None})
+        dishes = {}
+        conn = self._connection()
+        # Stay under SQLite's bound parameter limit
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            rows = conn.execute(
+                f"SELECT {COLUMNS} FROM dishes WHERE id IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            dishes.update((str(row['id']), self._as_dict(row)) for row in rows)
+        return dishes
+
+    def find_by_name(self, name, kitchen=None):
+        """Dishes whose name matches (ignoring case and extra spaces), optionally in one outlet"""
+        if kitchen is None:
+            rows = self._connection().execute(
+                f"SELECT {COLUMNS} FROM dishes WHERE name_key = ? ORDER BY id", (name_key(name),)
+            ).fetchall()
+        else:
+            rows = self._connection().execute(
+                f"SELECT {COLUMNS} FROM dishes WHERE kitchen = ? AND name_key = ? ORDER BY id",
+                (kitchen, name_key(name))
+            ).fetchall()
+        return [self._as_dict(row) for row in rows]
+
+    def dishes(self, kitchen=None, offset=0, limit=None):
+        """Registered dishes in id order, optionally of one outlet"""
+        where, params = ("WHERE kitchen = ?", [kitchen]) if kitchen is not None else ("", [])
+        rows = self._connection().execute(
+            f"SELECT {COLUMNS} FROM dishes {where} ORDER BY id LIMIT ? OFFSET ?",
+            params + [-1 if limit is None else limit, offset]
+        ).fetchall()
+        return [self._as_dict(row) for row in rows]
+
+    def count(self, kitchen=None):
+        if kitchen is None:
+            return self._connection().execute("SELECT COUNT(*) FROM dishes").fetchone()[0]
+        return self._connection().execute("SELECT COUNT(*) FROM dishes WHERE kitchen = ?", (kitchen,)).fetchone()[0]
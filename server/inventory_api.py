@@ -8,21 +8,35 @@ import os
 import io
 import base64
 import requests
-import matplotlib.pyplot as plt
 from matplotlib.colors import LinearSegmentedColormap
-import seaborn as sns
 from io import BytesIO
 from functools import lru_cache
 from scipy import stats
 import calendar
 import logging
 import pickle
+import threading
+import time
+import hashlib
+import sqlite3
+import asyncio
+import contextvars
+from contextlib import closing
+from urllib.parse import urlsplit
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.preprocessing import StandardScaler
 import joblib
-from typing import List, Dict, Union, Optional
+from typing import List, Dict, Union, Optional, Tuple
 import traceback
 
+from charts import (
+    ChartService, CHART_MAX_POINTS, generate_price_trend_plot, generate_price_distribution_plot,
+    generate_inventory_chart, generate_price_forecast_chart, generate_price_matrix_heatmap,
+    generate_seasonal_chart, generate_yoy_chart
+)
+
 # Try to import computer vision libraries, use placeholders if not available
 try:
     import cv2
@@ -34,6 +48,20 @@ except ImportError:
     CV_AVAILABLE = False
     logging.warning("Computer Vision packages not installed. Some features will be unavailable.")
 
+# ONNX Runtime is optional; TorchScript models are used when it is missing
+try:
+    import onnxruntime as ort
+    ONNX_AVAILABLE = True
+except ImportError:
+    ONNX_AVAILABLE = False
+
+# aiohttp is optional; upstream calls fall back to the requests session on a thread pool
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+
 app = Flask(__name__)
 CORS(app)
 
@@ -43,7 +71,75 @@ logger = logging.getLogger(__name__)
 
 # Constants
 CACHE_TTL = 3600  # Cache time to live in seconds
+FALLBACK_CACHE_TTL = 60  # Seconds placeholder prices are served before the upstream is asked again
 MODEL_CACHE_FILE = "inventory_model_cache.pkl"
+PREDICTOR_CACHE_FILE = "inventory_predictor_cache.pkl"
+MAX_FETCH_WORKERS = 8  # Concurrent upstream requests per host
+UPSTREAM_POOL_SIZE = 32  # Open upstream connections across all hosts
+UPSTREAM_TIMEOUT = 10  # Seconds per data.gov.in request
+UPSTREAM_RETRIES = 2
+UPSTREAM_BACKOFF = 0.5  # Seconds before the first retry, doubled per retry
+UPSTREAM_HEDGE_DELAY = 2.0  # Seconds before a duplicate request is raced against a slow one
+UPSTREAM_DEADLINE = 12  # Seconds a synchronous caller waits for an upstream call, retries and hedges included
+CIRCUIT_FAILURE_THRESHOLD = 5  # Consecutive failed requests before a host is short-circuited
+CIRCUIT_RESET_TIMEOUT = 30  # Seconds before a probe request is let through to an open host
+MANDI_API_KEY = "579b464db66ec23bdd000001eb7c66f45534444866353f59c1b4470e"
+MANDI_API_URL = "https://api.data.gov.in/resource/9ef84268-d588-465a-a308-a864a43d0070"
+MAX_BATCH_COMMODITIES = 60
+MODEL_POLL_INTERVAL = 30  # Seconds between checks for newly written model files
+MIN_OPTIMIZER_TRAINING_ROWS = 20
+MAX_BATCH_ITEMS = 1000
+SPOILAGE_FRAME_WIDTH = 320  # Frames are downscaled to this width before background subtraction
+SPOILAGE_HISTORY = 120  # Frames kept in each camera's background model
+SPOILAGE_SMOOTHING = 0.2  # EMA weight of the newest spoilage score
+MAX_TRACKED_CAMERAS = 32
+CAMERA_IDLE_TIMEOUT = 1800  # Seconds without frames before a camera's state is dropped
+SPOILAGE_DARK_VALUE = 60  # HSV value below which a pixel counts as rotten/dark in stateless scoring
+SPOILAGE_BROWN_HUE = (5, 25)  # OpenCV hue range (0-180) of browning produce
+DETECTOR_MODEL_PATH = os.environ.get('INVENTORY_DETECTOR_MODEL', os.path.join('models', 'inventory_detector.onnx'))
+DETECTOR_INPUT_SIZE = 640
+DETECTOR_CONF_THRESHOLD = 0.35
+DETECTOR_IOU_THRESHOLD = 0.5
+DETECTOR_MAX_DETECTIONS = 300
+DETECTOR_BATCH_CHUNK = 16  # Images per letterboxed tensor and forward pass (16 x 3 x 640 x 640 float32 is ~79 MB)
+MAX_DETECT_BATCH_IMAGES = 64  # Images per /api/inventory/detect/batch request
+PRICE_HISTORY_DB = os.environ.get('PRICE_HISTORY_DB', 'market_price_history.db')
+CATALOG_PAGE_SIZE = 1000
+CATALOG_MAX_PAGES = 50  # Upper bound on records paged per catalog sync
+CATALOG_SYNC_INTERVAL = 86400  # Seconds between background catalog syncs
+CATALOG_MAX_AGE = 300  # Browser cache lifetime for /api/states; ETags make revalidation cheap
+SEASONAL_CACHE_SIZE = 512  # (commodity, market, year) seasonal index results kept in memory
+ALL_MARKETS = '*'  # Series key for the average over every market of a commodity
+FORECAST_HORIZON_DAYS = 30
+FORECAST_CACHE_SIZE = 256  # Fitted forecaster states kept in memory
+FORECAST_REFIT_INTERVAL = 60  # Observations absorbed incrementally before parameters are re-estimated
+FORECAST_DAMPING = 0.98  # Per-day trend damping
+FORECAST_HISTORY_DAYS = 365  # Stored history used to seed a forecast
+ANNOTATED_IMAGE_CACHE_SIZE = 64  # Annotated detection images kept for download
+DETECTOR_THREADS = int(os.environ.get('INVENTORY_DETECTOR_THREADS', os.cpu_count() or 1))
+
+# Waste predictor feature layout (shared by training and inference)
+WASTE_FEATURE_COLUMNS = ['days_in_stock', 'temperature', 'humidity', 'shelf_life', 'quantity']
+
+# Stock optimizer feature layout (shared by training and inference)
+OPTIMIZER_FEATURE_COLUMNS = [
+    'current_stock', 'storage_capacity', 'min_stock_level', 'lead_time_days', 'spoilage_rate',
+    'is_weekend', 'is_festival', 'restaurant_type', 'storage_conditions',
+    'price_mean', 'price_std', 'price_max', 'price_min'
+]
+OPTIMIZER_PROFILE_DEFAULTS = {
+    'current_stock': 0,
+    'storage_capacity': 100,
+    'min_stock_level': 10,
+    'lead_time_days': 3,
+    'spoilage_rate': 5,
+    'is_weekend': False,
+    'is_festival': False,
+    'restaurant_type': 'Casual Dining',
+    'storage_conditions': 'Optimal'
+}
+RESTAURANT_TYPE_CODES = {'Fast Food': 0, 'Fine Dining': 1, 'Casual Dining': 2, 'Cafe': 3}
+STORAGE_CONDITION_CODES = {'Optimal': 2, 'Sub-optimal': 1, 'Poor': 0}
 
 # Update the STATES_DATA dictionary with more cities
 STATES_DATA = {
@@ -84,15 +180,270 @@ COMMODITY_CATEGORIES = {
     ]
 }
 
-# Configure requests retry
-retry_strategy = requests.adapters.Retry(
-    total=3,
-    backoff_factor=1,
-    status_forcelist=[500, 502, 503, 504]
+# Detector class labels default to every commodity, in category order
+DETECTOR_LABELS = [item for items in COMMODITY_CATEGORIES.values() for item in items]
+ITEM_CATEGORY = {}
+for _category, _items in COMMODITY_CATEGORIES.items():
+    for _item in _items:
+        ITEM_CATEGORY.setdefault(_item, _category)
+
+# Upstream HTTP client
+class UpstreamError(Exception):
+    """An upstream request failed after retries and hedging"""
+
+class CircuitOpenError(UpstreamError):
+    """The host has failed repeatedly and is not being called for now"""
+
+class UpstreamDeadlineError(UpstreamError):
+    """The caller's overall deadline passed before the upstream answered"""
+
+class UpstreamStatusError(UpstreamError):
+    def __init__(self, url: str, status: int):
+        super().__init__(f"{url} returned HTTP {status}")
+        self.status = status
+    
+    @property
+    def retryable(self) -> bool:
+        return self.status >= 500 or self.status == 429
+
+# Monotonic deadline of the synchronous caller; inherited by tasks spawned on its behalf
+_upstream_deadline = contextvars.ContextVar("upstream_deadline", default=None)
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open probe"""
+    
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.state = "closed"
+        self.opened_at = 0.0
+    
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            return True
+        return False
+    
+    def record_success(self):
+        self.failures = 0
+        self.state = "closed"
+    
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+class UpstreamClient:
+    """
+    Async client for upstream JSON APIs.
+    
+    One event loop per process runs in a daemon thread and owns a sized connection pool
+    (aiohttp when installed, otherwise the requests session on a bounded thread pool).
+    Each host gets a concurrency limit and a circuit breaker; slow requests are hedged
+    with a duplicate after UPSTREAM_HEDGE_DELAY and the first answer wins. Coroutines can
+    be awaited directly on the loop, and synchronous Flask handlers use run(), which
+    bounds the whole call (retries and hedges included) by a deadline so request
+    threads are released on time.
+    """
+    
+    def __init__(self, pool_size: int = UPSTREAM_POOL_SIZE, per_host_limit: int = MAX_FETCH_WORKERS,
+                 timeout: float = UPSTREAM_TIMEOUT, retries: int = UPSTREAM_RETRIES,
+                 hedge_delay: Optional[float] = UPSTREAM_HEDGE_DELAY):
+        self.pool_size = pool_size
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.retries = retries
+        self.hedge_delay = hedge_delay
+        self._lock = threading.Lock()
+        self._loop = None
+        self._loop_thread = None
+        self._pid = None
+        self._executor = None
+        self._http = None
+        self._semaphores = {}
+        self._breakers = {}
+        self._stats = {"requests": 0, "hedged": 0, "retries": 0, "failures": 0, "short_circuited": 0}
+    
+    @property
+    def backend(self) -> str:
+        return "aiohttp" if AIOHTTP_AVAILABLE else "requests"
+    
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            # Start lazily, and again in forked workers that inherited a dead loop thread
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="upstream")
+                self._http = None
+                self._semaphores = {}
+                self._pid = os.getpid()
+                self._loop_thread = threading.Thread(target=self._loop.run_forever, name="upstream-client", daemon=True)
+                self._loop_thread.start()
+            return self._loop
+    
+    def run(self, coro, timeout: Optional[float] = UPSTREAM_DEADLINE):
+        """
+        Run a coroutine on the client loop from synchronous code and wait for its result.
+        
+        Upstream calls made by the coroutine stop retrying and hedging at the deadline; if
+        it still has not finished shortly after, it is cancelled and UpstreamDeadlineError
+        is raised.
+        """
+        loop = self._ensure_loop()
+        if threading.current_thread() is self._loop_thread:
+            coro.close()
+            raise RuntimeError("UpstreamClient.run() called from the client loop; await the coroutine instead")
+        future = asyncio.run_coroutine_threadsafe(self._with_deadline(coro, timeout), loop)
+        try:
+            # A little grace so the coroutine can return its own fallback at the deadline
+            return future.result(None if timeout is None else timeout + 1.0)
+        except TimeoutError:
+            future.cancel()
+            raise UpstreamDeadlineError(f"Upstream call did not finish within {timeout}s")
+    
+    @staticmethod
+    async def _with_deadline(coro, timeout: Optional[float]):
+        if timeout is not None:
+            _upstream_deadline.set(time.monotonic() + timeout)
+        return await coro
+    
+    @staticmethod
+    def _remaining() -> Optional[float]:
+        """Seconds left before the caller's deadline, or None without one"""
+        deadline = _upstream_deadline.get()
+        return None if deadline is None else deadline - time.monotonic()
+    
+    def _breaker(self, host: str) -> CircuitBreaker:
+        if host not in self._breakers:
+            self._breakers[host] = CircuitBreaker()
+        return self._breakers[host]
+    
+    def _semaphore(self, host: str) -> asyncio.Semaphore:
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.per_host_limit)
+        return self._semaphores[host]
+    
+    async def _transport_get(self, url: str, params: Optional[Dict]) -> Tuple[int, object]:
+        if AIOHTTP_AVAILABLE:
+            if self._http is None:
+                self._http = aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(limit=self.pool_size, limit_per_host=self.per_host_limit,
+                                                   ttl_dns_cache=300),
+                    timeout=aiohttp.ClientTimeout(total=self.timeout)
+                )
+            async with self._http.get(url, params=params) as response:
+                if response.status >= 400:
+                    return response.status, None
+                return response.status, await response.json(content_type=None)
+        
+        def blocking_get():
+            response = session.get(url, params=params, timeout=self.timeout)
+            if response.status_code >= 400:
+                return response.status_code, None
+            return response.status_code, response.json()
+        
+        return await asyncio.get_running_loop().run_in_executor(self._executor, blocking_get)
+    
+    async def _attempt(self, host: str, url: str, params: Optional[Dict]):
+        remaining = self._remaining()
+        timeout = self.timeout if remaining is None else min(self.timeout, remaining)
+        if timeout <= 0:
+            raise UpstreamDeadlineError(f"Deadline passed before requesting {url}")
+        async with self._semaphore(host):
+            status, payload = await asyncio.wait_for(self._transport_get(url, params), timeout)
+        if status >= 400:
+            raise UpstreamStatusError(url, status)
+        return payload
+    
+    async def _hedged(self, host: str, url: str, params: Optional[Dict]):
+        primary = asyncio.ensure_future(self._attempt(host, url, params))
+        remaining = self._remaining()
+        if self.hedge_delay is None or (remaining is not None and remaining <= self.hedge_delay):
+            return await primary
+        
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_delay)
+        if done:
+            return primary.result()
+        
+        self._stats["hedged"] += 1
+        pending = {primary, asyncio.ensure_future(self._attempt(host, url, params))}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    async def get_json(self, url: str, params: Optional[Dict] = None):
+        """GET a JSON document with per-host limits, retries, hedging and circuit breaking"""
+        host = urlsplit(url).netloc
+        breaker = self._breaker(host)
+        if not breaker.allow():
+            self._stats["short_circuited"] += 1
+            raise CircuitOpenError(f"Circuit open for {host}")
+        
+        self._stats["requests"] += 1
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                backoff = UPSTREAM_BACKOFF * 2 ** (attempt - 1)
+                remaining = self._remaining()
+                if remaining is not None and remaining <= backoff:
+                    # No time left for another attempt before the caller's deadline
+                    break
+                self._stats["retries"] += 1
+                await asyncio.sleep(backoff)
+            try:
+                payload = await self._hedged(host, url, dict(params or {}))
+            except UpstreamStatusError as e:
+                if not e.retryable:
+                    # The host answered, so it is healthy even though the request was rejected
+                    breaker.record_success()
+                    raise
+                last_error = e
+            except Exception as e:
+                last_error = e
+            else:
+                breaker.record_success()
+                return payload
+        
+        self._stats["failures"] += 1
+        breaker.record_failure()
+        raise UpstreamError(f"{host} failed after {attempt + 1} attempts: {last_error}") from last_error
+    
+    def get_json_sync(self, url: str, params: Optional[Dict] = None, timeout: Optional[float] = UPSTREAM_DEADLINE):
+        return self.run(self.get_json(url, params), timeout)
+    
+    def stats(self) -> Dict:
+        return {
+            "backend": self.backend,
+            "pool_size": self.pool_size,
+            "per_host_limit": self.per_host_limit,
+            **self._stats,
+            "circuits": {host: breaker.state for host, breaker in list(self._breakers.items())}
+        }
+
+# Blocking transport for the thread-pool fallback; retries live in UpstreamClient
+adapter = requests.adapters.HTTPAdapter(
+    max_retries=0,
+    pool_connections=MAX_FETCH_WORKERS,
+    pool_maxsize=UPSTREAM_POOL_SIZE
 )
-adapter = requests.adapters.HTTPAdapter(max_retries=retry_strategy)
 session = requests.Session()
 session.mount("https://", adapter)
+session.mount("http://", adapter)
+upstream_client = UpstreamClient()
 
 # Cache decorator
 @lru_cache(maxsize=128)
@@ -103,11 +454,19 @@ def cache_heavy_computations(func):
     return wrapper
 
 # Market data functions
-def get_mandi_prices_optimized(state: str, city: str, commodity: str) -> List[Dict]:
-    """Optimized version of get_mandi_prices with better error handling"""
-    API_KEY = "579b464db66ec23bdd000001eb7c66f45534444866353f59c1b4470e"
-    BASE_URL = "https://api.data.gov.in/resource/9ef84268-d588-465a-a308-a864a43d0070"
-    
+class FallbackMarketData(list):
+    """Placeholder prices returned when the upstream has no data or fails; never stored or cached for long"""
+
+def store_market_records(data: Dict):
+    """Keep real upstream prices for seasonal analysis and the states catalog"""
+    try:
+        price_history.ingest(process_market_data_frame(data, None))
+        market_catalog.observe(data["records"])
+    except Exception as e:
+        logger.error(f"Error storing market history: {str(e)}")
+
+async def fetch_mandi_prices(state: str, city: str, commodity: str) -> List[Dict]:
+    """Fetch market data from the upstream API, widening the search when a district has no records"""
     # Standardize commodity names
     commodity_mapping = {
         "Onion": "Onion",
@@ -120,7 +479,7 @@ def get_mandi_prices_optimized(state: str, city: str, commodity: str) -> List[Di
     
     try:
         params = {
-            "api-key": API_KEY,
+            "api-key": MANDI_API_KEY,
             "format": "json",
             "limit": 1000,
             "filters[commodity]": commodity_mapping.get(commodity, commodity),
@@ -128,77 +487,152 @@ def get_mandi_prices_optimized(state: str, city: str, commodity: str) -> List[Di
             "filters[district]": city
         }
         
-        response = session.get(BASE_URL, params=params, timeout=10)
-        data = response.json()
+        data = await upstream_client.get_json(MANDI_API_URL, params)
         
         if not data.get("records"):
             # Try without district filter
             params.pop("filters[district]")
-            response = session.get(BASE_URL, params=params, timeout=10)
-            data = response.json()
+            data = await upstream_client.get_json(MANDI_API_URL, params)
             
             if not data.get("records"):
-                # Try major markets as fallback
+                # Try major markets as fallback, concurrently, keeping the first in priority order
                 fallback_markets = [
                     ("Maharashtra", "Mumbai"),
                     ("Delhi", "New Delhi"),
                     ("Gujarat", "Ahmedabad")
                 ]
                 
-                for fallback_state, fallback_city in fallback_markets:
-                    params["filters[state]"] = fallback_state
-                    params["filters[district]"] = fallback_city
-                    response = session.get(BASE_URL, params=params, timeout=10)
-                    data = response.json()
-                    if data.get("records"):
+                responses = await asyncio.gather(*[
+                    upstream_client.get_json(MANDI_API_URL, {
+                        **params, "filters[state]": fallback_state, "filters[district]": fallback_city
+                    })
+                    for fallback_state, fallback_city in fallback_markets
+                ], return_exceptions=True)
+                
+                for (fallback_state, fallback_city), response in zip(fallback_markets, responses):
+                    if isinstance(response, dict) and response.get("records"):
+                        data = response
                         logger.info(f"Using market data from {fallback_city}, {fallback_state} as reference")
                         break
         
         if data.get("records"):
+            await asyncio.get_running_loop().run_in_executor(None, store_market_records, data)
             return process_market_data(data, None)
         
         # If still no data, return default structured data
-        return generate_default_market_data(commodity)
+        return FallbackMarketData(generate_default_market_data(commodity))
         
     except Exception as e:
         logger.error(f"Error fetching market data: {str(e)}")
-        return generate_default_market_data(commodity)
+        return FallbackMarketData(generate_default_market_data(commodity))
 
-def process_market_data(current_data: Dict, historical_data: Dict) -> List[Dict]:
-    """Process market data into a serializable format"""
-    result = []
+def get_mandi_prices_optimized(state: str, city: str, commodity: str,
+                               timeout: float = UPSTREAM_DEADLINE) -> List[Dict]:
+    """Optimized version of get_mandi_prices with better error handling"""
+    return upstream_client.run(fetch_mandi_prices(state, city, commodity), timeout)
+
+# In-process cache of upstream market data, keyed by (state, city, commodity)
+MARKET_DATA_CACHE = {}
+market_cache_lock = threading.Lock()
+_market_fetches_in_flight = {}  # Only touched on the upstream client loop
+
+async def fetch_mandi_prices_cached(state: str, city: str, commodity: str) -> List[Dict]:
+    """
+    Return market data from the local cache, sharing one upstream fetch between concurrent callers.
     
-    # Process current data
-    if current_data and "records" in current_data:
-        for record in current_data["records"]:
-            processed_record = {
-                "Market": record.get("market", "Unknown"),
-                "Commodity": record.get("commodity", "Unknown"),
-                "Min Price": float(record.get("min_price", 0)),
-                "Max Price": float(record.get("max_price", 0)),
-                "Modal Price": float(record.get("modal_price", 0)),
-                "Date": record.get("arrival_date", "Unknown")
-            }
-            result.append(processed_record)
+    Placeholder prices from a failed fetch are only kept for FALLBACK_CACHE_TTL.
+    """
+    key = (state, city, commodity)
+    now = time.time()
+
+    with market_cache_lock:
+        cached = MARKET_DATA_CACHE.get(key)
+    if cached:
+        ttl = FALLBACK_CACHE_TTL if isinstance(cached[1], FallbackMarketData) else CACHE_TTL
+        if now - cached[0] < ttl:
+            return cached[1]
+
+    fetch = _market_fetches_in_flight.get(key)
+    if fetch is None:
+        fetch = asyncio.ensure_future(_fetch_and_cache_mandi_prices(key))
+        _market_fetches_in_flight[key] = fetch
+        fetch.add_done_callback(lambda _: _market_fetches_in_flight.pop(key, None))
+    # A caller that gives up at its deadline leaves the shared fetch running for the others
+    return await asyncio.shield(fetch)
+
+async def _fetch_and_cache_mandi_prices(key: Tuple[str, str, str]) -> List[Dict]:
+    market_data = await fetch_mandi_prices(*key)
+    with market_cache_lock:
+        MARKET_DATA_CACHE[key] = (time.time(), market_data)
+    return market_data
+
+def get_mandi_prices_cached(state: str, city: str, commodity: str,
+                            timeout: float = UPSTREAM_DEADLINE) -> List[Dict]:
+    """Return market data from the local cache, fetching it if missing or expired"""
+    return upstream_client.run(fetch_mandi_prices_cached(state, city, commodity), timeout)
+
+async def fetch_mandi_prices_batch(state: str, city: str, commodities: List[str]) -> Dict[str, List[Dict]]:
+    """Fetch market data for several commodities concurrently on the upstream client loop"""
+    results = await asyncio.gather(*[fetch_mandi_prices_cached(state, city, c) for c in commodities])
+    return dict(zip(commodities, results))
+
+def get_mandi_prices_batch(state: str, city: str, commodities: List[str],
+                           timeout: float = UPSTREAM_DEADLINE) -> Dict[str, List[Dict]]:
+    """Fetch market data for several commodities concurrently, within one overall deadline"""
+    if not commodities:
+        return {}
+    return upstream_client.run(fetch_mandi_prices_batch(state, city, commodities), timeout)
+
+def normalize_market_records(current_data: Dict, historical_data: Dict) -> Dict[str, np.ndarray]:
+    """Merge upstream records into typed columns, adding historical records only for unseen markets"""
+    records = list(current_data["records"]) if current_data and "records" in current_data else []
     
-    # Process historical data if needed
     if historical_data and "records" in historical_data:
+        # Hash the market names once instead of rescanning the result per record
+        seen_markets = {record.get("market", "Unknown") for record in records}
         for record in historical_data["records"]:
-            # Check if this market is already in the result
-            market_exists = any(r["Market"] == record.get("market", "Unknown") for r in result)
-            
-            if not market_exists:
-                processed_record = {
-                    "Market": record.get("market", "Unknown"),
-                    "Commodity": record.get("commodity", "Unknown"),
-                    "Min Price": float(record.get("min_price", 0)),
-                    "Max Price": float(record.get("max_price", 0)),
-                    "Modal Price": float(record.get("modal_price", 0)),
-                    "Date": record.get("arrival_date", "Unknown")
-                }
-                result.append(processed_record)
+            market = record.get("market", "Unknown")
+            if market not in seen_markets:
+                seen_markets.add(market)
+                records.append(record)
     
-    return result
+    count = len(records)
+    return {
+        "Market": np.array([r.get("market", "Unknown") for r in records], dtype=object),
+        "Commodity": np.array([r.get("commodity", "Unknown") for r in records], dtype=object),
+        "Min Price": np.fromiter((float(r.get("min_price", 0)) for r in records), dtype=np.float64, count=count),
+        "Max Price": np.fromiter((float(r.get("max_price", 0)) for r in records), dtype=np.float64, count=count),
+        "Modal Price": np.fromiter((float(r.get("modal_price", 0)) for r in records), dtype=np.float64, count=count),
+        "Date": np.array([r.get("arrival_date", "Unknown") for r in records], dtype=object)
+    }
+
+def parse_market_dates(values) -> pd.Series:
+    """Parse upstream dd/mm/yyyy arrival dates, falling back to ISO and other unambiguous formats"""
+    values = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    parsed = pd.to_datetime(values, format='%d/%m/%Y', errors='coerce')
+    missing = parsed.isna() & values.notna()
+    if missing.any():
+        parsed[missing] = pd.to_datetime(values[missing], format='mixed', errors='coerce')
+    return parsed
+
+def market_columns_to_frame(columns: Dict[str, np.ndarray]) -> pd.DataFrame:
+    """Build an analysis-ready DataFrame from normalized market columns"""
+    frame = pd.DataFrame(columns, copy=False)
+    # data.gov.in reports arrival dates as dd/mm/yyyy
+    frame["Date"] = pd.to_datetime(frame["Date"], dayfirst=True, errors="coerce")
+    return frame
+
+def process_market_data_frame(current_data: Dict, historical_data: Dict) -> pd.DataFrame:
+    """Process market data straight into a typed DataFrame"""
+    return market_columns_to_frame(normalize_market_records(current_data, historical_data))
+
+def process_market_data(current_data: Dict, historical_data: Dict) -> List[Dict]:
+    """Process market data into a serializable format"""
+    columns = normalize_market_records(current_data, historical_data)
+    names = list(columns.keys())
+    return [dict(zip(names, row)) for row in zip(*(columns[name].tolist() for name in names))]
 
 def generate_default_market_data(commodity: str) -> List[Dict]:
     """Generate default market data based on commodity type"""
@@ -232,72 +666,747 @@ def generate_default_market_data(commodity: str) -> List[Dict]:
     
     return result
 
-def get_available_states() -> Dict[str, List[str]]:
-    """Fetch available states and districts from the API with better error handling"""
-    API_KEY = "579b464db66ec23bdd000001eb7c66f45534444866353f59c1b4470e"
-    BASE_URL = "https://api.data.gov.in/resource/9ef84268-d588-465a-a308-a864a43d0070"
-    
-    try:
+def fetch_market_catalog_pages(max_pages: int = CATALOG_MAX_PAGES):
+    """Page through the upstream feed, yielding lists of records"""
+    for page in range(max_pages):
         params = {
-            "api-key": API_KEY,
+            "api-key": MANDI_API_KEY,
             "format": "json",
-            "limit": 1000
+            "limit": CATALOG_PAGE_SIZE,
+            "offset": page * CATALOG_PAGE_SIZE
         }
-        response = session.get(BASE_URL, params=params)
-        response.raise_for_status()
-        
-        data = response.json()
-        states_dict = {}
-        
-        if "records" in data:
-            for record in data["records"]:
-                state = record.get("state", "")
-                district = record.get("district", "")
-                if state and district:
-                    if state not in states_dict:
-                        states_dict[state] = set()
-                    states_dict[state].add(district)
+        records = upstream_client.get_json_sync(MANDI_API_URL, params).get("records") or []
+        yield records
+        if len(records) < CATALOG_PAGE_SIZE:
+            break
+
+def get_available_states() -> Dict[str, List[str]]:
+    """Available states and districts, served from the in-memory market catalog"""
+    return market_catalog.states()
+
+# Market price history
+class PriceHistoryStore:
+    """
+    Durable daily price history per commodity and market, kept in SQLite.
+    
+    Rows are upserted on (commodity, market, date), so re-ingesting a fetch is harmless.
+    Subscribers are told which (commodity, market) series and months changed, so derived
+    caches can refresh just those parts.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS market_prices (
+            commodity TEXT NOT NULL,
+            market TEXT NOT NULL,
+            date TEXT NOT NULL,
+            min_price REAL,
+            max_price REAL,
+            modal_price REAL NOT NULL,
+            PRIMARY KEY (commodity, market, date)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_market_prices_commodity_date ON market_prices (commodity, date);
+    """
+    
+    def __init__(self, path: str = PRICE_HISTORY_DB):
+        self.path = path
+        self._local = threading.local()
+        self._listeners = []
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+    
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread, opened on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            with self._schema_lock:
+                if not self._schema_ready:
+                    conn.executescript(self.SCHEMA)
+                    self._schema_ready = True
+            self._local.conn = conn
+        return conn
+    
+    def subscribe(self, callback):
+        """
+        Register callback(touched, rows): touched maps (commodity, market) to a set of 'YYYY-MM'
+        months, rows holds the ingested prices (commodity, market, date, min/max/modal_price)
+        """
+        self._listeners.append(callback)
+    
+    def ingest(self, frame: pd.DataFrame) -> int:
+        """Upsert validated daily prices (Commodity, Market, Date, Min/Max/Modal Price); returns rows written"""
+        if frame.empty or not {'Commodity', 'Market', 'Date', 'Modal Price'}.issubset(frame.columns):
+            return 0
+        
+        dates = pd.to_datetime(frame['Date'], errors='coerce')
+        modal = pd.to_numeric(frame['Modal Price'], errors='coerce')
+        valid = dates.notna() & (modal > 0)
+        if not valid.any():
+            return 0
+        
+        rows = pd.DataFrame({
+            'commodity': frame.loc[valid, 'Commodity'].astype(str),
+            'market': frame.loc[valid, 'Market'].astype(str),
+            'date': dates[valid].dt.strftime('%Y-%m-%d'),
+            'min_price': pd.to_numeric(frame.loc[valid, 'Min Price'], errors='coerce') if 'Min Price' in frame else np.nan,
+            'max_price': pd.to_numeric(frame.loc[valid, 'Max Price'], errors='coerce') if 'Max Price' in frame else np.nan,
+            'modal_price': modal[valid]
+        })
+        params = rows.astype(object).where(rows.notna(), None)
+        
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                """
+                INSERT INTO market_prices (commodity, market, date, min_price, max_price, modal_price)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (commodity, market, date) DO UPDATE SET
+                    min_price = excluded.min_price,
+                    max_price = excluded.max_price,
+                    modal_price = excluded.modal_price
+                """,
+                params.itertuples(index=False, name=None)
+            )
         
-        # Convert sets to sorted lists
-        return {k: sorted(list(v)) for k, v in states_dict.items()}
+        touched = {
+            key: set(months)
+            for key, months in rows['date'].str[:7].groupby([rows['commodity'], rows['market']])
+        }
+        for callback in self._listeners:
+            try:
+                callback(touched, rows)
+            except Exception as e:
+                logger.error(f"Error refreshing market history subscriber: {str(e)}")
+        return len(rows)
+    
+    def monthly_means(self, commodity: str, market: Optional[str] = None,
+                      months: Optional[set] = None) -> pd.Series:
+        """Mean modal price per month (PeriodIndex), optionally for one market and a subset of months"""
+        query = "SELECT substr(date, 1, 7) AS month, AVG(modal_price) FROM market_prices WHERE commodity = ?"
+        params = [commodity]
+        if market is not None:
+            query += " AND market = ?"
+            params.append(market)
+        if months:
+            # Bound the scan by the changed months' date range
+            query += " AND date >= ? AND date <= ?"
+            params.extend([f"{min(months)}-01", f"{max(months)}-31"])
+        query += " GROUP BY month ORDER BY month"
+        
+        rows = self._connection().execute(query, params).fetchall()
+        series = pd.Series(
+            [value for _, value in rows],
+            index=pd.PeriodIndex([month for month, _ in rows], freq='M'),
+            dtype=np.float64
+        )
+        return series[series.index.strftime('%Y-%m').isin(months)] if months else series
+    
+    def history(self, commodity: str, market: Optional[str] = None,
+                start: Optional[str] = None, end: Optional[str] = None) -> pd.DataFrame:
+        """Stored daily prices in the analysis column layout"""
+        query = "SELECT market, commodity, min_price, max_price, modal_price, date FROM market_prices WHERE commodity = ?"
+        params = [commodity]
+        if market is not None:
+            query += " AND market = ?"
+            params.append(market)
+        if start:
+            query += " AND date >= ?"
+            params.append(start)
+        if end:
+            query += " AND date <= ?"
+            params.append(end)
+        query += " ORDER BY date"
+        
+        frame = pd.DataFrame(
+            self._connection().execute(query, params).fetchall(),
+            columns=['Market', 'Commodity', 'Min Price', 'Max Price', 'Modal Price', 'Date']
+        )
+        frame['Date'] = pd.to_datetime(frame['Date'])
+        return frame
+
+def classical_seasonal_indices(monthly: pd.Series) -> Dict:
+    """
+    Multiplicative classical decomposition of a monthly price series.
+    
+    With two or more years the trend is a centered 2x12 moving average; with less, the
+    overall mean stands in for it. Returns Jan..Dec seasonal indices (mean 1), the current
+    deseasonalized price level and the gap-filled monthly series.
+    """
+    if monthly.dropna().empty:
+        return {"method": "insufficient_history", "indices": np.ones(12), "level": None,
+                "months_of_history": 0, "monthly": monthly}
+    
+    full = monthly.reindex(pd.period_range(monthly.index.min(), monthly.index.max(), freq='M'))
+    values = full.interpolate(limit=2, limit_area='inside').to_numpy(dtype=np.float64)
+    month_idx = full.index.month.to_numpy() - 1
+    n = len(values)
+    
+    if n >= 24:
+        weights = np.r_[0.5, np.ones(11), 0.5] / 12
+        trend = np.full(n, np.nan)
+        trend[6:n - 6] = np.convolve(values, weights, mode='valid')
+        method = "classical_multiplicative"
+    else:
+        trend = np.full(n, np.nanmean(values))
+        method = "monthly_mean_ratio"
+    
+    ratios = values / trend
+    observed = ~np.isnan(ratios)
+    sums = np.bincount(month_idx[observed], weights=ratios[observed], minlength=12)
+    counts = np.bincount(month_idx[observed], minlength=12)
+    indices = np.divide(sums, counts, out=np.full(12, np.nan), where=counts > 0)
+    indices = np.nan_to_num(indices / np.nanmean(indices), nan=1.0)
+    
+    # Price level = mean of the last year's deseasonalized prices
+    deseasonalized = values / indices[month_idx]
+    return {
+        "method": method,
+        "indices": indices,
+        "level": float(np.nanmean(deseasonalized[-12:])),
+        "months_of_history": int(np.count_nonzero(~np.isnan(full.to_numpy()))),
+        "monthly": full
+    }
+
+class SeasonalIndexCache:
+    """
+    Seasonal indices per (commodity, market, year) from the stored price history.
+    
+    Monthly means are loaded once per series and patched in place when the history store
+    reports new data for specific months; only results for years at or after the earliest
+    changed month are recomputed.
+    """
+    def __init__(self, store: PriceHistoryStore, max_entries: int = SEASONAL_CACHE_SIZE):
+        self.store = store
+        self.max_entries = max_entries
+        self._monthly = {}  # (commodity, market) -> monthly mean Series
+        self._results = OrderedDict()  # (commodity, market, year) -> result, least recently used first
+        self._lock = threading.Lock()
+        store.subscribe(self._on_ingest)
     
-    except requests.exceptions.RequestException:
-        # Fallback to basic states if API fails
-        return STATES_DATA
+    def _on_ingest(self, touched: Dict[Tuple[str, str], set], rows: pd.DataFrame):
+        for (commodity, market), months in touched.items():
+            first_year = int(min(months)[:4])
+            for series_market in (market, ALL_MARKETS):
+                key = (commodity, series_market)
+                with self._lock:
+                    loaded = key in self._monthly
+                if loaded:
+                    updates = self.store.monthly_means(
+                        commodity, None if series_market == ALL_MARKETS else series_market, months
+                    )
+                    with self._lock:
+                        self._monthly[key] = updates.combine_first(self._monthly[key]).sort_index()
+                with self._lock:
+                    for stale in [k for k in self._results if k[:2] == key and k[2] >= first_year]:
+                        del self._results[stale]
+    
+    def _monthly_series(self, commodity: str, market: str) -> pd.Series:
+        key = (commodity, market)
+        with self._lock:
+            series = self._monthly.get(key)
+        if series is None:
+            series = self.store.monthly_means(commodity, None if market == ALL_MARKETS else market)
+            with self._lock:
+                series = self._monthly.setdefault(key, series)
+        return series
+    
+    def get(self, commodity: str, market: str = ALL_MARKETS, year: Optional[int] = None) -> Dict:
+        """Seasonal indices using history up to the end of `year`, plus that year's YoY changes"""
+        year = year or datetime.now().year
+        key = (commodity, market, year)
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                return self._results[key]
+        
+        monthly = self._monthly_series(commodity, market)
+        monthly = monthly[monthly.index <= pd.Period(f"{year}-12", freq='M')]
+        result = classical_seasonal_indices(monthly)
+        
+        # Year-over-year change of each calendar month's mean price
+        this_year = monthly[monthly.index.year == year]
+        last_year = monthly[monthly.index.year == year - 1]
+        current = np.full(12, np.nan)
+        previous = np.full(12, np.nan)
+        current[this_year.index.month.to_numpy() - 1] = this_year.to_numpy()
+        previous[last_year.index.month.to_numpy() - 1] = last_year.to_numpy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result["yoy_change"] = (current - previous) / previous * 100
+        result["observed"] = current
+        result["year"] = year
+        
+        with self._lock:
+            self._results[key] = result
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+        return result
+
+class PriceCube:
+    """
+    Market x date matrix of daily prices for one commodity.
+    
+    Modal, min and max prices live in NumPy arrays with market and date index maps. New
+    markets and dates are appended (capacity grows geometrically), so updates never rebuild
+    the cube; heatmaps and market metrics are slices and reductions over it.
+    """
+    def __init__(self, commodity: str, capacity: Tuple[int, int] = (16, 64)):
+        self.commodity = commodity
+        self.markets = []  # row -> market name
+        self.days = []  # column -> days since epoch
+        self._market_rows = {}
+        self._day_columns = {}
+        self.modal = np.full(capacity, np.nan)
+        self.low = np.full(capacity, np.nan)
+        self.high = np.full(capacity, np.nan)
+        self._lock = threading.RLock()
+    
+    @classmethod
+    def from_frame(cls, commodity: str, market_data: pd.DataFrame) -> 'PriceCube':
+        """Build a transient cube from a request DataFrame"""
+        cube = cls(commodity)
+        cube.update(market_data)
+        return cube
+    
+    def _positions(self, index: Dict, keys: List, values: np.ndarray) -> np.ndarray:
+        """Map values to positions, appending unseen keys"""
+        for value in pd.unique(values):
+            if value not in index:
+                index[value] = len(keys)
+                keys.append(value)
+        return pd.Index(keys).get_indexer(values)
+    
+    def _ensure_capacity(self):
+        rows, columns = self.modal.shape
+        needed_rows, needed_columns = len(self.markets), len(self.days)
+        if needed_rows <= rows and needed_columns <= columns:
+            return
+        new_shape = (max(rows, 1) * 2 if needed_rows > rows else rows,
+                     max(columns, 1) * 2 if needed_columns > columns else columns)
+        new_shape = (max(new_shape[0], needed_rows), max(new_shape[1], needed_columns))
+        for name in ('modal', 'low', 'high'):
+            grown = np.full(new_shape, np.nan)
+            grown[:rows, :columns] = getattr(self, name)
+            setattr(self, name, grown)
+    
+    def update(self, market_data: pd.DataFrame) -> int:
+        """Write daily prices (Market, Date, Min/Max/Modal Price) into the cube; returns cells written"""
+        if market_data.empty or not {'Market', 'Date', 'Modal Price'}.issubset(market_data.columns):
+            return 0
+        
+        dates = parse_market_dates(market_data['Date'])
+        modal = pd.to_numeric(market_data['Modal Price'], errors='coerce')
+        valid = (dates.notna() & modal.notna()).to_numpy()
+        if not valid.any():
+            return 0
+        
+        def column(name):
+            if name not in market_data.columns:
+                return np.full(valid.sum(), np.nan)
+            return pd.to_numeric(market_data[name], errors='coerce').to_numpy(dtype=np.float64)[valid]
+        
+        cells = pd.DataFrame({
+            'market': market_data['Market'].astype(str).to_numpy()[valid],
+            'day': dates.to_numpy()[valid].astype('datetime64[D]').astype(np.int64),
+            'modal': modal.to_numpy(dtype=np.float64)[valid],
+            'low': column('Min Price'),
+            'high': column('Max Price')
+        }).groupby(['market', 'day'], sort=False).mean().reset_index()
+        
+        with self._lock:
+            rows = self._positions(self._market_rows, self.markets, cells['market'].to_numpy())
+            columns = self._positions(self._day_columns, self.days, cells['day'].to_numpy())
+            self._ensure_capacity()
+            self.modal[rows, columns] = cells['modal'].to_numpy()
+            self.low[rows, columns] = cells['low'].to_numpy()
+            self.high[rows, columns] = cells['high'].to_numpy()
+        return len(cells)
+    
+    def slice(self, markets: Optional[List[str]] = None, start: Optional[datetime] = None,
+              end: Optional[datetime] = None) -> Tuple[List[str], np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Copy of the selected markets and date range, columns in date order"""
+        with self._lock:
+            days = np.array(self.days, dtype=np.int64)
+            columns = np.argsort(days, kind='stable')
+            if start is not None:
+                columns = columns[days[columns] >= np.datetime64(start, 'D').astype(np.int64)]
+            if end is not None:
+                columns = columns[days[columns] <= np.datetime64(end, 'D').astype(np.int64)]
+            
+            if markets is None:
+                rows = np.arange(len(self.markets))
+            else:
+                rows = np.array([self._market_rows[m] for m in markets if m in self._market_rows], dtype=np.intp)
+            
+            grid = np.ix_(rows, columns)
+            return ([self.markets[r] for r in rows], days[columns],
+                    self.modal[grid], self.low[grid], self.high[grid])
+    
+    def heatmap_matrix(self, markets: Optional[List[str]] = None, start: Optional[datetime] = None,
+                       end: Optional[datetime] = None, title: str = "Market Price Heatmap") -> Dict:
+        """Market x date modal-price matrix in the format=data heatmap layout"""
+        names, days, modal, _, _ = self.slice(markets, start, end)
+        # Drop markets and dates without any observation in the window
+        rows = ~np.isnan(modal).all(axis=1)
+        columns = ~np.isnan(modal).all(axis=0)
+        return {
+            "type": "heatmap",
+            "title": title,
+            "rows": [name for name, keep in zip(names, rows) if keep],
+            "columns": np.datetime_as_string(days[columns].astype('datetime64[D]')).tolist(),
+            "values": [_round_list(row) for row in modal[np.ix_(rows, columns)]]
+        }
+    
+    def metrics(self, markets: Optional[List[str]] = None, start: Optional[datetime] = None,
+                end: Optional[datetime] = None) -> Dict:
+        """Price stability, market efficiency and seasonal impact over a slice of the cube"""
+        metrics = {
+            "price_stability": 0.5,
+            "supply_consistency": 0.5,
+            "market_efficiency": 0.5,
+            "seasonal_impact": 0.5
+        }
+        _, days, modal, low, high = self.slice(markets, start, end)
+        observed = ~np.isnan(modal)
+        if not observed.any():
+            return metrics
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_price = np.nanmean(modal)
+            if observed.sum() > 1:
+                # Price stability - lower volatility means higher stability
+                price_volatility = np.nanstd(modal, ddof=1) / mean_price
+                metrics["price_stability"] = float(max(0, min(1, 1 - price_volatility)))
+            
+            # Market efficiency - lower spread between min and max prices indicates efficiency
+            if not np.isnan(high).all() and not np.isnan(low).all():
+                price_spread = (np.nanmax(high) - np.nanmin(low)) / mean_price
+                metrics["market_efficiency"] = float(max(0, min(1, 1 - price_spread)))
+            
+            # Seasonal impact - variation of calendar-month mean prices
+            months = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64) % 12
+            month_sums = np.bincount(months, weights=np.where(observed, modal, 0).sum(axis=0), minlength=12)
+            month_counts = np.bincount(months, weights=observed.sum(axis=0), minlength=12)
+            month_avg = month_sums[month_counts > 0] / month_counts[month_counts > 0]
+            if len(month_avg) > 1:
+                month_variation = month_avg.std(ddof=1) / month_avg.mean()
+                metrics["seasonal_impact"] = float(max(0, min(1, month_variation)))
+        
+        return metrics
+
+class PriceCubeStore:
+    """Per-commodity price cubes loaded from the history store and kept current on every ingest"""
+    def __init__(self, store: PriceHistoryStore):
+        self.store = store
+        self._cubes = {}
+        self._lock = threading.Lock()
+        store.subscribe(self._on_ingest)
+    
+    def _on_ingest(self, touched: Dict[Tuple[str, str], set], rows: pd.DataFrame):
+        # Cubes not loaded yet pick the rows up from the store when first requested
+        with self._lock:
+            loaded = [c for c in rows['commodity'].unique() if c in self._cubes]
+        for commodity in loaded:
+            subset = rows[rows['commodity'] == commodity]
+            self._cubes[commodity].update(pd.DataFrame({
+                'Market': subset['market'],
+                'Date': subset['date'],
+                'Min Price': subset['min_price'],
+                'Max Price': subset['max_price'],
+                'Modal Price': subset['modal_price']
+            }))
+    
+    def get(self, commodity: str) -> PriceCube:
+        with self._lock:
+            cube = self._cubes.get(commodity)
+            if cube is None:
+                cube = PriceCube.from_frame(commodity, self.store.history(commodity))
+                self._cubes[commodity] = cube
+        return cube
+
+class MarketCatalog:
+    """
+    State -> district -> market -> commodity hierarchy of the upstream price feed.
+    
+    Built from the records every market fetch sees plus a paged upstream sync, persisted
+    next to the price history and served from memory as pre-serialized JSON with a
+    content ETag. Districts from STATES_DATA are always included so the dropdowns never
+    shrink while the catalog fills up.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS market_catalog (
+            state TEXT NOT NULL,
+            district TEXT NOT NULL,
+            market TEXT NOT NULL,
+            commodity TEXT NOT NULL,
+            PRIMARY KEY (state, district, market, commodity)
+        ) WITHOUT ROWID;
+    """
+    
+    def __init__(self, path: str = PRICE_HISTORY_DB):
+        self.path = path
+        self._entries = None  # set of (state, district, market, commodity), loaded on first use
+        self._bodies = {}
+        self._etags = {}
+        self._lock = threading.Lock()
+        self._sync_thread = None
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.executescript(self.SCHEMA)
+        return conn
+    
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._entries is not None:
+                return
+            try:
+                with closing(self._connect()) as conn:
+                    self._entries = set(conn.execute(
+                        "SELECT state, district, market, commodity FROM market_catalog"
+                    ).fetchall())
+            except sqlite3.Error as e:
+                logger.error(f"Error loading market catalog: {str(e)}")
+                self._entries = set()
+            self._rebuild()
+    
+    def _rebuild(self):
+        """Re-serialize both response variants (caller holds the lock)"""
+        hierarchy = {}
+        for state, district, market, commodity in self._entries:
+            hierarchy.setdefault(state, {}).setdefault(district, {}).setdefault(market, set()).add(commodity)
+        
+        states = {state: set(districts) for state, districts in STATES_DATA.items()}
+        for state, districts in hierarchy.items():
+            states.setdefault(state, set()).update(districts)
+        
+        payloads = {
+            "states": {"states": {state: sorted(districts) for state, districts in sorted(states.items())}},
+            "full": {
+                "states": {state: sorted(districts) for state, districts in sorted(states.items())},
+                "hierarchy": {
+                    state: {
+                        district: {market: sorted(commodities) for market, commodities in sorted(markets.items())}
+                        for district, markets in sorted(districts.items())
+                    }
+                    for state, districts in sorted(hierarchy.items())
+                }
+            }
+        }
+        for variant, payload in payloads.items():
+            body = json.dumps({"status": "success", "data": payload}).encode('utf-8')
+            self._bodies[variant] = body
+            self._etags[variant] = hashlib.sha1(body).hexdigest()
+    
+    def observe(self, records: List[Dict], rebuild: bool = True) -> int:
+        """
+        Add the (state, district, market, commodity) combinations seen in upstream records.
+        
+        The SQLite write happens outside the lock so readers of /api/states never wait
+        on it; with rebuild=False the serialized responses are left for the caller to
+        rebuild once after a batch of observations.
+        """
+        self._ensure_loaded()
+        seen = {
+            (str(r.get("state", "")).strip(), str(r.get("district", "")).strip(),
+             str(r.get("market", "")).strip(), str(r.get("commodity", "")).strip())
+            for r in records
+        }
+        with self._lock:
+            new_entries = {entry for entry in seen if all(entry)} - self._entries
+        if not new_entries:
+            return 0
+        # INSERT OR IGNORE keeps concurrent observers of the same entries harmless
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO market_catalog (state, district, market, commodity) VALUES (?, ?, ?, ?)",
+                new_entries
+            )
+        with self._lock:
+            new_entries -= self._entries
+            self._entries |= new_entries
+            if new_entries and rebuild:
+                self._rebuild()
+        return len(new_entries)
+    
+    def sync(self, max_pages: int = CATALOG_MAX_PAGES) -> int:
+        """Page through the upstream feed and add every combination found"""
+        added = 0
+        try:
+            for records in fetch_market_catalog_pages(max_pages):
+                added += self.observe(records, rebuild=False)
+        finally:
+            if added:
+                with self._lock:
+                    self._rebuild()
+        logger.info(f"Market catalog sync added {added} entries")
+        return added
+    
+    def _sync_loop(self):
+        while True:
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error(f"Error syncing market catalog: {str(e)}")
+            time.sleep(CATALOG_SYNC_INTERVAL)
+    
+    def schedule_sync(self):
+        """Start the background sync thread in the serving process (idempotent)"""
+        with self._lock:
+            if self._sync_thread is None:
+                self._sync_thread = threading.Thread(target=self._sync_loop, name="market-catalog", daemon=True)
+                self._sync_thread.start()
+    
+    def states(self) -> Dict[str, List[str]]:
+        self._ensure_loaded()
+        with self._lock:
+            return json.loads(self._bodies["states"])["data"]["states"]
+    
+    def markets(self, state: str, district: str, commodity: Optional[str] = None) -> List[str]:
+        """Markets seen in a district (case-insensitive), optionally trading one commodity"""
+        self._ensure_loaded()
+        state, district = state.strip().casefold(), district.strip().casefold()
+        commodity = commodity.strip().casefold() if commodity else None
+        with self._lock:
+            return sorted({
+                m for s, d, m, c in self._entries
+                if s.casefold() == state and d.casefold() == district
+                and (commodity is None or c.casefold() == commodity)
+            })
+    
+    def response(self, variant: str = "states") -> Tuple[bytes, str]:
+        """Serialized /api/states body and its ETag"""
+        self._ensure_loaded()
+        with self._lock:
+            return self._bodies[variant], self._etags[variant]
+
+price_history = PriceHistoryStore()
+seasonal_index_cache = SeasonalIndexCache(price_history)
+price_cubes = PriceCubeStore(price_history)
+market_catalog = MarketCatalog()
 
 # Validation and Analysis
-def validate_market_data(mandi_data: pd.DataFrame) -> pd.DataFrame:
-    """Validate and clean market data"""
+PRICE_COLUMNS = ["Min Price", "Modal Price", "Max Price"]
+OUTLIER_RULES = ["outlier_min_price", "outlier_modal_price", "outlier_max_price"]
+
+def _price_matrix(mandi_data: pd.DataFrame) -> np.ndarray:
+    """Return the price columns as an (n, 3) float matrix, coercing invalid values to NaN"""
+    try:
+        return mandi_data[PRICE_COLUMNS].to_numpy(dtype=np.float64)
+    except (ValueError, TypeError):
+        return mandi_data[PRICE_COLUMNS].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+
+def _iqr_bounds(prices: np.ndarray, codes: np.ndarray, n_groups: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Compute per-group IQR fences for every price column, shaped (n_groups, 3)"""
+    if n_groups == 1:
+        if len(prices) == 0:
+            q1 = q3 = np.full((1, len(PRICE_COLUMNS)), np.nan)
+        else:
+            q1, q3 = np.percentile(prices, [25, 75], axis=0)
+            q1, q3 = q1[np.newaxis, :], q3[np.newaxis, :]
+    else:
+        grouped = pd.DataFrame(prices).groupby(codes)
+        q1 = grouped.quantile(0.25).reindex(range(n_groups)).to_numpy()
+        q3 = grouped.quantile(0.75).reindex(range(n_groups)).to_numpy()
+    
+    iqr = q3 - q1
+    return q1 - 1.5 * iqr, q3 + 1.5 * iqr
+
+def compute_validation_masks(prices: np.ndarray, codes: Optional[np.ndarray] = None,
+                             n_groups: int = 1) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """
+    Evaluate every validation rule over a price matrix in one pass.
+    
+    Quantiles are computed once (per group) on the consistent rows, and all rules are
+    combined into a single boolean mask. Returns the mask of accepted rows and a mask of
+    rejected rows for each rule.
+    """
+    if codes is None:
+        codes = np.zeros(len(prices), dtype=np.intp)
+    
+    finite = np.isfinite(prices).all(axis=1)
+    with np.errstate(invalid='ignore'):
+        ordered = (prices[:, 0] <= prices[:, 1]) & (prices[:, 1] <= prices[:, 2])
+    consistent = finite & ordered
+    
+    lower, upper = _iqr_bounds(prices[consistent], codes[consistent], n_groups)
+    with np.errstate(invalid='ignore'):
+        within = (prices >= lower[codes]) & (prices <= upper[codes])
+    
+    rule_masks = {
+        "invalid_price": ~finite,
+        "inconsistent": finite & ~ordered
+    }
+    for i, rule in enumerate(OUTLIER_RULES):
+        rule_masks[rule] = consistent & ~within[:, i]
+    
+    accepted = consistent & within.all(axis=1)
+    return accepted, rule_masks
+
+def _rejection_report(accepted: np.ndarray, rule_masks: Dict[str, np.ndarray]) -> Dict:
+    """Summarize validation masks into accepted/rejected counts"""
+    return {
+        "total": int(len(accepted)),
+        "accepted": int(accepted.sum()),
+        "rejected": {rule: int(mask.sum()) for rule, mask in rule_masks.items()}
+    }
+
+def validate_market_data_with_report(mandi_data: pd.DataFrame, group_by: Optional[str] = None) -> Tuple[pd.DataFrame, Dict]:
+    """
+    Validate and clean market data, reporting how many rows each rule rejected.
+    
+    When group_by names a column (e.g. "Market" or "Commodity"), outlier fences are
+    computed per group, which allows bulk validation of multi-market price data.
+    """
     if mandi_data.empty:
-        return pd.DataFrame()
+        return pd.DataFrame(), {"total": 0, "accepted": 0, "rejected": {}}
     
+    missing_columns = [col for col in PRICE_COLUMNS if col not in mandi_data.columns]
+    if missing_columns or (group_by and group_by not in mandi_data.columns):
+        logger.error(f"Error validating market data: missing columns {missing_columns or [group_by]}")
+        return pd.DataFrame(), {"total": len(mandi_data), "accepted": 0, "rejected": {}}
+    
+    prices = _price_matrix(mandi_data)
+    
+    if group_by:
+        codes, groups = pd.factorize(mandi_data[group_by], use_na_sentinel=False)
+        n_groups = len(groups)
+    else:
+        codes, groups, n_groups = None, None, 1
+    
+    accepted, rule_masks = compute_validation_masks(prices, codes, n_groups)
+    
+    validated = mandi_data.loc[accepted].copy()
+    validated[PRICE_COLUMNS] = prices[accepted]
+    
+    report = _rejection_report(accepted, rule_masks)
+    if group_by:
+        counts = {
+            "total": np.bincount(codes, minlength=n_groups),
+            "accepted": np.bincount(codes, weights=accepted, minlength=n_groups)
+        }
+        rule_counts = {
+            rule: np.bincount(codes, weights=mask, minlength=n_groups)
+            for rule, mask in rule_masks.items()
+        }
+        report["groups"] = {
+            str(group): {
+                "total": int(counts["total"][i]),
+                "accepted": int(counts["accepted"][i]),
+                "rejected": {rule: int(values[i]) for rule, values in rule_counts.items()}
+            }
+            for i, group in enumerate(groups)
+        }
+    
+    return validated, report
+
+def validate_market_data(mandi_data: pd.DataFrame) -> pd.DataFrame:
+    """Validate and clean market data"""
     try:
-        # Convert price columns to numeric, removing any invalid values
-        price_cols = ["Min Price", "Modal Price", "Max Price"]
-        for col in price_cols:
-            if col in mandi_data.columns:
-                mandi_data[col] = pd.to_numeric(mandi_data[col], errors='coerce')
-        
-        # Remove rows with invalid prices
-        mandi_data = mandi_data.dropna(subset=price_cols)
-        
-        # Ensure price consistency (min ≤ modal ≤ max)
-        mandi_data = mandi_data[
-            (mandi_data["Min Price"] <= mandi_data["Modal Price"]) &
-            (mandi_data["Modal Price"] <= mandi_data["Max Price"])
-        ]
-        
-        # Remove extreme outliers (using IQR method)
-        for col in price_cols:
-            Q1 = mandi_data[col].quantile(0.25)
-            Q3 = mandi_data[col].quantile(0.75)
-            IQR = Q3 - Q1
-            mandi_data = mandi_data[
-                (mandi_data[col] >= Q1 - 1.5 * IQR) &
-                (mandi_data[col] <= Q3 + 1.5 * IQR)
-            ]
-        
-        return mandi_data
+        validated, report = validate_market_data_with_report(mandi_data)
+        if report["accepted"] < report["total"]:
+            logger.debug(f"Market data validation: {report}")
+        return validated
         
     except Exception as e:
         logger.error(f"Error validating market data: {str(e)}")
@@ -343,87 +1452,186 @@ def analyze_market_insights(mandi_data: pd.DataFrame) -> Dict:
 
 def calculate_market_metrics(market_data: pd.DataFrame) -> Dict:
     """Calculate advanced market metrics"""
-    metrics = {
-        "price_stability": 0.5,
-        "supply_consistency": 0.5,
-        "market_efficiency": 0.5,
-        "seasonal_impact": 0.5
-    }
+    if market_data.empty or "Modal Price" not in market_data.columns or "Date" not in market_data.columns:
+        return {
+            "price_stability": 0.5,
+            "supply_consistency": 0.5,
+            "market_efficiency": 0.5,
+            "seasonal_impact": 0.5
+        }
     
-    if not market_data.empty and "Modal Price" in market_data.columns:
-        # Price stability - lower volatility means higher stability
-        price_volatility = market_data["Modal Price"].std() / market_data["Modal Price"].mean()
-        metrics["price_stability"] = max(0, min(1, 1 - price_volatility))
-        
-        # Market efficiency - lower spread between min and max prices indicates efficiency
-        price_spread = (market_data["Max Price"].max() - market_data["Min Price"].min()) / market_data["Modal Price"].mean()
-        metrics["market_efficiency"] = max(0, min(1, 1 - price_spread))
-        
-        # Try to calculate seasonal impact if date column is available
-        if "Date" in market_data.columns:
-            try:
-                market_data["Date"] = pd.to_datetime(market_data["Date"])
-                market_data["month"] = market_data["Date"].dt.month
-                month_avg = market_data.groupby("month")["Modal Price"].mean()
-                month_variation = month_avg.std() / month_avg.mean()
-                metrics["seasonal_impact"] = max(0, min(1, month_variation))
-            except:
-                pass
-        
-        # Supply consistency - if arrival columns are available
-        if "arrival" in market_data.columns or any("arrival" in col.lower() for col in market_data.columns):
-            arrival_col = next((col for col in market_data.columns if "arrival" in col.lower()), None)
-            if arrival_col:
-                arrival_volatility = market_data[arrival_col].std() / market_data[arrival_col].mean()
-                metrics["supply_consistency"] = max(0, min(1, 1 - arrival_volatility))
+    # Reductions over a transient market x date cube (the input frame is not modified)
+    metrics = PriceCube.from_frame("", market_data).metrics()
+    
+    # Supply consistency - if arrival columns are available
+    arrival_col = next((col for col in market_data.columns if "arrival" in col.lower()), None)
+    if arrival_col:
+        arrivals = pd.to_numeric(market_data[arrival_col], errors="coerce")
+        if arrivals.notna().any():
+            arrival_volatility = arrivals.std() / arrivals.mean()
+            metrics["supply_consistency"] = max(0, min(1, 1 - arrival_volatility))
     
     return metrics
 
-def predict_price_trends(market_data: pd.DataFrame) -> pd.DataFrame:
-    """Predict price trends for next 30 days"""
+class PriceForecaster:
+    """
+    Damped-trend Holt exponential smoothing for irregularly spaced daily prices.
+    
+    Smoothing weights are scaled by the gap between observations (1 - (1 - alpha) ** gap), so
+    missing days need no imputation. Smoothing parameters are chosen by one-step-ahead error
+    over a grid evaluated in a single vectorized pass. Fitted state is cached per series; new
+    observations update it in O(new points) and parameters are re-estimated only every
+    FORECAST_REFIT_INTERVAL observations or when older data is backfilled.
+    """
+    ALPHAS = np.array([0.05, 0.1, 0.2, 0.3, 0.5, 0.7, 0.9])
+    BETAS = np.array([0.01, 0.05, 0.1, 0.2])
+    
+    def __init__(self, max_entries: int = FORECAST_CACHE_SIZE, damping: float = FORECAST_DAMPING):
+        self.max_entries = max_entries
+        self.damping = damping
+        self._states = OrderedDict()  # series key -> fitted state, least recently used first
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def daily_series(market_data: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+        """Mean modal price per day as (days since epoch, price) arrays"""
+        dates = parse_market_dates(market_data["Date"])
+        prices = pd.to_numeric(market_data["Modal Price"], errors="coerce")
+        daily = prices[dates.notna() & prices.notna()].groupby(dates.dt.normalize()).mean()
+        days = daily.index.to_numpy().astype('datetime64[D]').astype(np.float64)
+        return days, daily.to_numpy(dtype=np.float64)
+    
+    def _damped_sum(self, gaps: np.ndarray) -> np.ndarray:
+        """Sum of phi^1..phi^gap: the trend multiplier over a gap of `gap` days"""
+        return self.damping * (1 - self.damping ** gaps) / (1 - self.damping)
+    
+    def _smooth(self, days: np.ndarray, prices: np.ndarray, alpha: np.ndarray, beta: np.ndarray,
+                level: np.ndarray, trend: np.ndarray):
+        """Run the recursion over new observations for every (alpha, beta) pair at once"""
+        sse = np.zeros_like(level)
+        for gap, price in zip(np.diff(days), prices[1:]):
+            forecast = level + trend * self._damped_sum(gap)
+            error = price - forecast
+            a = 1 - (1 - alpha) ** gap
+            b = 1 - (1 - beta) ** gap
+            sse += error ** 2
+            level = forecast + a * error
+            trend = trend * self.damping ** gap + a * b * error / gap
+        return level, trend, sse
+    
+    def fit(self, days: np.ndarray, prices: np.ndarray) -> Dict:
+        """Estimate parameters and state from scratch"""
+        if len(prices) < 3:
+            # Too short for a trend: flat forecast with a spread-based error
+            spread = np.std(prices) if len(prices) > 1 else 0.05 * prices[-1]
+            return {"alpha": 0.5, "beta": 0.0, "level": float(prices[-1]), "trend": 0.0,
+                    "sse": float(spread ** 2), "n_errors": 1, "first_day": float(days[0]), "last_day": float(days[-1]),
+                    "since_refit": 0, "method": "flat"}
+        
+        alpha, beta = (grid.ravel() for grid in np.meshgrid(self.ALPHAS, self.BETAS))
+        trend0 = (prices[1] - prices[0]) / (days[1] - days[0])
+        level, trend, sse = self._smooth(days, prices, alpha, beta,
+                                         np.full(alpha.shape, prices[0]), np.full(alpha.shape, trend0))
+        best = int(np.argmin(sse))
+        return {"alpha": float(alpha[best]), "beta": float(beta[best]), "level": float(level[best]),
+                "trend": float(trend[best]), "sse": float(sse[best]), "n_errors": len(prices) - 1,
+                "first_day": float(days[0]), "last_day": float(days[-1]), "since_refit": 0, "method": "holt_damped"}
+    
+    def update(self, state: Dict, days: np.ndarray, prices: np.ndarray) -> Dict:
+        """Absorb observations newer than the state without re-estimating parameters"""
+        days = np.concatenate([[state["last_day"]], days])
+        prices = np.concatenate([[state["level"]], prices])
+        level, trend, sse = self._smooth(days, prices, np.array([state["alpha"]]), np.array([state["beta"]]),
+                                         np.array([state["level"]]), np.array([state["trend"]]))
+        return dict(state, level=float(level[0]), trend=float(trend[0]), sse=state["sse"] + float(sse[0]),
+                    n_errors=state["n_errors"] + len(prices) - 1, last_day=float(days[-1]),
+                    since_refit=state["since_refit"] + len(prices) - 1)
+    
+    def state_for(self, key, days: np.ndarray, prices: np.ndarray) -> Dict:
+        """Cached state for a series, updated incrementally with any newer observations"""
+        with self._lock:
+            state = self._states.get(key) if key is not None else None
+        
+        # Refit on backfilled history, short series and periodically; otherwise only absorb newer days
+        if (state is None or state["method"] == "flat" or days[0] < state["first_day"]
+                or state["since_refit"] >= FORECAST_REFIT_INTERVAL):
+            state = self.fit(days, prices)
+        else:
+            newer = days > state["last_day"]
+            if newer.any():
+                state = self.update(state, days[newer], prices[newer])
+        
+        if key is not None:
+            with self._lock:
+                self._states[key] = state
+                self._states.move_to_end(key)
+                while len(self._states) > self.max_entries:
+                    self._states.popitem(last=False)
+        return state
+    
+    def forecast(self, state: Dict, horizon: int = FORECAST_HORIZON_DAYS, z: float = 1.96) -> pd.DataFrame:
+        """Point forecasts and prediction intervals for the next `horizon` days"""
+        steps = np.arange(1, horizon + 1, dtype=np.float64)
+        predicted = state["level"] + state["trend"] * self._damped_sum(steps)
+        
+        # Holt h-step variance: sigma^2 * (1 + sum_{j<h} (alpha * (1 + beta * damped_sum(j)))^2)
+        sigma2 = state["sse"] / max(1, state["n_errors"])
+        weights = (state["alpha"] * (1 + state["beta"] * self._damped_sum(steps[:-1]))) ** 2
+        variance = sigma2 * (1 + np.concatenate([[0.0], np.cumsum(weights)]))
+        margin = z * np.sqrt(variance)
+        
+        last_date = np.datetime64(int(state["last_day"]), 'D')
+        return pd.DataFrame({
+            "arrival_date": pd.to_datetime(last_date + steps.astype(np.int64)),
+            "predicted_price": predicted,
+            "confidence_upper": predicted + margin,
+            "confidence_lower": np.maximum(0, predicted - margin)
+        })
+
+price_forecaster = PriceForecaster()
+
+def predict_price_trends(market_data: pd.DataFrame, series_key=None,
+                         horizon: int = FORECAST_HORIZON_DAYS) -> pd.DataFrame:
+    """
+    Predict price trends for the next `horizon` days.
+    
+    With a series_key the fitted model is cached and refreshed incrementally on later calls.
+    """
     if market_data.empty or "Modal Price" not in market_data.columns or "Date" not in market_data.columns:
         return None
     
     try:
-        # Convert dates
-        market_data["Date"] = pd.to_datetime(market_data["Date"])
-        market_data = market_data.sort_values("Date")
-        
-        # Simple linear prediction - in production, you'd use a more sophisticated model
-        X = np.array(range(len(market_data))).reshape(-1, 1)
-        y = market_data["Modal Price"].values
-        
-        # Linear regression
-        slope, intercept, r_value, p_value, std_err = stats.linregress(
-            range(len(market_data)), market_data["Modal Price"]
-        )
-        
-        # Generate future dates
-        last_date = market_data["Date"].max()
-        future_dates = [last_date + timedelta(days=i) for i in range(1, 31)]
-        
-        # Predict prices
-        future_indices = range(len(market_data), len(market_data) + 30)
-        predicted_prices = [slope * x + intercept for x in future_indices]
-        
-        # Generate confidence intervals (simple approach)
-        confidence_margin = std_err * 1.96  # 95% confidence interval
-        confidence_upper = [p + confidence_margin for p in predicted_prices]
-        confidence_lower = [max(0, p - confidence_margin) for p in predicted_prices]
-        
-        # Create prediction dataframe
-        predictions = pd.DataFrame({
-            "arrival_date": future_dates,
-            "predicted_price": predicted_prices,
-            "confidence_upper": confidence_upper,
-            "confidence_lower": confidence_lower
-        })
+        days, prices = PriceForecaster.daily_series(market_data)
+        if len(prices) == 0:
+            return None
         
-        return predictions
+        state = price_forecaster.state_for(series_key, days, prices)
+        return price_forecaster.forecast(state, horizon)
     except Exception as e:
         logger.error(f"Error predicting prices: {str(e)}")
         return None
 
+def summarize_commodity_prices(commodity_stats: Dict[str, Dict]) -> Dict:
+    """Combine per-commodity price statistics into a single overview"""
+    priced = {c: s for c, s in commodity_stats.items() if s and s.get("avg_price") is not None}
+    if not priced:
+        return {"commodity_count": 0}
+
+    avg_prices = {c: float(s["avg_price"]) for c, s in priced.items()}
+    volatility = {
+        c: float(s.get("price_volatility", 0) or 0) / avg_prices[c] if avg_prices[c] else 0.0
+        for c, s in priced.items()
+    }
+
+    return {
+        "commodity_count": len(priced),
+        "avg_price": float(np.mean(list(avg_prices.values()))),
+        "cheapest_commodity": min(avg_prices, key=avg_prices.get),
+        "most_expensive_commodity": max(avg_prices, key=avg_prices.get),
+        "most_volatile_commodity": max(volatility, key=volatility.get),
+        "market_count": int(sum(s.get("market_count", 0) for s in priced.values()))
+    }
+
 def analyze_market_health() -> Dict:
     """Analyze market health indicators"""
     # In production, this would use real market data
@@ -519,65 +1727,622 @@ def calculate_cost_savings(current: float, optimal: Dict,
     optimal_cost = optimal['min_stock'] * price_data['Modal Price'].mean()
     return max(0, (current_cost - optimal_cost) / current_cost * 100)
 
+# Stock optimizer features
+def recent_price_features(price_history: pd.DataFrame, by: str = 'Commodity', window: int = 7) -> pd.DataFrame:
+    """Mean/std/max/min of the last `window` modal prices for every commodity, in one groupby"""
+    columns = ['price_mean', 'price_std', 'price_max', 'price_min']
+    if price_history is None or price_history.empty or 'Modal Price' not in price_history.columns or by not in price_history.columns:
+        return pd.DataFrame(columns=columns)
+    
+    history = price_history
+    if 'Date' in history.columns:
+        history = history.assign(Date=pd.to_datetime(history['Date'], errors='coerce')).sort_values('Date')
+    
+    recent = history.groupby(by, sort=False).tail(window)
+    return recent.groupby(by)['Modal Price'].agg(
+        price_mean='mean', price_std='std', price_max='max', price_min='min'
+    )
+
+def build_optimizer_features(frame: pd.DataFrame) -> np.ndarray:
+    """Vectorized feature matrix for the stock optimizer, one row per item"""
+    def column(name):
+        default = OPTIMIZER_PROFILE_DEFAULTS.get(name, 0)
+        if name in frame.columns:
+            return frame[name].where(frame[name].notna(), default)
+        return pd.Series(default, index=frame.index)
+    
+    features = np.zeros((len(frame), len(OPTIMIZER_FEATURE_COLUMNS)), dtype=np.float64)
+    features[:, 0] = column('current_stock').astype(float)
+    features[:, 1] = column('storage_capacity').astype(float)
+    features[:, 2] = column('min_stock_level').astype(float)
+    features[:, 3] = column('lead_time_days').astype(float)
+    features[:, 4] = column('spoilage_rate').astype(float) / 100
+    features[:, 5] = column('is_weekend').astype(bool)
+    features[:, 6] = column('is_festival').astype(bool)
+    features[:, 7] = column('restaurant_type').map(RESTAURANT_TYPE_CODES).fillna(2)
+    features[:, 8] = column('storage_conditions').map(STORAGE_CONDITION_CODES).fillna(1)
+    for i, name in enumerate(['price_mean', 'price_std', 'price_max', 'price_min'], start=9):
+        if name in frame.columns:
+            features[:, i] = frame[name].astype(float).fillna(0)
+    
+    return features
+
+def heuristic_min_stock(features: np.ndarray) -> np.ndarray:
+    """Rule-based minimum stock used until a trained optimizer model is available"""
+    multiplier = np.where(features[:, 5] > 0, 1.2, 1.0) * np.where(features[:, 6] > 0, 1.5, 1.0)
+    type_multiplier = np.array([1.3, 0.8, 1.0, 0.9])[np.clip(features[:, 7].astype(int), 0, 3)]
+    spoilage_factor = np.maximum(0.7, 1.0 - features[:, 4])
+    return features[:, 2] * multiplier * type_multiplier * spoilage_factor
+
+def _is_fitted(model) -> bool:
+    return model is not None and hasattr(model, 'n_features_in_')
+
+# Image I/O helpers
+def open_image_upload(source, target_size: Optional[int] = None):
+    """
+    Open an uploaded image without copying the upload into a bytes object first.
+    
+    `source` may be a werkzeug FileStorage (read straight from its stream), raw bytes or a
+    base64 string / data URL. When `target_size` is given, JPEGs are decoded at a reduced
+    scale (draft mode) that still covers target_size on each side. Returns the RGB image and
+    the original (width, height).
+    """
+    if hasattr(source, 'stream'):
+        fp = source.stream
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        fp = BytesIO(source)
+    elif isinstance(source, str):
+        # Handle base64 encoded images, with or without the data URL prefix
+        fp = BytesIO(base64.b64decode(source[source.find(',') + 1:]))
+    else:
+        raise ValueError("Unsupported image input")
+    
+    image = Image.open(fp)
+    original_size = image.size
+    if target_size and image.format == 'JPEG':
+        image.draft('RGB', (target_size, target_size))
+    return image.convert('RGB'), original_size
+
+def scale_detections(detections: List[Dict], scale_x: float, scale_y: float) -> List[Dict]:
+    """Map detection boxes from a reduced decode back to original image pixels"""
+    if scale_x == 1 and scale_y == 1:
+        return detections
+    return [
+        dict(det, box=[int(round(det['box'][0] * scale_x)), int(round(det['box'][1] * scale_y)),
+                       int(round(det['box'][2] * scale_x)), int(round(det['box'][3] * scale_y))])
+        for det in detections
+    ]
+
+ANNOTATED_IMAGES = OrderedDict()
+annotated_images_lock = threading.Lock()
+
+def store_annotated_image(data: bytes) -> str:
+    """Keep an encoded annotated image for download and return its id"""
+    image_id = hashlib.sha1(data).hexdigest()
+    with annotated_images_lock:
+        ANNOTATED_IMAGES[image_id] = data
+        ANNOTATED_IMAGES.move_to_end(image_id)
+        while len(ANNOTATED_IMAGES) > ANNOTATED_IMAGE_CACHE_SIZE:
+            ANNOTATED_IMAGES.popitem(last=False)
+    return image_id
+
+# Object detection helpers
+def letterbox(image: np.ndarray, size: int = DETECTOR_INPUT_SIZE, fill: int = 114) -> Tuple[np.ndarray, float, int, int]:
+    """
+    Resize an HxWx3 image to fit a size x size square, keeping the aspect ratio, and pad the rest.
+    
+    Returns the padded image with the scale and (x, y) padding needed to map boxes back.
+    """
+    height, width = image.shape[:2]
+    scale = min(size / height, size / width)
+    new_width, new_height = int(round(width * scale)), int(round(height * scale))
+    
+    resized = image if (new_width, new_height) == (width, height) else \
+        cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    
+    pad_x, pad_y = (size - new_width) // 2, (size - new_height) // 2
+    canvas = np.full((size, size, 3), fill, dtype=np.uint8)
+    canvas[pad_y:pad_y + new_height, pad_x:pad_x + new_width] = resized
+    return canvas, scale, pad_x, pad_y
+
+def letterbox_batch(images: List[np.ndarray], size: int = DETECTOR_INPUT_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+    """Letterbox a list of RGB images into one float32 NCHW batch plus per-image (scale, pad_x, pad_y)"""
+    batch = np.empty((len(images), 3, size, size), dtype=np.float32)
+    transforms_ = np.empty((len(images), 3), dtype=np.float32)
+    for i, image in enumerate(images):
+        canvas, scale, pad_x, pad_y = letterbox(image, size)
+        np.multiply(canvas.transpose(2, 0, 1), 1.0 / 255, out=batch[i], casting='unsafe')
+        transforms_[i] = (scale, pad_x, pad_y)
+    return batch, transforms_
+
+def non_max_suppression(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """Greedy NMS over xyxy boxes; returns kept indices in descending score order"""
+    order = np.argsort(-scores)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = []
+    while order.size:
+        best = order[0]
+        keep.append(best)
+        rest = order[1:]
+        x1 = np.maximum(boxes[best, 0], boxes[rest, 0])
+        y1 = np.maximum(boxes[best, 1], boxes[rest, 1])
+        x2 = np.minimum(boxes[best, 2], boxes[rest, 2])
+        y2 = np.minimum(boxes[best, 3], boxes[rest, 3])
+        intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+        iou = intersection / (areas[best] + areas[rest] - intersection + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=np.intp)
+
+def decode_detections(output: np.ndarray, transform: np.ndarray, image_shape: Tuple[int, int],
+                      conf_threshold: float = DETECTOR_CONF_THRESHOLD,
+                      iou_threshold: float = DETECTOR_IOU_THRESHOLD) -> np.ndarray:
+    """
+    Decode one image's raw detector output into an array of [x1, y1, x2, y2, confidence, class].
+    
+    `output` is the YOLO-style (4 + num_classes, anchors) matrix (cx, cy, w, h, class scores);
+    the transposed layout is accepted too. Boxes are mapped back to original image pixels.
+    """
+    if output.shape[0] > output.shape[1]:
+        output = output.T
+    class_scores = output[4:]
+    class_ids = class_scores.argmax(axis=0)
+    confidences = class_scores[class_ids, np.arange(class_scores.shape[1])]
+    
+    candidates = confidences >= conf_threshold
+    if not candidates.any():
+        return np.empty((0, 6), dtype=np.float32)
+    cx, cy, w, h = output[:4, candidates]
+    confidences, class_ids = confidences[candidates], class_ids[candidates]
+    
+    scale, pad_x, pad_y = transform
+    boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+    boxes[:, [0, 2]] = (boxes[:, [0, 2]] - pad_x) / scale
+    boxes[:, [1, 3]] = (boxes[:, [1, 3]] - pad_y) / scale
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, image_shape[1])
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, image_shape[0])
+    
+    # Offset boxes per class so one NMS pass never suppresses across classes
+    offsets = class_ids[:, None] * (max(image_shape) + 1.0)
+    keep = non_max_suppression(boxes + offsets, confidences, iou_threshold)[:DETECTOR_MAX_DETECTIONS]
+    return np.column_stack([boxes[keep], confidences[keep], class_ids[keep]]).astype(np.float32)
+
+def count_detections(detections: List[Dict]) -> Dict:
+    """Group detections into {category: {'count', 'items': {item: count}}}"""
+    inventory_count = {}
+    for det in detections:
+        category = ITEM_CATEGORY.get(det['label'], 'Other')
+        entry = inventory_count.setdefault(category, {'count': 0, 'items': {}})
+        entry['items'][det['label']] = entry['items'].get(det['label'], 0) + 1
+        entry['count'] += 1
+    return inventory_count
+
 # Classes
+class ModelRegistry:
+    """
+    Process-wide store of trained models.
+    
+    Each model is loaded once (numpy weights memory-mapped where the file allows it) and
+    served from memory. A background watcher reloads a model when its file changes and
+    swaps the new version in atomically, so request handlers never touch the disk.
+    """
+    def __init__(self, poll_interval: float = MODEL_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._watcher = None
+    
+    def register(self, name: str, path: str, default_factory):
+        """Register a model file; default_factory builds a fallback bundle when the file is missing"""
+        with self._lock:
+            self._entries[name] = {
+                "path": path,
+                "default_factory": default_factory,
+                "bundle": None,
+                "version": None
+            }
+        self._reload(name)
+    
+    def get(self, name: str) -> Dict:
+        """Return the current model bundle for name (no disk I/O)"""
+        with self._lock:
+            return self._entries[name]["bundle"]
+    
+    def version(self, name: str) -> Optional[Tuple[int, int]]:
+        with self._lock:
+            return self._entries[name]["version"]
+    
+    def _file_version(self, path: str) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(path)
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+    
+    def _reload(self, name: str):
+        """Load the model file if it changed since the last load, then swap it in"""
+        with self._lock:
+            entry = self._entries[name]
+        
+        file_version = self._file_version(entry["path"])
+        if entry["bundle"] is not None and file_version == entry["version"]:
+            return
+        
+        bundle = None
+        if file_version is not None:
+            try:
+                bundle = joblib.load(entry["path"], mmap_mode='r')
+                logger.info(f"Loaded model '{name}' from {entry['path']}")
+            except Exception as e:
+                logger.error(f"Error loading model '{name}': {str(e)}")
+                if entry["bundle"] is not None:
+                    return
+        if bundle is None:
+            bundle = entry["default_factory"]()
+        
+        with self._lock:
+            entry["bundle"] = bundle
+            entry["version"] = file_version
+    
+    def publish(self, name: str, bundle: Dict):
+        """Persist a new model version atomically and make it current"""
+        with self._lock:
+            path = self._entries[name]["path"]
+        
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        joblib.dump(bundle, tmp_path)
+        os.replace(tmp_path, path)
+        
+        with self._lock:
+            self._entries[name]["bundle"] = bundle
+            self._entries[name]["version"] = self._file_version(path)
+    
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                names = list(self._entries)
+            for name in names:
+                try:
+                    self._reload(name)
+                except Exception as e:
+                    logger.error(f"Error refreshing model '{name}': {str(e)}")
+    
+    def start_watcher(self):
+        """Start the background thread that hot-swaps changed model files"""
+        if self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch, name="model-registry", daemon=True)
+            self._watcher.start()
+
+class SpoilageTracker:
+    """
+    Per-camera spoilage tracking.
+    
+    Each storage camera/shelf keeps its own background model, so the foreground share of a
+    new frame measures how much that shelf changed against its usual appearance. Frames are
+    downscaled before processing, per-camera state has a fixed size, and cameras that stop
+    sending frames are evicted. A camera whose frame size changes starts a new model.
+    """
+    def __init__(self, max_cameras: int = MAX_TRACKED_CAMERAS, idle_timeout: float = CAMERA_IDLE_TIMEOUT,
+                 frame_width: int = SPOILAGE_FRAME_WIDTH):
+        self.max_cameras = max_cameras
+        self.idle_timeout = idle_timeout
+        self.frame_width = frame_width
+        self._cameras = OrderedDict()  # camera_id -> state, least recently used first
+        self._lock = threading.Lock()
+    
+    def _evict_idle(self, now: float):
+        while self._cameras:
+            camera_id, state = next(iter(self._cameras.items()))
+            if now - state["last_seen"] < self.idle_timeout:
+                break
+            self._cameras.popitem(last=False)
+            logger.info(f"Evicted idle spoilage camera '{camera_id}'")
+    
+    def _camera(self, camera_id: str) -> Dict:
+        """Return the state for camera_id, creating it (and evicting old cameras) as needed"""
+        now = time.time()
+        with self._lock:
+            self._evict_idle(now)
+            state = self._cameras.get(camera_id)
+            if state is None:
+                state = {
+                    "model": None,  # created for the first frame's shape
+                    "shape": None,
+                    "lock": threading.Lock(),
+                    "frames": 0,
+                    "score": None,
+                    "smoothed": None
+                }
+                self._cameras[camera_id] = state
+                while len(self._cameras) > self.max_cameras:
+                    self._cameras.popitem(last=False)
+            else:
+                self._cameras.move_to_end(camera_id)
+            state["last_seen"] = now
+        return state
+    
+    def _prepare(self, frame) -> np.ndarray:
+        """Convert a frame to a downscaled RGB array"""
+        if hasattr(frame, 'convert'):
+            # PIL Image: let the JPEG decoder skip detail we are about to throw away
+            if hasattr(frame, 'draft'):
+                frame.draft('RGB', (self.frame_width, self.frame_width))
+            frame = np.asarray(frame.convert('RGB'))
+        elif not isinstance(frame, np.ndarray):
+            raise ValueError("Unsupported frame type")
+        
+        height, width = frame.shape[:2]
+        if width > self.frame_width:
+            new_height = max(1, int(round(height * self.frame_width / width)))
+            frame = cv2.resize(frame, (self.frame_width, new_height), interpolation=cv2.INTER_AREA)
+        return frame
+    
+    def update(self, camera_id: str, frame) -> Dict:
+        """Feed one frame for a camera and return its spoilage score and change since the last frame"""
+        small = self._prepare(frame)
+        state = self._camera(camera_id)
+        
+        # The background model is stateful, so frames for one camera are applied in order
+        with state["lock"]:
+            if state["shape"] != small.shape:
+                # MOG2 only accepts frames of the shape it was seeded with
+                if state["shape"] is not None:
+                    logger.info(f"Frame size of spoilage camera '{camera_id}' changed, resetting its model")
+                state.update(
+                    model=cv2.createBackgroundSubtractorMOG2(history=SPOILAGE_HISTORY, detectShadows=True),
+                    shape=small.shape, frames=0, score=None, smoothed=None
+                )
+            fg_mask = state["model"].apply(small)
+            if state["frames"] == 0:
+                score = 0.0  # The first frame only seeds the background model
+            else:
+                score = float(np.count_nonzero(fg_mask == 255)) / fg_mask.size  # Shadows (127) are ignored
+            previous = state["score"]
+            if state["smoothed"] is None:
+                state["smoothed"] = score
+            else:
+                state["smoothed"] = SPOILAGE_SMOOTHING * score + (1 - SPOILAGE_SMOOTHING) * state["smoothed"]
+            state["score"] = score
+            state["frames"] += 1
+            
+            return {
+                "camera_id": camera_id,
+                "frames": state["frames"],
+                "spoilage_score": score,
+                "delta": 0.0 if previous is None else score - previous,
+                "smoothed_score": state["smoothed"]
+            }
+    
+    def stateless_score(self, frame) -> float:
+        """
+        Spoilage score of a single frame with no background model: the share of dark or
+        brown pixels. Used when the caller has no camera to compare against.
+        """
+        small = self._prepare(frame)
+        if small.ndim == 2:
+            small = cv2.cvtColor(small, cv2.COLOR_GRAY2RGB)
+        hue, saturation, value = cv2.split(cv2.cvtColor(small[..., :3], cv2.COLOR_RGB2HSV))
+        dark = value < SPOILAGE_DARK_VALUE
+        brown = (hue >= SPOILAGE_BROWN_HUE[0]) & (hue <= SPOILAGE_BROWN_HUE[1]) & (saturation > 60) & (value < 160)
+        return float(np.count_nonzero(dark | brown)) / dark.size
+    
+    def update_many(self, camera_id: str, frames: List) -> List[Dict]:
+        """Feed a stream of frames for one camera in order"""
+        return [self.update(camera_id, frame) for frame in frames]
+    
+    def cameras(self) -> List[Dict]:
+        """Summary of the cameras currently tracked"""
+        with self._lock:
+            self._evict_idle(time.time())
+            return [
+                {
+                    "camera_id": camera_id,
+                    "frames": state["frames"],
+                    "spoilage_score": state["score"],
+                    "smoothed_score": state["smoothed"],
+                    "last_seen": datetime.fromtimestamp(state["last_seen"]).isoformat()
+                }
+                for camera_id, state in self._cameras.items()
+            ]
+    
+    def reset(self, camera_id: str) -> bool:
+        """Drop a camera's background model"""
+        with self._lock:
+            return self._cameras.pop(camera_id, None) is not None
+
 class SmartInventoryPredictor:
     """AI-powered inventory prediction system with waste prediction and spoilage risk assessment"""
-    def __init__(self):
+    def __init__(self, registry: Optional[ModelRegistry] = None,
+                 spoilage_tracker: Optional[SpoilageTracker] = None):
         self.min_stock = 10
         self.storage_capacity = 100
-        self.waste_predictor = RandomForestRegressor(n_estimators=100, random_state=42)
-        self.stock_optimizer = RandomForestRegressor(n_estimators=100, random_state=42)
-        self.scaler = StandardScaler()
-        if CV_AVAILABLE:
-            self.spoilage_model = cv2.createBackgroundSubtractorMOG2()
-        else:
-            self.spoilage_model = None
-
+        self.registry = registry
+        if registry is None:
+            bundle = self.default_model_bundle()
+            self.waste_predictor = bundle['waste_predictor']
+            self.stock_optimizer = bundle['stock_optimizer']
+            self.scaler = bundle['scaler']
+        # Background models are created per camera on its first frame
+        self.spoilage_tracker = spoilage_tracker or SpoilageTracker()
+    
+    @staticmethod
+    def default_model_bundle() -> Dict:
+        """Untrained model bundle used until a trained one is available"""
+        return {
+            'waste_predictor': RandomForestRegressor(n_estimators=100, random_state=42),
+            'stock_optimizer': RandomForestRegressor(n_estimators=100, random_state=42),
+            'scaler': StandardScaler()
+        }
+    
+    def _current_models(self) -> Dict:
+        """Models and scaler to use for this call, taken together from one registry version"""
+        if self.registry is not None:
+            return self.registry.get('inventory_predictor')
+        return {
+            'waste_predictor': self.waste_predictor,
+            'stock_optimizer': self.stock_optimizer,
+            'scaler': self.scaler
+        }
+    
+    @staticmethod
+    def _days_ratio(days_in_stock: np.ndarray, shelf_life: np.ndarray) -> np.ndarray:
+        """Fraction of shelf life used; items without a positive shelf life count as expired"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(shelf_life > 0, days_in_stock / shelf_life, np.inf)
+    
+    @staticmethod
+    def _scaled_features(models: Dict, *columns: np.ndarray) -> np.ndarray:
+        features = np.column_stack(columns)
+        scaler = models.get('scaler')
+        return scaler.transform(features) if _is_fitted(scaler) else features
+    
+    def predict_waste_risk_batch(self, days_in_stock: np.ndarray, temperature: np.ndarray,
+                                 humidity: np.ndarray, shelf_life: np.ndarray,
+                                 quantity: Optional[np.ndarray] = None) -> np.ndarray:
+        """Predict waste risk for many items at once"""
+        models = self._current_models()
+        if quantity is not None and _is_fitted(models.get('waste_predictor')):
+            features = self._scaled_features(models, days_in_stock, temperature, humidity, shelf_life, quantity)
+            return np.clip(models['waste_predictor'].predict(features), 0.0, 1.0)
+        
+        # Heuristic fallback until a trained waste model is published
+        days_ratio = self._days_ratio(days_in_stock, shelf_life)
+        temp_factor = temperature / 20  # Normalize to 1 at 20C
+        humidity_factor = humidity / 50  # Normalize to 1 at 50%
+        
+        return np.minimum(1.0, days_ratio * 0.7 + temp_factor * 0.2 + humidity_factor * 0.1)
+    
     def predict_waste_risk(self, item_data: Dict) -> float:
         """Predict risk of waste for an item"""
-        features = np.array([
-            item_data.get('days_in_stock', 0),
-            item_data.get('temperature', 20),
-            item_data.get('humidity', 50),
-            item_data.get('shelf_life', 7),
-            item_data.get('current_quantity', 0)
-        ]).reshape(1, -1)
-        
-        # In a real system, you would use the trained model
-        # For demo, we'll use a simple heuristic
-        days_ratio = item_data.get('days_in_stock', 0) / item_data.get('shelf_life', 7)
-        temp_factor = item_data.get('temperature', 20) / 20  # Normalize to 1 at 20C
-        humidity_factor = item_data.get('humidity', 50) / 50  # Normalize to 1 at 50%
-        
-        waste_risk = min(1.0, days_ratio * 0.7 + temp_factor * 0.2 + humidity_factor * 0.1)
-        return float(waste_risk)
+        waste_risk = self.predict_waste_risk_batch(
+            np.array([item_data.get('days_in_stock', 0)], dtype=np.float64),
+            np.array([item_data.get('temperature', 20)], dtype=np.float64),
+            np.array([item_data.get('humidity', 50)], dtype=np.float64),
+            np.array([item_data.get('shelf_life', 7)], dtype=np.float64),
+            np.array([item_data.get('current_quantity', 0)], dtype=np.float64)
+        )
+        return float(waste_risk[0])
+    
+    def score_items_batch(self, days_in_stock: np.ndarray, temperature: np.ndarray, humidity: np.ndarray,
+                          shelf_life: np.ndarray, quantity: np.ndarray,
+                          spoilage_risk: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+        """
+        Score waste risk, spoilage risk, stock levels and actions for a whole item list in one
+        vectorized pass. Without image-based spoilage scores, spoilage risk is estimated from stock age.
+        """
+        waste_risk = self.predict_waste_risk_batch(days_in_stock, temperature, humidity, shelf_life, quantity)
+        if spoilage_risk is None:
+            spoilage_risk = np.minimum(1.0, self._days_ratio(days_in_stock, shelf_life) * 0.8)
+        
+        safety_factor = np.maximum(1.0, 1.5 - waste_risk - spoilage_risk)  # Adjust stock based on risks
+        
+        # A trained stock model predicts expected usage; otherwise hold the current quantity
+        base_level = quantity
+        models = self._current_models()
+        if _is_fitted(models.get('stock_optimizer')):
+            features = self._scaled_features(models, days_in_stock, temperature, humidity, shelf_life, quantity)
+            base_level = np.maximum(0, models['stock_optimizer'].predict(features))
+        
+        return {
+            'waste_risk': waste_risk,
+            'spoilage_risk': spoilage_risk,
+            'optimal_level': base_level * safety_factor,
+            'min_level': self.min_stock * (1 + waste_risk + spoilage_risk),  # Increase min stock for high-risk items
+            'max_level': np.full(len(quantity), float(self.storage_capacity)),
+            'recommended_action': np.where((waste_risk > 0.7) | (spoilage_risk > 0.7), 'reduce', 'maintain'),
+            'days_to_expiry': np.maximum(0, shelf_life - days_in_stock)
+        }
+    
+    def train(self, history: pd.DataFrame) -> Dict:
+        """
+        Fit the waste and stock models on historical stocking periods and publish them.
+        
+        Each history row holds the WASTE_FEATURE_COLUMNS (`quantity` may be given as
+        `opening_stock`) and the quantity wasted (`wasted_kg`). When the quantity used is
+        known (`used_kg`, or `opening_stock - closing_stock - wasted_kg`) the stock model is
+        fitted as well; otherwise it stays on the heuristic.
+        """
+        frame = history.reset_index(drop=True).copy()
+        if 'quantity' not in frame.columns and 'opening_stock' in frame.columns:
+            frame['quantity'] = frame['opening_stock']
+        if 'wasted_kg' not in frame.columns or 'quantity' not in frame.columns:
+            raise ValueError("History needs quantity (or opening_stock) and wasted_kg")
+        if 'used_kg' not in frame.columns and {'opening_stock', 'closing_stock'}.issubset(frame.columns):
+            frame['used_kg'] = frame['opening_stock'] - frame['closing_stock'] - frame['wasted_kg']
+        
+        defaults = {'days_in_stock': 1, 'temperature': 20, 'humidity': 50, 'shelf_life': 7, 'quantity': 0}
+        features = np.column_stack([
+            pd.to_numeric(frame[col], errors='coerce').fillna(defaults[col]).to_numpy(dtype=np.float64)
+            if col in frame.columns else np.full(len(frame), float(defaults[col]))
+            for col in WASTE_FEATURE_COLUMNS
+        ])
+        quantity = features[:, WASTE_FEATURE_COLUMNS.index('quantity')]
+        wasted = pd.to_numeric(frame['wasted_kg'], errors='coerce').to_numpy(dtype=np.float64)
+        
+        valid = ~np.isnan(wasted) & (quantity > 0)
+        if valid.sum() < MIN_OPTIMIZER_TRAINING_ROWS:
+            raise ValueError(f"At least {MIN_OPTIMIZER_TRAINING_ROWS} history rows are required for training")
+        features = features[valid]
+        waste_fraction = np.clip(wasted[valid] / quantity[valid], 0.0, 1.0)
+        
+        scaler = StandardScaler().fit(features)
+        scaled = scaler.transform(features)
+        waste_predictor = RandomForestRegressor(n_estimators=100, random_state=42, oob_score=True, n_jobs=-1)
+        waste_predictor.fit(scaled, waste_fraction)
+        metrics = {'n_samples': int(valid.sum()), 'waste_oob_r2': float(waste_predictor.oob_score_)}
+        
+        stock_optimizer = RandomForestRegressor(n_estimators=100, random_state=42)
+        if 'used_kg' in frame.columns:
+            used = pd.to_numeric(frame['used_kg'], errors='coerce').to_numpy(dtype=np.float64)[valid]
+            has_usage = ~np.isnan(used)
+            if has_usage.sum() >= MIN_OPTIMIZER_TRAINING_ROWS:
+                stock_optimizer = RandomForestRegressor(n_estimators=100, random_state=42, oob_score=True, n_jobs=-1)
+                stock_optimizer.fit(scaled[has_usage], np.maximum(0, used[has_usage]))
+                metrics['stock_oob_r2'] = float(stock_optimizer.oob_score_)
+        
+        bundle = {
+            'waste_predictor': waste_predictor,
+            'stock_optimizer': stock_optimizer,
+            'scaler': scaler,
+            'features': WASTE_FEATURE_COLUMNS,
+            'trained_at': datetime.now().isoformat(),
+            'n_samples': metrics['n_samples']
+        }
+        if self.registry is not None:
+            self.registry.publish('inventory_predictor', bundle)
+        else:
+            self.waste_predictor, self.stock_optimizer, self.scaler = waste_predictor, stock_optimizer, scaler
+            joblib.dump(bundle, PREDICTOR_CACHE_FILE)
+        
+        metrics['trained_at'] = bundle['trained_at']
+        return metrics
 
     def calculate_optimal_levels(self, current_stock: float, item_data: Dict) -> Dict:
         """Calculate optimal inventory levels considering waste risk and spoilage"""
         try:
-            waste_risk = self.predict_waste_risk(item_data)
-            
             # Check if image is available for spoilage risk assessment
-            spoilage_risk = 0.0
+            spoilage_risk = None
             if CV_AVAILABLE and 'image' in item_data and item_data['image'] is not None:
-                spoilage_risk = self.assess_spoilage_risk(item_data['image'])
-            else:
-                # Calculate spoilage risk based on other factors if image is not available
-                spoilage_risk = min(1.0, (item_data.get('days_in_stock', 0) / 
-                                        item_data.get('shelf_life', 7)) * 0.8)
+                spoilage_risk = np.array([
+                    self.assess_spoilage_risk(item_data['image'], item_data.get('camera_id'))
+                ])
             
-            safety_factor = max(1.0, 1.5 - waste_risk - spoilage_risk)  # Adjust stock based on risks
-
-            optimal_level = current_stock * safety_factor
-            min_level = self.min_stock * (1 + waste_risk + spoilage_risk)  # Increase min stock for high-risk items
+            scores = self.score_items_batch(
+                np.array([item_data.get('days_in_stock', 0)], dtype=np.float64),
+                np.array([item_data.get('temperature', 20)], dtype=np.float64),
+                np.array([item_data.get('humidity', 50)], dtype=np.float64),
+                np.array([item_data.get('shelf_life', 7)], dtype=np.float64),
+                np.array([current_stock], dtype=np.float64),
+                spoilage_risk
+            )
 
             return {
-                'optimal_level': float(optimal_level),
-                'min_level': float(min_level),
+                'optimal_level': float(scores['optimal_level'][0]),
+                'min_level': float(scores['min_level'][0]),
                 'max_level': float(self.storage_capacity),
-                'waste_risk': float(waste_risk),
-                'spoilage_risk': float(spoilage_risk),
-                'recommended_action': 'reduce' if waste_risk > 0.7 or spoilage_risk > 0.7 else 'maintain'
+                'waste_risk': float(scores['waste_risk'][0]),
+                'spoilage_risk': float(scores['spoilage_risk'][0]),
+                'recommended_action': str(scores['recommended_action'][0])
             }
         except Exception as e:
             logger.error(f"Error calculating optimal levels: {e}")
@@ -590,55 +2355,66 @@ class SmartInventoryPredictor:
                 'recommended_action': 'maintain'
             }
 
-    def assess_spoilage_risk(self, image) -> float:
-        """Assess spoilage risk using image analysis with improved error handling"""
+    def assess_spoilage_risk(self, image, camera_id: Optional[str] = None) -> float:
+        """
+        Assess spoilage risk using image analysis with improved error handling.
+        
+        With a camera_id the image is compared against that camera's background model;
+        without one it is scored on its own, so unrelated callers never share a model.
+        """
         if not CV_AVAILABLE:
             return 0.3  # Default risk if CV not available
             
         try:
-            # Convert PIL Image to numpy array if needed
-            if hasattr(image, 'convert'):
-                # It's a PIL Image
-                image_np = np.array(image.convert('RGB'))
-            elif isinstance(image, np.ndarray):
-                # It's already a numpy array
-                image_np = image
-            else:
-                # Unknown format, return default risk
-                return 0.3
-                
-            # Apply background subtraction for spoilage detection
-            fg_mask = self.spoilage_model.apply(image_np)
-            
-            # Calculate spoilage score
-            if fg_mask is not None and fg_mask.size > 0:
-                spoilage_score = np.sum(fg_mask) / (image_np.shape[0] * image_np.shape[1])
-                return min(1.0, spoilage_score)  # Ensure score is between 0 and 1
-            return 0.3  # Default moderate risk if processing fails
+            if camera_id is None:
+                return min(1.0, self.spoilage_tracker.stateless_score(image))
+            # Compare against this camera's background model
+            return min(1.0, self.spoilage_tracker.update(camera_id, image)['spoilage_score'])
+        except ValueError:
+            # Unknown format, return default risk
+            return 0.3
         except Exception as e:
             logger.error(f"Error in spoilage risk assessment: {e}")
             return 0.3  # Default moderate risk on error
 
 class AIStockOptimizer:
     """AI-powered stock optimization with market trend analysis"""
-    def __init__(self):
-        self.model = RandomForestRegressor(n_estimators=100, random_state=42)
-        self.scaler = StandardScaler()
-        self._load_or_train_model()
+    def __init__(self, registry: Optional[ModelRegistry] = None):
+        self.registry = registry
+        if registry is None:
+            self.model = RandomForestRegressor(n_estimators=100, random_state=42)
+            self.scaler = StandardScaler()
+            self._load_or_train_model()
+    
+    @staticmethod
+    def default_model_bundle() -> Dict:
+        """Untrained model bundle used until a trained one is available"""
+        return {
+            'model': RandomForestRegressor(n_estimators=100, random_state=42),
+            'scaler': StandardScaler()
+        }
+    
+    def _current_model(self) -> Dict:
+        """Model and scaler to use for this call, taken together from one registry version"""
+        if self.registry is not None:
+            return self.registry.get('stock_optimizer')
+        return {'model': self.model, 'scaler': self.scaler}
     
     def _load_or_train_model(self):
         """Load or train the optimization model"""
-        try:
-            # Try to load cached model
-            with open(MODEL_CACHE_FILE, 'rb') as f:
-                cached_model = pickle.load(f)
-                self.model = cached_model['model']
-                self.scaler = cached_model['scaler']
-                logger.info("Loaded cached optimization model")
-        except:
+        if not os.path.exists(MODEL_CACHE_FILE):
             logger.info("Training new optimization model")
             # Model will be trained on first optimization request
-            pass
+            return
+        try:
+            # train() writes the cache with joblib, the same format ModelRegistry reads
+            cached_model = joblib.load(MODEL_CACHE_FILE)
+            self.model = cached_model['model']
+            self.scaler = cached_model['scaler']
+            logger.info("Loaded cached optimization model")
+        except (OSError, EOFError, ImportError, AttributeError, KeyError, TypeError, ValueError,
+                pickle.UnpicklingError) as e:
+            logger.error(f"Error loading cached optimization model, using an untrained one: {str(e)}")
     
     def _prepare_features(self, current_stock: float, historical_data: pd.DataFrame, profile: Dict) -> np.ndarray:
         """Prepare features for the optimization model"""
@@ -660,7 +2436,7 @@ class AIStockOptimizer:
             recent_prices = recent_prices.tail(7)
             features.extend([
                 recent_prices['Modal Price'].mean(),
-                recent_prices['Modal Price'].std(),
+                recent_prices['Modal Price'].std() if len(recent_prices) > 1 else 0,
                 recent_prices['Modal Price'].max(),
                 recent_prices['Modal Price'].min()
             ])
@@ -670,45 +2446,115 @@ class AIStockOptimizer:
         
         return np.array(features).reshape(1, -1)
     
+    def predict_levels_batch(self, features: np.ndarray) -> Dict[str, np.ndarray]:
+        """Predict min/max stock and reorder points for a whole feature matrix in one call"""
+        bundle = self._current_model()
+        model = bundle.get('model') if bundle else None
+        
+        if _is_fitted(model):
+            scaler = bundle.get('scaler')
+            inputs = scaler.transform(features) if scaler is not None else features
+            optimal_stock = model.predict(inputs)
+        else:
+            optimal_stock = heuristic_min_stock(features)
+        
+        return {
+            'min_stock': np.maximum(0, optimal_stock),
+            'max_stock': np.maximum(optimal_stock * 1.5, features[:, 1] * 0.8),  # 1.5x min stock or 80% of storage capacity
+            'reorder_point': np.maximum(0, optimal_stock * 0.7)  # 70% of min stock
+        }
+    
     def _predict_optimal_levels(self, features: np.ndarray) -> Dict:
         """Predict optimal stock levels"""
         try:
-            # For a real model, you would use:
-            # predictions = self.model.predict(features)
-            
-            # For demo purposes, we'll use a simple heuristic approach
-            base_capacity = features[0, 1]  # storage capacity
-            base_min_stock = features[0, 2]  # min stock level
-            spoilage_rate = features[0, 4]  # spoilage rate
-            is_weekend = features[0, 5]  # is weekend
-            is_festival = features[0, 6]  # is festival
-            restaurant_type = features[0, 7]  # restaurant type
-            
-            # Calculate optimal stock based on simple heuristics
-            base_multiplier = 1.0
-            if is_weekend:
-                base_multiplier *= 1.2
-            if is_festival:
-                base_multiplier *= 1.5
-                
-            # Restaurant type adjustments
-            type_multiplier = {0: 1.3, 1: 0.8, 2: 1.0, 3: 0.9}.get(restaurant_type, 1.0)
-            base_multiplier *= type_multiplier
-            
-            # Adjust for spoilage risk
-            spoilage_factor = max(0.7, 1.0 - spoilage_rate)
-            
-            optimal_stock = base_min_stock * base_multiplier * spoilage_factor
-            
-            return {
-                'min_stock': max(0, optimal_stock),
-                'max_stock': max(optimal_stock * 1.5, base_capacity * 0.8),  # 1.5x min stock or 80% of storage capacity
-                'reorder_point': max(0, optimal_stock * 0.7)  # 70% of min stock
-            }
+            levels = self.predict_levels_batch(np.nan_to_num(features))
+            return {name: float(values[0]) for name, values in levels.items()}
         except Exception as e:
             logger.error(f"Error in prediction: {str(e)}")
             return None
     
+    def optimize_batch(self, items: pd.DataFrame, price_history: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """
+        Score many commodities at once.
+        
+        `items` holds one row per commodity with the profile columns used by the optimizer
+        (missing columns fall back to defaults). Recent price features are joined from
+        `price_history` by commodity.
+        """
+        frame = items.reset_index(drop=True)
+        if 'commodity' in frame.columns:
+            price_features = recent_price_features(price_history)
+            if not price_features.empty:
+                frame = frame.join(price_features, on='commodity')
+        
+        features = build_optimizer_features(frame)
+        levels = self.predict_levels_batch(features)
+        
+        result = pd.DataFrame(levels)
+        result.insert(0, 'current_stock', features[:, 0])
+        if 'commodity' in frame.columns:
+            result.insert(0, 'commodity', frame['commodity'])
+        result['suggested_order'] = np.maximum(0, result['min_stock'] - result['current_stock'])
+        result['status'] = np.select(
+            [result['current_stock'] < result['reorder_point'], result['current_stock'] < result['min_stock']],
+            ['reorder_now', 'below_optimal'],
+            default='optimal'
+        )
+        return result
+    
+    def train(self, history: pd.DataFrame, price_history: Optional[pd.DataFrame] = None) -> Dict:
+        """
+        Fit the optimizer on historical stock, waste and price data and publish it.
+        
+        Each history row describes one stocking period: the profile columns, the stock on
+        hand (`current_stock` or `opening_stock`) and the quantity actually used
+        (`used_kg`, or `opening_stock - closing_stock - wasted_kg`). The model learns the
+        stock that would have covered real usage without the waste.
+        """
+        frame = history.reset_index(drop=True).copy()
+        if 'current_stock' not in frame.columns and 'opening_stock' in frame.columns:
+            frame['current_stock'] = frame['opening_stock']
+        if 'used_kg' not in frame.columns:
+            required = {'opening_stock', 'closing_stock', 'wasted_kg'}
+            if not required.issubset(frame.columns):
+                raise ValueError("History needs used_kg or opening_stock, closing_stock and wasted_kg")
+            frame['used_kg'] = frame['opening_stock'] - frame['closing_stock'] - frame['wasted_kg']
+        
+        if 'commodity' in frame.columns:
+            price_features = recent_price_features(price_history)
+            if not price_features.empty:
+                frame = frame.join(price_features, on='commodity')
+        
+        target = pd.to_numeric(frame['used_kg'], errors='coerce').clip(lower=0)
+        frame = frame[target.notna()]
+        target = target[target.notna()]
+        if len(frame) < MIN_OPTIMIZER_TRAINING_ROWS:
+            raise ValueError(f"At least {MIN_OPTIMIZER_TRAINING_ROWS} history rows are required for training")
+        
+        features = build_optimizer_features(frame)
+        scaler = StandardScaler().fit(features)
+        model = RandomForestRegressor(n_estimators=100, random_state=42, oob_score=True, n_jobs=-1)
+        model.fit(scaler.transform(features), target.to_numpy())
+        
+        bundle = {
+            'model': model,
+            'scaler': scaler,
+            'features': OPTIMIZER_FEATURE_COLUMNS,
+            'trained_at': datetime.now().isoformat(),
+            'n_samples': len(frame)
+        }
+        if self.registry is not None:
+            self.registry.publish('stock_optimizer', bundle)
+        else:
+            self.model, self.scaler = model, scaler
+            joblib.dump(bundle, MODEL_CACHE_FILE)
+        
+        return {
+            'n_samples': len(frame),
+            'oob_r2': float(model.oob_score_),
+            'trained_at': bundle['trained_at']
+        }
+    
     def _generate_recommendations(self, optimal_levels: Dict, current_stock: float, historical_data: pd.DataFrame) -> List[str]:
         """Generate smart recommendations based on optimization results"""
         recommendations = []
@@ -755,12 +2601,8 @@ class AIStockOptimizer:
             # Prepare features
             features = self._prepare_features(current_stock, historical_data, profile)
             
-            # Scale features - in a real system, you would use the fitted scaler
-            # scaled_features = self.scaler.transform(features)
-            scaled_features = features  # For demo purposes
-            
-            # Predict optimal levels
-            optimal_levels = self._predict_optimal_levels(scaled_features)
+            # Predict optimal levels (the fitted scaler is applied with the model)
+            optimal_levels = self._predict_optimal_levels(features)
             if not optimal_levels:
                 return None
             
@@ -784,100 +2626,207 @@ class AIStockOptimizer:
             logger.error(f"Error in stock optimization: {str(e)}")
             return None
 
+# Shared model registry and predictors, created once per worker process
+model_registry = ModelRegistry()
+model_registry.register('stock_optimizer', MODEL_CACHE_FILE, AIStockOptimizer.default_model_bundle)
+model_registry.register('inventory_predictor', PREDICTOR_CACHE_FILE, SmartInventoryPredictor.default_model_bundle)
+model_registry.start_watcher()
+stock_optimizer = AIStockOptimizer(registry=model_registry)
+inventory_predictor = SmartInventoryPredictor(registry=model_registry)
+
+class OnnxDetectionBackend:
+    """ONNX Runtime CPU session for an exported detector"""
+    name = 'onnx'
+    
+    def __init__(self, path: str, threads: int = DETECTOR_THREADS):
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, sess_options=options, providers=['CPUExecutionProvider'])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # Models exported with a fixed batch dimension are fed in chunks of that size
+        self.max_batch = model_input.shape[0] if isinstance(model_input.shape[0], int) else None
+    
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        if self.max_batch is None or len(batch) <= self.max_batch:
+            return self.session.run(None, {self.input_name: batch})[0]
+        return np.concatenate([
+            self.session.run(None, {self.input_name: batch[i:i + self.max_batch]})[0]
+            for i in range(0, len(batch), self.max_batch)
+        ])
+
+class TorchScriptDetectionBackend:
+    """TorchScript CPU module for an exported detector"""
+    name = 'torchscript'
+    
+    def __init__(self, path: str, threads: int = DETECTOR_THREADS):
+        torch.set_num_threads(threads)
+        self.model = torch.jit.load(path, map_location='cpu').eval()
+        try:
+            self.model = torch.jit.optimize_for_inference(self.model)
+        except Exception as e:
+            logger.warning(f"TorchScript optimization skipped: {str(e)}")
+    
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        with torch.inference_mode():
+            output = self.model(torch.from_numpy(batch))
+        if isinstance(output, (list, tuple)):
+            output = output[0]
+        return output.numpy()
+
+def load_detection_backend(path: str = DETECTOR_MODEL_PATH, threads: int = DETECTOR_THREADS):
+    """Load the detector matching the model file extension, or None if it cannot be loaded"""
+    if not os.path.exists(path):
+        return None
+    try:
+        if path.endswith('.onnx') and ONNX_AVAILABLE:
+            return OnnxDetectionBackend(path, threads)
+        if path.endswith(('.pt', '.torchscript')) and CV_AVAILABLE:
+            return TorchScriptDetectionBackend(path, threads)
+        logger.error(f"No runtime available for detector model {path}")
+    except Exception as e:
+        logger.error(f"Failed to load detector model {path}: {str(e)}")
+    return None
+
+def load_detector_labels(path: str = DETECTOR_MODEL_PATH) -> List[str]:
+    """Class labels from <model>.labels.json, falling back to DETECTOR_LABELS"""
+    labels_file = os.path.splitext(path)[0] + '.labels.json'
+    try:
+        with open(labels_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return DETECTOR_LABELS
+
 class SmartInventoryDetector:
     """Advanced inventory detection using computer vision"""
-    def __init__(self):
+    def __init__(self, backend=None, labels: Optional[List[str]] = None, input_size: int = DETECTOR_INPUT_SIZE):
+        self.backend = None
         if not CV_AVAILABLE:
             self.initialized = False
             logger.error("Computer vision libraries not available")
             return
             
         try:
-            # In a real system, you would load models here
-            # For demo, we'll use placeholders
+            # The detector is loaded once; without a model file the detector falls back to demo detections
+            self.backend = backend if backend is not None else load_detection_backend()
+            self.labels = labels or load_detector_labels()
+            self.input_size = input_size
             self.initialized = True
+            if self.backend is None:
+                logger.warning(f"No detection model at {DETECTOR_MODEL_PATH}, using simulated detections")
             logger.info("SmartInventoryDetector initialized successfully")
         except Exception as e:
             self.initialized = False
             logger.error(f"Failed to initialize SmartInventoryDetector: {str(e)}")
 
-    def detect_inventory(self, image_data):
-        """Detect inventory items in image"""
+    @property
+    def backend_name(self) -> str:
+        return self.backend.name if self.backend is not None else 'simulated'
+
+    def _decode_image(self, image_data, full_resolution: bool = False):
+        """Convert supported image inputs to an RGB PIL Image and its original (width, height)"""
+        if isinstance(image_data, np.ndarray):
+            image_data = Image.fromarray(image_data)
+        if isinstance(image_data, Image.Image):
+            return image_data.convert('RGB'), image_data.size
+        
+        # Only the detector input resolution is needed unless the caller asks for full size
+        return open_image_upload(image_data, None if full_resolution else self.input_size)
+
+    def _simulate_detections(self, image) -> List[Dict]:
+        """Demo detections used when no detection model is installed"""
+        items = {
+            'Vegetables': ['Tomato', 'Potato', 'Onion', 'Carrot'],
+            'Fruits': ['Apple', 'Banana', 'Orange'],
+            'Grains': ['Rice', 'Wheat'],
+            'Spices': ['Turmeric', 'Chilli', 'Cumin']
+        }
+        
+        detections = []
+        for category_items in items.values():
+            count = np.random.randint(0, 3)  # 0-2 types of each category
+            for item in np.random.choice(category_items, count, replace=False):
+                for _ in range(np.random.randint(1, 5)):  # 1-4 of each item
+                    x1 = int(np.random.randint(0, max(1, image.width - 100)))
+                    y1 = int(np.random.randint(0, max(1, image.height - 100)))
+                    detections.append({
+                        'label': str(item),
+                        'confidence': float(np.random.uniform(0.7, 0.95)),
+                        'box': [x1, y1, x1 + int(np.random.randint(50, 100)), y1 + int(np.random.randint(50, 100))]
+                    })
+        return detections
+
+    def detect_batch(self, images: List) -> List[List[Dict]]:
+        """Run the detector on PIL images or RGB arrays, DETECTOR_BATCH_CHUNK images per forward pass"""
+        if self.backend is None:
+            return [self._simulate_detections(Image.fromarray(img) if isinstance(img, np.ndarray) else img)
+                    for img in images]
+        
+        results = []
+        for start in range(0, len(images), DETECTOR_BATCH_CHUNK):
+            results.extend(self._detect_chunk(images[start:start + DETECTOR_BATCH_CHUNK]))
+        return results
+    
+    def _detect_chunk(self, images: List) -> List[List[Dict]]:
+        arrays = [np.asarray(img.convert('RGB')) if hasattr(img, 'convert') else img for img in images]
+        batch, transforms_ = letterbox_batch(arrays, self.input_size)
+        outputs = self.backend(batch)
+        
+        results = []
+        for output, transform, array in zip(outputs, transforms_, arrays):
+            decoded = decode_detections(output, transform, array.shape[:2])
+            results.append([
+                {
+                    'label': self.labels[int(cls)] if int(cls) < len(self.labels) else f"class_{int(cls)}",
+                    'confidence': float(conf),
+                    'box': [int(round(v)) for v in (x1, y1, x2, y2)]
+                }
+                for x1, y1, x2, y2, conf, cls in decoded
+            ])
+        return results
+
+    def detect_inventory(self, image_data, annotate: str = 'base64', full_resolution: bool = False):
+        """
+        Detect inventory items in image.
+        
+        annotate: 'base64' embeds the annotated JPEG in the result, 'url' stores it for download
+        from /api/inventory/annotated/<id>, and 'none' skips drawing and encoding it.
+        """
         if not self.initialized or not CV_AVAILABLE:
             logger.error("Inventory detection system not properly initialized")
             return None
             
         try:
             # Convert image data to PIL Image
-            if isinstance(image_data, bytes):
-                image = Image.open(BytesIO(image_data))
-            elif isinstance(image_data, str) and image_data.startswith('data:image'):
-                # Handle base64 encoded images
-                image_data = image_data.split(',')[1]
-                image = Image.open(BytesIO(base64.b64decode(image_data)))
-            elif isinstance(image_data, np.ndarray):
-                image = Image.fromarray(image_data)
-            elif isinstance(image_data, Image.Image):
-                image = image_data
-            else:
+            try:
+                image, (original_width, original_height) = self._decode_image(image_data, full_resolution)
+            except ValueError:
                 return None
-                
-            # For demo purposes, we'll simulate object detection
-            # In a real system, you'd use an actual object detection model
-            
-            # Generate some demo detections
-            categories = ['Vegetables', 'Fruits', 'Grains', 'Spices']
-            items = {
-                'Vegetables': ['Tomato', 'Potato', 'Onion', 'Carrot'],
-                'Fruits': ['Apple', 'Banana', 'Orange'],
-                'Grains': ['Rice', 'Wheat'],
-                'Spices': ['Turmeric', 'Chilli', 'Cumin']
-            }
             
-            # Create fake bounding boxes and detections
-            inventory_count = {}
-            detections = []
+            detections = self.detect_batch([image])[0]
             
-            for category in categories:
-                category_items = items[category]
-                count = np.random.randint(0, 3)  # 0-2 types of each category
-                
-                if count > 0:
-                    inventory_count[category] = {'count': 0, 'items': {}}
-                    
-                    # Add random items
-                    selected_items = np.random.choice(category_items, count, replace=False)
-                    for item in selected_items:
-                        item_count = np.random.randint(1, 5)  # 1-4 of each item
-                        inventory_count[category]['items'][item] = item_count
-                        inventory_count[category]['count'] += item_count
-                        
-                        # Create fake detections
-                        for i in range(item_count):
-                            x1 = np.random.randint(0, image.width - 100)
-                            y1 = np.random.randint(0, image.height - 100)
-                            x2 = x1 + np.random.randint(50, 100)
-                            y2 = y1 + np.random.randint(50, 100)
-                            
-                            detections.append({
-                                'label': item,
-                                'confidence': np.random.uniform(0.7, 0.95),
-                                'box': [x1, y1, x2, y2]
-                            })
-            
-            # Create annotated image
-            annotated_image = self.create_annotated_image(image, detections)
+            result = {
+                'inventory_count': count_detections(detections),
+                'raw_detections': scale_detections(
+                    detections, original_width / image.width, original_height / image.height
+                ),
+                'image_size': [original_width, original_height],
+                'backend': self.backend_name
+            }
             
-            # Convert to base64 for API response
-            buffered = BytesIO()
-            annotated_image.save(buffered, format="JPEG")
-            img_str = base64.b64encode(buffered.getvalue()).decode()
+            if annotate != 'none':
+                # Annotate at the decoded resolution and encode once
+                annotated_image = self.create_annotated_image(image, detections)
+                buffered = BytesIO()
+                annotated_image.save(buffered, format="JPEG")
+                if annotate == 'url':
+                    image_id = store_annotated_image(buffered.getvalue())
+                    result['annotated_image_url'] = f"/api/inventory/annotated/{image_id}"
+                else:
+                    result['annotated_image'] = base64.b64encode(buffered.getbuffer()).decode()
             
-            return {
-                'inventory_count': inventory_count,
-                'annotated_image': img_str,
-                'raw_detections': detections
-            }
+            return result
                 
         except Exception as e:
             logger.error(f"Error in inventory detection: {str(e)}")
@@ -906,334 +2855,343 @@ class SmartInventoryDetector:
             logger.error(f"Error creating annotated image: {str(e)}")
             return image
 
-# Utility functions for visualization
-def generate_price_trend_plot(market_data: pd.DataFrame, title: str = "Price Trends") -> str:
-    """Generate price trend visualization and return as base64 image"""
-    try:
-        if market_data.empty or not set(['Min Price', 'Modal Price', 'Max Price']).issubset(market_data.columns):
-            # Generate empty plot with message
-            fig, ax = plt.subplots(figsize=(10, 6))
-            ax.text(0.5, 0.5, "No data available for visualization", 
-                    horizontalalignment='center', verticalalignment='center', transform=ax.transAxes)
-            ax.set_title(title)
-            
-            # Convert to base64
-            buf = BytesIO()
-            plt.savefig(buf, format='png')
-            buf.seek(0)
-            img_str = base64.b64encode(buf.getvalue()).decode('utf-8')
-            plt.close(fig)
-            return img_str
-            
-        # Create plot with market data
-        fig, ax = plt.subplots(figsize=(10, 6))
-        
-        # Sort by market for better visualization
-        market_data_sorted = market_data.sort_values('Market')
-        
-        # Plot min, modal, and max prices
-        x = range(len(market_data_sorted))
-        markets = market_data_sorted['Market'].tolist()
-        
-        ax.plot(x, market_data_sorted['Min Price'], 'b-o', label='Min Price')
-        ax.plot(x, market_data_sorted['Modal Price'], 'g-o', label='Modal Price')
-        ax.plot(x, market_data_sorted['Max Price'], 'r-o', label='Max Price')
-        
-        # Set x-ticks to market names
-        ax.set_xticks(x)
-        ax.set_xticklabels(markets, rotation=45, ha='right')
-        
-        # Add labels and title
-        ax.set_xlabel('Market')
-        ax.set_ylabel('Price (₹/kg)')
-        ax.set_title(title)
-        ax.legend()
-        
-        # Adjust layout
-        plt.tight_layout()
-        
-        # Convert to base64
-        buf = BytesIO()
-        plt.savefig(buf, format='png')
-        buf.seek(0)
-        img_str = base64.b64encode(buf.getvalue()).decode('utf-8')
-        plt.close(fig)
-        
-        return img_str
-    except Exception as e:
-        logger.error(f"Error generating price trend plot: {str(e)}")
-        return ""
+def benchmark_detector(detector: SmartInventoryDetector, batch_sizes: Tuple[int, ...] = (1, 8, 32),
+                       iterations: int = 5, image_size: Tuple[int, int] = (1280, 720)) -> List[Dict]:
+    """
+    Measure end-to-end detector throughput (letterbox, inference and decoding) per batch size.
+    
+    One warm-up batch is run for each size before timing.
+    """
+    rng = np.random.default_rng(0)
+    width, height = image_size
+    results = []
+    for batch_size in batch_sizes:
+        images = [rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(batch_size)]
+        detector.detect_batch(images)
+        
+        start = time.perf_counter()
+        for _ in range(iterations):
+            detector.detect_batch(images)
+        elapsed = time.perf_counter() - start
+        
+        results.append({
+            'batch_size': batch_size,
+            'images_per_sec': batch_size * iterations / elapsed,
+            'latency_ms_per_batch': elapsed / iterations * 1000
+        })
+    return results
 
-def generate_price_distribution_plot(market_data: pd.DataFrame, title: str = "Price Distribution") -> str:
-    """Generate price distribution visualization and return as base64 image"""
-    try:
-        if market_data.empty or 'Modal Price' not in market_data.columns:
-            # Generate empty plot with message
-            fig, ax = plt.subplots(figsize=(10, 6))
-            ax.text(0.5, 0.5, "No data available for visualization", 
-                    horizontalalignment='center', verticalalignment='center', transform=ax.transAxes)
-            ax.set_title(title)
-            
-            # Convert to base64
-            buf = BytesIO()
-            plt.savefig(buf, format='png')
-            buf.seek(0)
-            img_str = base64.b64encode(buf.getvalue()).decode('utf-8')
-            plt.close(fig)
-            return img_str
-            
-        # Create box plot
-        fig, ax = plt.subplots(figsize=(10, 6))
-        
-        # Create data for boxplot
-        price_columns = [col for col in ['Min Price', 'Modal Price', 'Max Price'] if col in market_data.columns]
-        data = [market_data[col] for col in price_columns]
-        
-        # Generate boxplot
-        bp = ax.boxplot(data, patch_artist=True, labels=price_columns)
-        
-        # Add some styling
-        colors = ['lightblue', 'lightgreen', 'salmon']
-        for patch, color in zip(bp['boxes'], colors[:len(price_columns)]):
-            patch.set_facecolor(color)
-            
-        # Add scatter points for individual data points
-        for i, col in enumerate(price_columns):
-            y = market_data[col]
-            x = np.random.normal(i+1, 0.04, size=len(y))
-            ax.scatter(x, y, alpha=0.3, s=20)
-            
-        # Add labels and title
-        ax.set_xlabel('Price Type')
-        ax.set_ylabel('Price (₹/kg)')
-        ax.set_title(title)
-        
-        # Adjust layout
-        plt.tight_layout()
-        
-        # Convert to base64
-        buf = BytesIO()
-        plt.savefig(buf, format='png')
-        buf.seek(0)
-        img_str = base64.b64encode(buf.getvalue()).decode('utf-8')
-        plt.close(fig)
-        
-        return img_str
-    except Exception as e:
-        logger.error(f"Error generating price distribution plot: {str(e)}")
-        return ""
+# Shared detector, created once per worker process
+inventory_detector = SmartInventoryDetector()
+
+# Utility functions for visualization (the renderers themselves live in charts.py)
+def generate_market_heatmap(market_data: pd.DataFrame, title: str = "Market Price Heatmap") -> str:
+    """Generate market price heatmap visualization and return as base64 image"""
+    return generate_price_matrix_heatmap(market_heatmap_matrix(market_data, title), title)
+
+# Chart data for client-side rendering (format=data)
+def _round_list(values, decimals: int = 2) -> List:
+    """Round a float array into a JSON-friendly list, mapping NaN to None"""
+    values = np.round(np.asarray(values, dtype=np.float64), decimals)
+    return [None if np.isnan(v) else v for v in values.tolist()]
+
+def lttb_downsample(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+
+    Returns the indices of at most `threshold` points that preserve the visual shape of
+    the series. The first and last points are always kept.
+    """
+    n = len(y)
+    if threshold is None or threshold < 3 or n <= threshold:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    every = (n - 2) / (threshold - 2)
+
+    indices = np.empty(threshold, dtype=np.intp)
+    indices[0] = 0
+    indices[-1] = n - 1
+    a = 0
+
+    for i in range(threshold - 2):
+        # Average point of the next bucket
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[avg_start:avg_end].mean()
+        avg_y = y[avg_start:avg_end].mean()
+
+        # Pick the point in this bucket forming the largest triangle
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a]) -
+            (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+
+    return indices
+
+def price_trend_series(market_data: pd.DataFrame, title: str = "Price Trends",
+                       max_points: int = CHART_MAX_POINTS) -> Dict:
+    """Columnar min/modal/max price series per market"""
+    if market_data.empty or not set(PRICE_COLUMNS).issubset(market_data.columns):
+        return {"type": "line", "title": title, "x": [], "series": {}}
+
+    market_data_sorted = market_data.sort_values('Market')
+    prices = market_data_sorted[PRICE_COLUMNS].to_numpy(dtype=np.float64)
+    keep = lttb_downsample(np.arange(len(prices)), prices[:, 1], max_points)
+
+    return {
+        "type": "line",
+        "title": title,
+        "x": market_data_sorted['Market'].to_numpy()[keep].tolist(),
+        "series": {
+            "min": _round_list(prices[keep, 0]),
+            "modal": _round_list(prices[keep, 1]),
+            "max": _round_list(prices[keep, 2])
+        },
+        "total_points": len(prices)
+    }
+
+def price_distribution_series(market_data: pd.DataFrame, title: str = "Price Distribution",
+                              max_points: int = CHART_MAX_POINTS) -> Dict:
+    """Box-plot summaries (five-number summary) for each price column"""
+    if market_data.empty or 'Modal Price' not in market_data.columns:
+        return {"type": "box", "title": title, "stats": {}}
+
+    price_columns = [col for col in PRICE_COLUMNS if col in market_data.columns]
+    prices = market_data[price_columns].to_numpy(dtype=np.float64)
+    summary = np.nanpercentile(prices, [0, 25, 50, 75, 100], axis=0)
+
+    return {
+        "type": "box",
+        "title": title,
+        "stats": {
+            col: dict(zip(["min", "q1", "median", "q3", "max"], _round_list(summary[:, i])))
+            for i, col in enumerate(price_columns)
+        },
+        "count": len(prices)
+    }
+
+def inventory_chart_series(current_stock: float, optimal_levels: Dict, title: str = "Inventory Status",
+                           max_points: int = CHART_MAX_POINTS) -> Dict:
+    """Current stock and optimal level markers"""
+    return {
+        "type": "bar",
+        "title": title,
+        "current_stock": float(current_stock),
+        "levels": {
+            "min_stock": float(optimal_levels.get('min_stock', 0)),
+            "reorder_point": float(optimal_levels.get('reorder_point', 0)),
+            "max_stock": float(optimal_levels.get('max_stock', 0))
+        }
+    }
+
+def price_forecast_series(historical_data: pd.DataFrame, forecast_data: pd.DataFrame,
+                          title: str = "Price Forecast", max_points: int = CHART_MAX_POINTS) -> Dict:
+    """Downsampled price history plus the forecast band"""
+    result = {"type": "forecast", "title": title, "history": {}, "forecast": {}}
+    if (historical_data.empty or 'Modal Price' not in historical_data.columns or
+        'Date' not in historical_data.columns or forecast_data is None):
+        return result
+
+    history = historical_data[['Date', 'Modal Price']].copy()
+    history['Date'] = pd.to_datetime(history['Date'])
+    history = history.sort_values('Date')
+    dates = history['Date'].to_numpy().astype('datetime64[s]')
+    prices = history['Modal Price'].to_numpy(dtype=np.float64)
+    keep = lttb_downsample(dates.astype(np.int64), prices, max_points)
+
+    result["history"] = {
+        "dates": np.datetime_as_string(dates[keep], unit='D').tolist(),
+        "price": _round_list(prices[keep]),
+        "total_points": len(history)
+    }
+
+    forecast = forecast_data.sort_values('arrival_date')
+    forecast_dates = pd.to_datetime(forecast['arrival_date']).to_numpy().astype('datetime64[s]')
+    result["forecast"] = {
+        "dates": np.datetime_as_string(forecast_dates, unit='D').tolist(),
+        "predicted": _round_list(forecast['predicted_price'])
+    }
+    if 'confidence_upper' in forecast.columns and 'confidence_lower' in forecast.columns:
+        result["forecast"]["lower"] = _round_list(forecast['confidence_lower'])
+        result["forecast"]["upper"] = _round_list(forecast['confidence_upper'])
+
+    return result
+
+def market_heatmap_matrix(market_data: pd.DataFrame, title: str = "Market Price Heatmap",
+                          max_points: int = CHART_MAX_POINTS) -> Dict:
+    """Market x date matrix of mean modal prices"""
+    return PriceCube.from_frame("", market_data).heatmap_matrix(title=title)
+
+def price_matrix_series(matrix: Dict, title: str = "Market Price Heatmap",
+                        max_points: int = CHART_MAX_POINTS) -> Dict:
+    """A precomputed heatmap matrix is already in the client-side layout"""
+    return dict(matrix, title=title)
+
+def seasonal_series(monthly_df: pd.DataFrame, title: str = "Seasonal Price Pattern",
+                    max_points: int = CHART_MAX_POINTS) -> Dict:
+    """Monthly typical prices and seasonal indices"""
+    return {
+        "type": "line",
+        "title": title,
+        "x": monthly_df['Month'].tolist(),
+        "series": {
+            "price": _round_list(monthly_df['AvgPrice']),
+            "seasonal_index": _round_list(monthly_df['SeasonalIndex'], 4)
+        },
+        "current_month": datetime.now().month
+    }
+
+def yoy_series(monthly_df: pd.DataFrame, title: str = "Year-over-Year Price Changes",
+               max_points: int = CHART_MAX_POINTS) -> Dict:
+    """Monthly year-over-year change in percent"""
+    return {
+        "type": "bar",
+        "title": title,
+        "x": monthly_df['Month'].tolist(),
+        "series": {"yoy_change": _round_list(monthly_df['YoYChange'])}
+    }
 
-def generate_inventory_chart(current_stock: float, optimal_levels: Dict, title: str = "Inventory Status") -> str:
-    """Generate inventory status visualization and return as base64 image"""
-    try:
-        # Create plot
-        fig, ax = plt.subplots(figsize=(10, 6))
-        
-        # Create bar for current stock
-        ax.bar(['Current Stock'], [current_stock], color='blue', alpha=0.6, label='Current Stock')
+# Chart rendering service
+
+CHART_DATA_BUILDERS = {
+    "generate_price_trend_plot": price_trend_series,
+    "generate_price_distribution_plot": price_distribution_series,
+    "generate_inventory_chart": inventory_chart_series,
+    "generate_price_forecast_chart": price_forecast_series,
+    "generate_market_heatmap": market_heatmap_matrix,
+    "generate_price_matrix_heatmap": price_matrix_series,
+    "generate_seasonal_chart": seasonal_series,
+    "generate_yoy_chart": yoy_series
+}
+
+chart_service = ChartService(data_builders=CHART_DATA_BUILDERS)
+
+# Market report helpers
+def build_market_price_report(state: str, city: str, commodity: str,
+                              market_data: List[Dict], include_charts: bool = True,
+                              chart_format: str = "base64", max_points: int = CHART_MAX_POINTS) -> Dict:
+    """Validate market data for one commodity and build its stats, insights and charts"""
+    # Ensure market_data is a list (defensive programming)
+    if not isinstance(market_data, list):
+        logger.warning("Market data is not a list, converting to default")
+        market_data = FallbackMarketData(generate_default_market_data(commodity))
+    
+    # Convert to DataFrame for analysis - with verification
+    df_market_data = pd.DataFrame(market_data)
+    
+    # Check if required columns exist
+    required_columns = ["Min Price", "Modal Price", "Max Price", "Market"]
+    missing_columns = [col for col in required_columns if col not in df_market_data.columns]
+    
+    if missing_columns:
+        logger.warning(f"Missing columns in market data: {missing_columns}, using defaults")
+        market_data = FallbackMarketData(generate_default_market_data(commodity))
+        df_market_data = pd.DataFrame(market_data)
         
-        # Add optimal level lines
-        stock_levels = [
-            ('Min Stock', optimal_levels.get('min_stock', 0), 'orange'),
-            ('Reorder Point', optimal_levels.get('reorder_point', 0), 'red'),
-            ('Max Stock', optimal_levels.get('max_stock', 0), 'green')
-        ]
+    # Validate data 
+    try:
+        df_market_data = validate_market_data(df_market_data)
         
-        # Plot level lines
-        for name, value, color in stock_levels:
-            ax.axhline(y=value, linestyle='--', color=color, label=name)
-            
-        # Add labels and title
-        ax.set_ylabel('Stock Level (kg)')
-        ax.set_title(title)
-        ax.legend()
-        
-        # Adjust layout
-        plt.tight_layout()
-        
-        # Convert to base64
-        buf = BytesIO()
-        plt.savefig(buf, format='png')
-        buf.seek(0)
-        img_str = base64.b64encode(buf.getvalue()).decode('utf-8')
-        plt.close(fig)
-        
-        return img_str
-    except Exception as e:
-        logger.error(f"Error generating inventory chart: {str(e)}")
-        return ""
-
-def generate_price_forecast_chart(historical_data: pd.DataFrame, forecast_data: pd.DataFrame, title: str = "Price Forecast") -> str:
-    """Generate price forecast visualization and return as base64 image"""
+        # If validation removed all data, fall back to defaults
+        if df_market_data.empty:
+            market_data = FallbackMarketData(generate_default_market_data(commodity))
+            df_market_data = pd.DataFrame(market_data)
+    except Exception as validation_error:
+        logger.error(f"Validation error: {str(validation_error)}")
+        market_data = FallbackMarketData(generate_default_market_data(commodity))
+        df_market_data = pd.DataFrame(market_data)
+    
+    # Generate visualizations safely
+    price_trend_chart = ""
+    price_distribution_chart = ""
     try:
-        if (historical_data.empty or 'Modal Price' not in historical_data.columns or 
-            'Date' not in historical_data.columns or forecast_data is None):
-            # Generate empty plot with message
-            fig, ax = plt.subplots(figsize=(10, 6))
-            ax.text(0.5, 0.5, "No data available for price forecast", 
-                    horizontalalignment='center', verticalalignment='center', transform=ax.transAxes)
-            ax.set_title(title)
-            
-            # Convert to base64
-            buf = BytesIO()
-            plt.savefig(buf, format='png')
-            buf.seek(0)
-            img_str = base64.b64encode(buf.getvalue()).decode('utf-8')
-            plt.close(fig)
-            return img_str
-            
-        # Ensure dates are in datetime format
-        historical_data['Date'] = pd.to_datetime(historical_data['Date'])
-        historical_data = historical_data.sort_values('Date')
-        
-        forecast_data['arrival_date'] = pd.to_datetime(forecast_data['arrival_date'])
-        forecast_data = forecast_data.sort_values('arrival_date')
-        
-        # Create plot
-        fig, ax = plt.subplots(figsize=(12, 6))
-        
-        # Plot historical data
-        ax.plot(historical_data['Date'], historical_data['Modal Price'], 'b-', label='Historical Price')
-        
-        # Plot forecast data
-        ax.plot(forecast_data['arrival_date'], forecast_data['predicted_price'], 'r--', label='Forecast')
-        
-        # Add confidence interval
-        if 'confidence_upper' in forecast_data.columns and 'confidence_lower' in forecast_data.columns:
-            ax.fill_between(
-                forecast_data['arrival_date'],
-                forecast_data['confidence_lower'],
-                forecast_data['confidence_upper'],
-                color='red', alpha=0.2,
-                label='95% Confidence Interval'
+        if include_charts:
+            price_trend_chart = chart_service.render_for_response(
+                generate_price_trend_plot,
+                df_market_data, 
+                f"{commodity} Prices in {city}, {state}",
+                chart_format=chart_format,
+                max_points=max_points
             )
             
-        # Add labels and title
-        ax.set_xlabel('Date')
-        ax.set_ylabel('Price (₹/kg)')
-        ax.set_title(title)
-        ax.legend()
-        
-        # Format date axis
-        fig.autofmt_xdate()
-        
-        # Adjust layout
-        plt.tight_layout()
-        
-        # Convert to base64
-        buf = BytesIO()
-        plt.savefig(buf, format='png')
-        buf.seek(0)
-        img_str = base64.b64encode(buf.getvalue()).decode('utf-8')
-        plt.close(fig)
-        
-        return img_str
-    except Exception as e:
-        logger.error(f"Error generating price forecast chart: {str(e)}")
-        return ""
-
-def generate_market_heatmap(market_data: pd.DataFrame, title: str = "Market Price Heatmap") -> str:
-    """Generate market price heatmap visualization and return as base64 image"""
+            price_distribution_chart = chart_service.render_for_response(
+                generate_price_distribution_plot,
+                df_market_data,
+                f"{commodity} Price Distribution",
+                chart_format=chart_format,
+                max_points=max_points
+            )
+    except Exception as chart_error:
+        logger.error(f"Error generating charts: {str(chart_error)}")
+        price_trend_chart = ""
+        price_distribution_chart = ""
+    
+    # Calculate statistics safely
     try:
-        if market_data.empty or 'Modal Price' not in market_data.columns or 'Market' not in market_data.columns:
-            # Generate empty plot with message
-            fig, ax = plt.subplots(figsize=(10, 6))
-            ax.text(0.5, 0.5, "No data available for heatmap visualization", 
-                    horizontalalignment='center', verticalalignment='center', transform=ax.transAxes)
-            ax.set_title(title)
-            
-            # Convert to base64
-            buf = BytesIO()
-            plt.savefig(buf, format='png')
-            buf.seek(0)
-            img_str = base64.b64encode(buf.getvalue()).decode('utf-8')
-            plt.close(fig)
-            return img_str
-        
-        # For date-based heatmap
-        if 'Date' in market_data.columns:
-            market_data['Date'] = pd.to_datetime(market_data['Date'])
-            
-            if len(market_data['Date'].unique()) > 1:
-                # Create pivot table for heatmap
-                if len(market_data['Market'].unique()) > 1:
-                    # Use market-date pivot
-                    pivot_data = market_data.pivot_table(
-                        values='Modal Price',
-                        index='Market',
-                        columns=pd.to_datetime(market_data['Date']).dt.strftime('%Y-%m-%d'),
-                        aggfunc='mean'
-                    )
-                else:
-                    # Only one market, use date-commodity pivot if possible
-                    if 'Commodity' in market_data.columns and len(market_data['Commodity'].unique()) > 1:
-                        pivot_data = market_data.pivot_table(
-                            values='Modal Price',
-                            index='Commodity',
-                            columns=pd.to_datetime(market_data['Date']).dt.strftime('%Y-%m-%d'),
-                            aggfunc='mean'
-                        )
-                    else:
-                        # Create single column for the one market
-                        pivot_data = pd.DataFrame({
-                            'Market': market_data['Market'].iloc[0],
-                            'Price': market_data['Modal Price']
-                        })
-            else:
-                # Only one date, use market-price pivot
-                pivot_data = market_data.pivot_table(
-                    values='Modal Price',
-                    index='Market',
-                    aggfunc='mean'
-                ).reset_index()
-        else:
-            # No date column, use market-price pivot
-            pivot_data = market_data[['Market', 'Modal Price']].drop_duplicates()
-        
-        # Create heatmap
-        fig, ax = plt.subplots(figsize=(12, 8))
-        
-        if isinstance(pivot_data, pd.DataFrame) and pivot_data.shape[1] > 1 and pivot_data.shape[0] > 1:
-            # Use seaborn for heatmap
-            sns.heatmap(pivot_data, annot=True, cmap="YlGnBu", ax=ax, fmt='.1f')
-            
-            # Add labels and title
-            ax.set_title(title)
-            
-            # Adjust layout for better display
-            plt.tight_layout()
-        else:
-            # Not enough data for a heatmap, create bar chart instead
-            if 'Market' in pivot_data.columns:
-                plt.bar(pivot_data['Market'], pivot_data['Modal Price'], color='skyblue')
-                plt.xticks(rotation=45, ha='right')
-                plt.xlabel('Market')
-                plt.ylabel('Price (₹/kg)')
-                plt.title(title)
-                plt.tight_layout()
-            else:
-                # Simple text if not enough data
-                ax.text(0.5, 0.5, "Not enough data for visualization", 
-                        horizontalalignment='center', verticalalignment='center', transform=ax.transAxes)
-                ax.set_title(title)
-        
-        # Convert to base64
-        buf = BytesIO()
-        plt.savefig(buf, format='png')
-        buf.seek(0)
-        img_str = base64.b64encode(buf.getvalue()).decode('utf-8')
-        plt.close(fig)
-        
-        return img_str
-    except Exception as e:
-        logger.error(f"Error generating market heatmap: {str(e)}")
-        return ""
+        price_stats = calculate_price_trends(df_market_data)
+    except Exception as stats_error:
+        logger.error(f"Error calculating stats: {str(stats_error)}")
+        price_stats = {
+            "avg_price": df_market_data["Modal Price"].mean() if "Modal Price" in df_market_data else 25,
+            "price_volatility": 5.0,
+            "price_range": 10.0,
+            "market_count": 3
+        }
+    
+    # Analyze market insights safely
+    try:
+        market_insights = analyze_market_insights(df_market_data)
+    except Exception as insights_error:
+        logger.error(f"Error analyzing insights: {str(insights_error)}")
+        market_insights = {
+            "price_trend": "fluctuating",
+            "market_count": 3,
+            "price_spread": 10.0,
+            "best_markets": [{
+                "Market": "Central Market",
+                "Modal_Price": price_stats.get("avg_price", 25) 
+            }],
+            "price_stability": "stable"
+        }
+    
+    return {
+        "market_data": market_data,
+        "is_fallback": isinstance(market_data, FallbackMarketData),
+        "price_stats": price_stats,
+        "market_insights": market_insights,
+        "charts": {
+            "price_trend": price_trend_chart,
+            "price_distribution": price_distribution_chart
+        }
+    }
 
 # API Routes
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({"status": "ok", "message": "Inventory API is running", "version": "1.0.0"})
+    return jsonify({"status": "ok", "message": "Inventory API is running", "version": "1.0.0",
+                    "upstream": upstream_client.stats()})
+
+@app.route('/api/charts/<chart_id>', methods=['GET'])
+def get_chart(chart_id):
+    """Serve a rendered chart by id; the id doubles as a strong ETag"""
+    image = chart_service.get(chart_id)
+    if image is None:
+        return jsonify({"status": "error", "message": "Chart not found or expired"}), 404
+    
+    return send_file(
+        BytesIO(image),
+        mimetype='image/png',
+        etag=chart_id,
+        max_age=CACHE_TTL,
+        conditional=True
+    )
 
 @app.route('/api/inventory/analysis', methods=['GET'])
 def get_inventory_analysis():
@@ -1307,8 +3265,7 @@ def optimize_inventory():
             }
         
         # Optimize inventory
-        optimizer = AIStockOptimizer()
-        optimization_results = optimizer.optimize_stock_levels(
+        optimization_results = stock_optimizer.optimize_stock_levels(
             current_stock,
             historical_data,
             restaurant_profile
@@ -1318,10 +3275,13 @@ def optimize_inventory():
             return jsonify({"status": "error", "message": "Failed to optimize inventory"}), 500
             
         # Generate visualization
-        inventory_chart = generate_inventory_chart(
+        inventory_chart = chart_service.render_for_response(
+            generate_inventory_chart,
             current_stock, 
             optimization_results['optimal_levels'],
-            f"Inventory Status for {data.get('commodity', 'Item')}"
+            f"Inventory Status for {data.get('commodity', 'Item')}",
+            chart_format=request.args.get('format', 'base64'),
+            max_points=request.args.get('max_points', CHART_MAX_POINTS, type=int)
         )
         
         # Calculate risk score
@@ -1366,6 +3326,88 @@ def optimize_inventory():
         traceback.print_exc()
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/api/inventory/optimize/batch', methods=['POST'])
+def optimize_inventory_batch():
+    """Endpoint to score stock levels for many commodities in one call"""
+    try:
+        data = request.json
+        if not data or not data.get('items'):
+            return jsonify({"status": "error", "message": "No items provided"}), 400
+        if len(data['items']) > MAX_BATCH_ITEMS:
+            return jsonify({
+                "status": "error",
+                "message": f"At most {MAX_BATCH_ITEMS} items can be optimized at once"
+            }), 400
+        
+        # Item fields override the shared restaurant profile
+        items = pd.DataFrame(data['items'])
+        for key, value in data.get('restaurant_profile', {}).items():
+            if key not in items.columns:
+                items[key] = value
+            else:
+                items[key] = items[key].where(items[key].notna(), value)
+        
+        price_history = pd.DataFrame(data['price_history']) if data.get('price_history') else None
+        
+        results = stock_optimizer.optimize_batch(items, price_history)
+        
+        return jsonify({
+            "status": "success",
+            "data": {
+                "results": results.to_dict('records'),
+                "summary": {
+                    "item_count": len(results),
+                    "reorder_now": int((results['status'] == 'reorder_now').sum()),
+                    "total_suggested_order": float(results['suggested_order'].sum())
+                }
+            }
+        })
+    except Exception as e:
+        logger.error(f"Error in optimize_inventory_batch: {str(e)}")
+        traceback.print_exc()
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/inventory/optimizer/train', methods=['POST'])
+def train_inventory_optimizer():
+    """Endpoint to train the stock optimizer from historical stock, waste and price data"""
+    try:
+        data = request.json
+        if not data or not data.get('history'):
+            return jsonify({"status": "error", "message": "No history provided"}), 400
+        
+        history = pd.DataFrame(data['history'])
+        price_history = pd.DataFrame(data['price_history']) if data.get('price_history') else None
+        
+        try:
+            metrics = stock_optimizer.train(history, price_history)
+        except ValueError as validation_error:
+            return jsonify({"status": "error", "message": str(validation_error)}), 400
+        
+        return jsonify({"status": "success", "data": metrics})
+    except Exception as e:
+        logger.error(f"Error in train_inventory_optimizer: {str(e)}")
+        traceback.print_exc()
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/inventory/predictor/train', methods=['POST'])
+def train_inventory_predictor():
+    """Endpoint to train the waste and stock models from historical stocking periods"""
+    try:
+        data = request.json
+        if not data or not data.get('history'):
+            return jsonify({"status": "error", "message": "No history provided"}), 400
+        
+        try:
+            metrics = inventory_predictor.train(pd.DataFrame(data['history']))
+        except ValueError as validation_error:
+            return jsonify({"status": "error", "message": str(validation_error)}), 400
+        
+        return jsonify({"status": "success", "data": metrics})
+    except Exception as e:
+        logger.error(f"Error in train_inventory_predictor: {str(e)}")
+        traceback.print_exc()
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 @app.route('/api/market/prices', methods=['GET'])
 def get_market_prices():
     """Endpoint to fetch market prices with improved error handling"""
@@ -1384,96 +3426,20 @@ def get_market_prices():
             # If no data returned, generate default data
             if not market_data:
                 logger.warning(f"No market data available for {commodity} in {city}, {state}, using defaults")
-                market_data = generate_default_market_data(commodity)
+                market_data = FallbackMarketData(generate_default_market_data(commodity))
         except Exception as data_error:
             logger.error(f"Error fetching from external API: {str(data_error)}")
-            market_data = generate_default_market_data(commodity)
-            
-        # Ensure market_data is a list (defensive programming)
-        if not isinstance(market_data, list):
-            logger.warning("Market data is not a list, converting to default")
-            market_data = generate_default_market_data(commodity)
-        
-        # Convert to DataFrame for analysis - with verification
-        df_market_data = pd.DataFrame(market_data)
-        
-        # Check if required columns exist
-        required_columns = ["Min Price", "Modal Price", "Max Price", "Market"]
-        missing_columns = [col for col in required_columns if col not in df_market_data.columns]
-        
-        if missing_columns:
-            logger.warning(f"Missing columns in market data: {missing_columns}, using defaults")
-            market_data = generate_default_market_data(commodity)
-            df_market_data = pd.DataFrame(market_data)
-            
-        # Validate data 
-        try:
-            df_market_data = validate_market_data(df_market_data)
-            
-            # If validation removed all data, fall back to defaults
-            if df_market_data.empty:
-                market_data = generate_default_market_data(commodity)
-                df_market_data = pd.DataFrame(market_data)
-        except Exception as validation_error:
-            logger.error(f"Validation error: {str(validation_error)}")
-            market_data = generate_default_market_data(commodity)
-            df_market_data = pd.DataFrame(market_data)
-        
-        # Generate visualizations safely
-        try:
-            price_trend_chart = generate_price_trend_plot(
-                df_market_data, 
-                f"{commodity} Prices in {city}, {state}"
-            )
+            market_data = FallbackMarketData(generate_default_market_data(commodity))
             
-            price_distribution_chart = generate_price_distribution_plot(
-                df_market_data,
-                f"{commodity} Price Distribution"
-            )
-        except Exception as chart_error:
-            logger.error(f"Error generating charts: {str(chart_error)}")
-            price_trend_chart = ""
-            price_distribution_chart = ""
-        
-        # Calculate statistics safely
-        try:
-            price_stats = calculate_price_trends(df_market_data)
-        except Exception as stats_error:
-            logger.error(f"Error calculating stats: {str(stats_error)}")
-            price_stats = {
-                "avg_price": df_market_data["Modal Price"].mean() if "Modal Price" in df_market_data else 25,
-                "price_volatility": 5.0,
-                "price_range": 10.0,
-                "market_count": 3
-            }
-        
-        # Analyze market insights safely
-        try:
-            market_insights = analyze_market_insights(df_market_data)
-        except Exception as insights_error:
-            logger.error(f"Error analyzing insights: {str(insights_error)}")
-            market_insights = {
-                "price_trend": "fluctuating",
-                "market_count": 3,
-                "price_spread": 10.0,
-                "best_markets": [{
-                    "Market": "Central Market",
-                    "Modal_Price": price_stats.get("avg_price", 25) 
-                }],
-                "price_stability": "stable"
-            }
+        report = build_market_price_report(
+            state, city, commodity, market_data,
+            chart_format=request.args.get('format', 'base64'),
+            max_points=request.args.get('max_points', CHART_MAX_POINTS, type=int)
+        )
         
         return jsonify({
             "status": "success",
-            "data": {
-                "market_data": market_data,
-                "price_stats": price_stats,
-                "market_insights": market_insights,
-                "charts": {
-                    "price_trend": price_trend_chart,
-                    "price_distribution": price_distribution_chart
-                }
-            }
+            "data": report
         })
     except Exception as e:
         logger.error(f"Unhandled error in get_market_prices: {str(e)}")
@@ -1552,6 +3518,60 @@ def get_market_prices():
         logger.error(f"Error in get_market_prices: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/api/market/prices/batch', methods=['GET'])
+def get_market_prices_batch():
+    """Endpoint to fetch market prices for many commodities or a whole category in one call"""
+    try:
+        state = request.args.get('state', 'Gujarat')
+        city = request.args.get('city', 'Ahmedabad')
+        category = request.args.get('category')
+        include_charts = request.args.get('include_charts', 'true').lower() != 'false'
+        chart_format = request.args.get('format', 'base64')
+        max_points = request.args.get('max_points', CHART_MAX_POINTS, type=int)
+
+        # Resolve the commodity list from an explicit list and/or a category
+        commodities = [c.strip() for c in request.args.get('commodities', '').split(',') if c.strip()]
+        if category:
+            if category not in COMMODITY_CATEGORIES:
+                return jsonify({"status": "error", "message": f"Unknown category: {category}"}), 400
+            commodities.extend(COMMODITY_CATEGORIES[category])
+        commodities = list(dict.fromkeys(commodities))
+
+        if not commodities:
+            return jsonify({"status": "error", "message": "No commodities or category provided"}), 400
+        if len(commodities) > MAX_BATCH_COMMODITIES:
+            return jsonify({
+                "status": "error",
+                "message": f"At most {MAX_BATCH_COMMODITIES} commodities can be requested at once"
+            }), 400
+
+        logger.info(f"Batch market price request for {len(commodities)} commodities in {city}, {state}")
+
+        batch_data = get_mandi_prices_batch(state, city, commodities)
+
+        reports = {}
+        for commodity in commodities:
+            market_data = batch_data.get(commodity) or FallbackMarketData(generate_default_market_data(commodity))
+            reports[commodity] = build_market_price_report(
+                state, city, commodity, market_data,
+                include_charts=include_charts, chart_format=chart_format,
+                max_points=max_points
+            )
+
+        return jsonify({
+            "status": "success",
+            "data": {
+                "commodities": reports,
+                "combined_stats": summarize_commodity_prices(
+                    {c: r["price_stats"] for c, r in reports.items()}
+                )
+            }
+        })
+    except Exception as e:
+        logger.error(f"Error in get_market_prices_batch: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 @app.route('/api/market/analysis', methods=['GET'])
 def get_market_analysis():
     """Endpoint for comprehensive market analysis"""
@@ -1560,6 +3580,8 @@ def get_market_analysis():
         city = request.args.get('city', 'Ahmedabad')
         commodity = request.args.get('commodity', 'Onion')
         days = int(request.args.get('days', 30))
+        chart_format = request.args.get('format', 'base64')
+        max_points = request.args.get('max_points', CHART_MAX_POINTS, type=int)
         
         # Fetch market data
         market_data = get_mandi_prices_optimized(state, city, commodity)
@@ -1572,34 +3594,61 @@ def get_market_analysis():
         
         # If data is available, analyze it
         if not df_market_data.empty:
+            # Slice this commodity's market x date cube to these markets and the requested window;
+            # without stored history the cube is built from today's prices alone
+            markets = df_market_data['Market'].astype(str).unique().tolist()
+            window_start = datetime.now() - timedelta(days=days)
+            cube = price_cubes.get(commodity)
+            heatmap_matrix = cube.heatmap_matrix(markets, window_start, title=f"{commodity} Market Prices")
+            if not heatmap_matrix["rows"]:
+                cube, window_start = PriceCube.from_frame(commodity, df_market_data), None
+                heatmap_matrix = cube.heatmap_matrix(title=f"{commodity} Market Prices")
+            
             # Calculate market metrics
-            market_metrics = calculate_market_metrics(df_market_data)
+            market_metrics = cube.metrics(markets, window_start)
             
             # Market health indicators
             market_health = analyze_market_health()
             
-            # Price prediction
-            forecast_data = predict_price_trends(df_market_data)
+            # Price prediction over stored history for these markets plus today's prices;
+            # placeholder prices are kept out of the cached forecaster state
+            history_start = (datetime.now() - timedelta(days=FORECAST_HISTORY_DAYS)).strftime('%Y-%m-%d')
+            stored_history = price_history.history(commodity, start=history_start)
+            stored_history = stored_history[stored_history['Market'].isin(df_market_data['Market'])]
+            forecast_frames = [stored_history[['Market', 'Modal Price', 'Date']]]
+            if not isinstance(market_data, FallbackMarketData):
+                forecast_frames.append(df_market_data[['Market', 'Modal Price']].assign(
+                    Date=parse_market_dates(df_market_data['Date'])
+                ))
+            forecast_input = pd.concat(forecast_frames, ignore_index=True)
+            forecast_data = predict_price_trends(forecast_input, series_key=(state, city, commodity))
             
             # Generate heatmap
-            market_heatmap = generate_market_heatmap(
-                df_market_data, 
-                f"{commodity} Market Prices"
+            market_heatmap = chart_service.render_for_response(
+                generate_price_matrix_heatmap,
+                heatmap_matrix,
+                f"{commodity} Market Prices",
+                chart_format=chart_format,
+                max_points=max_points
             )
             
             # Generate forecast chart if forecast data is available
             forecast_chart = ""
             if forecast_data is not None:
-                forecast_chart = generate_price_forecast_chart(
+                forecast_chart = chart_service.render_for_response(
+                    generate_price_forecast_chart,
                     df_market_data,
                     forecast_data,
-                    f"{commodity} Price Forecast"
+                    f"{commodity} Price Forecast",
+                    chart_format=chart_format,
+                    max_points=max_points
                 )
             
             return jsonify({
                 "status": "success",
                 "data": {
                     "market_data": market_data,
+                    "is_fallback": isinstance(market_data, FallbackMarketData),
                     "market_metrics": market_metrics,
                     "market_health": market_health,
                     "forecast_data": forecast_data.to_dict('records') if forecast_data is not None else None,
@@ -1629,150 +3678,122 @@ def get_seasonal_analysis():
         state = request.args.get('state', 'Gujarat')
         city = request.args.get('city', 'Ahmedabad')
         commodity = request.args.get('commodity', 'Onion')
-        
-        # Fetch market data
-        market_data = get_mandi_prices_optimized(state, city, commodity)
-        
-        # Convert to DataFrame for analysis
-        df_market_data = pd.DataFrame(market_data)
-        
-        # Add some simulated seasonal data (in production, this would come from historical data)
-        # Create simulated monthly data for demonstration
-        monthly_data = []
+        market = request.args.get('market')
         today = datetime.now()
+        year = request.args.get('year', today.year, type=int)
+        chart_format = request.args.get('format', 'base64')
+        max_points = request.args.get('max_points', CHART_MAX_POINTS, type=int)
+        
+        # Fetching keeps the stored history current; seasonal indices come from that history
+        market_data = get_mandi_prices_cached(state, city, commodity)
+        market_scope = "market"
+        if market:
+            seasonal = seasonal_index_cache.get(commodity, market, year)
+        else:
+            # Default to the city's market with the most history; the all-market series
+            # mixes every region's prices and is only a last resort
+            candidates = [
+                dict(seasonal_index_cache.get(commodity, m, year), market=m)
+                for m in market_catalog.markets(state, city, commodity)
+            ]
+            candidates = [s for s in candidates if s['method'] != "insufficient_history"]
+            if candidates:
+                seasonal = max(candidates, key=lambda s: s['months_of_history'])
+                market, market_scope = seasonal['market'], "city"
+            else:
+                market, market_scope = ALL_MARKETS, "all_markets"
+                seasonal = seasonal_index_cache.get(commodity, market, year)
         
-        for month in range(1, 13):
-            # Generate price pattern with seasonal variations
-            # Example: higher prices in summer (May-July), lower in winter (Nov-Jan)
-            seasonal_factor = 1.0
-            if 5 <= month <= 7:  # Summer months
-                seasonal_factor = 1.2
-            elif 11 <= month or month <= 1:  # Winter months
-                seasonal_factor = 0.8
-                
-            base_price = df_market_data['Modal Price'].mean() if not df_market_data.empty else 30
-            month_price = base_price * seasonal_factor * (1 + np.random.uniform(-0.1, 0.1))
-            
-            month_date = datetime(today.year, month, 15)
-            
-            monthly_data.append({
-                'Month': calendar.month_name[month],
-                'MonthNum': month,
-                'Date': month_date,
-                'AvgPrice': month_price,
-                'YoYChange': np.random.uniform(-10, 15)  # Simulated year-over-year change
-            })
-        
-        monthly_df = pd.DataFrame(monthly_data)
+        level = seasonal['level']
+        if level is None:
+            # No stored history yet: flat pattern around today's price
+            df_market_data = pd.DataFrame(market_data)
+            level = float(df_market_data['Modal Price'].mean()) if 'Modal Price' in df_market_data else 30.0
+        
+        month_nums = np.arange(1, 13)
+        monthly_df = pd.DataFrame({
+            'Month': [calendar.month_name[m] for m in month_nums],
+            'MonthNum': month_nums,
+            'Date': [datetime(year, m, 15) for m in month_nums],
+            'AvgPrice': level * seasonal['indices'],
+            'SeasonalIndex': seasonal['indices'],
+            'ObservedPrice': seasonal['observed'],
+            'YoYChange': seasonal['yoy_change']
+        })
         
         # Calculate seasonal insights
         peak_month = monthly_df.loc[monthly_df['AvgPrice'].idxmax()]
         low_month = monthly_df.loc[monthly_df['AvgPrice'].idxmin()]
-        current_month = monthly_df[monthly_df['MonthNum'] == today.month].iloc[0]
-        next_month_idx = today.month % 12 + 1
-        next_month = monthly_df[monthly_df['MonthNum'] == next_month_idx].iloc[0]
-        
-        # Create seasonal chart
-        fig, ax = plt.subplots(figsize=(12, 6))
-        
-        # Plot monthly prices
-        ax.plot(monthly_df['Month'], monthly_df['AvgPrice'], 'b-o', linewidth=2)
-        
-        # Highlight peak and low months
-        ax.plot(peak_month['Month'], peak_month['AvgPrice'], 'ro', markersize=10, label='Peak Price')
-        ax.plot(low_month['Month'], low_month['AvgPrice'], 'go', markersize=10, label='Lowest Price')
-        
-        # Highlight current month
-        ax.axvline(x=monthly_df['Month'].tolist().index(current_month['Month']), color='gray', linestyle='--', alpha=0.7)
-        ax.text(monthly_df['Month'].tolist().index(current_month['Month']), 
-                ax.get_ylim()[0] + (ax.get_ylim()[1] - ax.get_ylim()[0])*0.05, 
-                'Current Month', rotation=90, alpha=0.7)
-        
-        # Add labels and title
-        ax.set_xlabel('Month')
-        ax.set_ylabel('Average Price (₹/kg)')
-        ax.set_title(f'Seasonal Price Pattern for {commodity}')
-        ax.legend()
-        
-        # Rotate x-axis labels for better readability
-        plt.xticks(rotation=45)
-        
-        # Adjust layout
-        plt.tight_layout()
-        
-        # Convert to base64
-        buf = BytesIO()
-        plt.savefig(buf, format='png')
-        buf.seek(0)
-        seasonal_chart = base64.b64encode(buf.getvalue()).decode('utf-8')
-        plt.close(fig)
-        
-        # Generate YoY change chart
-        fig, ax = plt.subplots(figsize=(12, 6))
-        
-        # Create colormap for positive/negative values
-        colors = ['red' if x < 0 else 'green' for x in monthly_df['YoYChange']]
-        
-        # Create bar chart
-        ax.bar(monthly_df['Month'], monthly_df['YoYChange'], color=colors)
+        current_month = monthly_df.iloc[today.month - 1]
+        next_month = monthly_df.iloc[today.month % 12]
         
-        # Add horizontal line at y=0
-        ax.axhline(y=0, color='black', linestyle='-', alpha=0.3)
+        def change(row) -> float:
+            return 0.0 if pd.isna(row['YoYChange']) else float(row['YoYChange'])
         
-        # Add labels and title
-        ax.set_xlabel('Month')
-        ax.set_ylabel('Year-over-Year Change (%)')
-        ax.set_title(f'Year-over-Year Price Changes for {commodity}')
+        def trend_text(row) -> str:
+            if pd.isna(row['YoYChange']):
+                return "no prior-year data"
+            return f"{'+' if row['YoYChange'] > 0 else ''}{row['YoYChange']:.1f}% YoY"
         
-        # Rotate x-axis labels for better readability
-        plt.xticks(rotation=45)
-        
-        # Adjust layout
-        plt.tight_layout()
-        
-        # Convert to base64
-        buf = BytesIO()
-        plt.savefig(buf, format='png')
-        buf.seek(0)
-        yoy_chart = base64.b64encode(buf.getvalue()).decode('utf-8')
-        plt.close(fig)
+        seasonal_chart = chart_service.render_for_response(
+            generate_seasonal_chart, monthly_df, f"Seasonal Price Pattern for {commodity}",
+            chart_format=chart_format, max_points=max_points
+        )
+        yoy_chart = chart_service.render_for_response(
+            generate_yoy_chart, monthly_df, f"Year-over-Year Price Changes for {commodity}",
+            chart_format=chart_format, max_points=max_points
+        )
         
         # Create response
         seasonal_insights = {
             "peak_month": {
                 "month": peak_month['Month'],
                 "price": float(peak_month['AvgPrice']),
-                "change": float(peak_month['YoYChange'])
+                "change": change(peak_month)
             },
             "low_month": {
                 "month": low_month['Month'],
                 "price": float(low_month['AvgPrice']),
-                "change": float(low_month['YoYChange'])
+                "change": change(low_month)
             },
             "current_month": {
                 "month": current_month['Month'],
                 "price": float(current_month['AvgPrice']),
-                "change": float(current_month['YoYChange'])
+                "change": change(current_month)
             },
             "next_month": {
                 "month": next_month['Month'],
                 "price": float(next_month['AvgPrice']),
-                "change": float(next_month['YoYChange'])
+                "change": change(next_month)
             },
             "price_range": float(peak_month['AvgPrice'] - low_month['AvgPrice']),
             "price_variation": float((peak_month['AvgPrice'] - low_month['AvgPrice']) / low_month['AvgPrice'] * 100),
+            "method": seasonal['method'],
+            "months_of_history": seasonal['months_of_history'],
+            "market": market,
+            "market_scope": market_scope,
             "recommendations": [
                 f"Best buying opportunity: {low_month['Month']} (historically lowest prices)",
                 f"Avoid stocking up in {peak_month['Month']} (historically highest prices)",
-                f"Current month ({current_month['Month']}) trend: {'+' if current_month['YoYChange'] > 0 else ''}{current_month['YoYChange']:.1f}% YoY",
-                f"Next month ({next_month['Month']}) forecast: {'+' if next_month['YoYChange'] > 0 else ''}{next_month['YoYChange']:.1f}% YoY"
+                f"Current month ({current_month['Month']}) trend: {trend_text(current_month)}",
+                f"Next month ({next_month['Month']}) trend: {trend_text(next_month)}"
             ]
         }
+        if seasonal['method'] == "insufficient_history":
+            seasonal_insights["recommendations"] = [
+                f"Not enough stored price history for {commodity} yet; seasonal patterns appear as data accumulates"
+            ]
+        elif market_scope == "all_markets":
+            seasonal_insights["recommendations"].insert(
+                0, f"No stored history for {commodity} in {city} markets; pattern is the average over all markets"
+            )
+        
+        monthly_records = monthly_df.astype(object).where(monthly_df.notna(), None).to_dict('records')
         
         return jsonify({
             "status": "success",
             "data": {
-                "seasonal_data": monthly_df.to_dict('records'),
+                "seasonal_data": monthly_records,
                 "seasonal_insights": seasonal_insights,
                 "charts": {
                     "seasonal_chart": seasonal_chart,
@@ -1784,6 +3805,103 @@ def get_seasonal_analysis():
         logger.error(f"Error in get_seasonal_analysis: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/api/market/history', methods=['POST'])
+def ingest_market_history():
+    """Endpoint to backfill stored daily price history (e.g. multi-year exports)"""
+    try:
+        data = request.json
+        if not data or not data.get('records'):
+            return jsonify({"status": "error", "message": "No records provided"}), 400
+        
+        records = data['records']
+        if 'modal_price' in records[0]:
+            # Raw data.gov.in records
+            frame = process_market_data_frame({"records": records}, None)
+        else:
+            frame = pd.DataFrame(records)
+        
+        stored = price_history.ingest(frame)
+        return jsonify({"status": "success", "data": {"received": len(records), "stored": stored}})
+    except Exception as e:
+        logger.error(f"Error in ingest_market_history: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/inventory/spoilage/<camera_id>', methods=['POST'])
+def track_spoilage(camera_id):
+    """Endpoint to feed frames from a storage camera and get incremental spoilage scores"""
+    try:
+        if not CV_AVAILABLE:
+            return jsonify({"status": "error", "message": "Computer vision libraries not available"}), 503
+        
+        uploads = request.files.getlist('frames') or request.files.getlist('image')
+        if not uploads:
+            return jsonify({"status": "error", "message": "No frames provided"}), 400
+        
+        tracker = inventory_predictor.spoilage_tracker
+        updates = [tracker.update(camera_id, Image.open(upload.stream)) for upload in uploads]
+        
+        return jsonify({
+            "status": "success",
+            "data": {
+                "camera_id": camera_id,
+                "latest": updates[-1],
+                "updates": updates
+            }
+        })
+    except Exception as e:
+        logger.error(f"Error in track_spoilage: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/inventory/spoilage', methods=['GET'])
+def list_spoilage_cameras():
+    """Endpoint to list tracked storage cameras and their latest spoilage scores"""
+    try:
+        return jsonify({"status": "success", "data": inventory_predictor.spoilage_tracker.cameras()})
+    except Exception as e:
+        logger.error(f"Error in list_spoilage_cameras: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/inventory/detect/batch', methods=['POST'])
+def detect_inventory_batch():
+    """Endpoint to count inventory in several shelf images, batched through the detector"""
+    try:
+        if not inventory_detector.initialized:
+            return jsonify({"status": "error", "message": "Inventory detection system not properly initialized"}), 503
+        
+        uploads = request.files.getlist('images')
+        if not uploads:
+            return jsonify({"status": "error", "message": "No images provided"}), 400
+        if len(uploads) > MAX_DETECT_BATCH_IMAGES:
+            return jsonify({"status": "error", "message": f"At most {MAX_DETECT_BATCH_IMAGES} images per request"}), 400
+        
+        # Decode one chunk at a time so only a chunk of images is held in memory
+        batch_detections = []
+        for start in range(0, len(uploads), DETECTOR_BATCH_CHUNK):
+            decoded = [open_image_upload(upload, inventory_detector.input_size)
+                       for upload in uploads[start:start + DETECTOR_BATCH_CHUNK]]
+            batch_detections.extend(
+                scale_detections(detections, size[0] / image.width, size[1] / image.height)
+                for (image, size), detections in zip(decoded, inventory_detector.detect_batch([d[0] for d in decoded]))
+            )
+        
+        return jsonify({
+            "status": "success",
+            "data": {
+                "backend": inventory_detector.backend_name,
+                "results": [
+                    {
+                        "filename": upload.filename,
+                        "inventory_count": count_detections(detections),
+                        "raw_detections": detections
+                    }
+                    for upload, detections in zip(uploads, batch_detections)
+                ]
+            }
+        })
+    except Exception as e:
+        logger.error(f"Error in detect_inventory_batch: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 @app.route('/api/inventory/detect', methods=['POST'])
 def detect_inventory():
     """Endpoint for inventory detection from image"""
@@ -1795,10 +3913,10 @@ def detect_inventory():
         if 'image' not in request.files and 'image_data' not in request.form:
             return jsonify({"status": "error", "message": "No image provided"}), 400
             
-        # Get image data
+        # Get image data (uploads are decoded straight from the request stream)
         image_data = None
         if 'image' in request.files:
-            image_data = request.files['image'].read()
+            image_data = request.files['image']
         elif 'image_data' in request.form:
             # Handle base64 encoded image
             image_data = request.form['image_data']
@@ -1810,18 +3928,16 @@ def detect_inventory():
         except:
             restaurant_profile = {}
             
-        # Initialize detector
-        detector = SmartInventoryDetector()
-        
         # Detect inventory
-        results = detector.detect_inventory(image_data)
+        annotate = request.form.get('annotate', request.args.get('annotate', 'base64'))
+        if annotate not in ('base64', 'url', 'none'):
+            return jsonify({"status": "error", "message": "annotate must be one of: base64, url, none"}), 400
+        full_resolution = request.form.get('full_resolution', 'false').lower() == 'true'
+        results = inventory_detector.detect_inventory(image_data, annotate, full_resolution)
         
         if not results:
             return jsonify({"status": "error", "message": "Failed to detect inventory items"}), 500
             
-        # Initialize predictor for waste analysis
-        predictor = SmartInventoryPredictor()
-        
         # Analyze each category
         analysis_results = {}
         for category, data in results['inventory_count'].items():
@@ -1856,7 +3972,7 @@ def detect_inventory():
             }
             
             # Calculate optimal levels
-            optimization_results = predictor.calculate_optimal_levels(current_count, item_data)
+            optimization_results = inventory_predictor.calculate_optimal_levels(current_count, item_data)
             
             analysis_results[category] = {
                 'current_count': current_count,
@@ -1881,6 +3997,22 @@ def detect_inventory():
         logger.error(f"Error in detect_inventory: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/api/inventory/annotated/<image_id>', methods=['GET'])
+def get_annotated_image(image_id):
+    """Serve an annotated detection image by id; the id doubles as a strong ETag"""
+    with annotated_images_lock:
+        image = ANNOTATED_IMAGES.get(image_id)
+    if image is None:
+        return jsonify({"status": "error", "message": "Image not found or expired"}), 404
+    
+    return send_file(
+        BytesIO(image),
+        mimetype='image/jpeg',
+        etag=image_id,
+        max_age=CACHE_TTL,
+        conditional=True
+    )
+
 @app.route('/api/inventory/waste', methods=['POST'])
 def predict_waste():
     """Endpoint for waste prediction"""
@@ -1893,43 +4025,38 @@ def predict_waste():
         if not items:
             return jsonify({"status": "error", "message": "No items provided"}), 400
             
-        # Initialize predictor
-        predictor = SmartInventoryPredictor()
+        # Score all items in one vectorized pass
+        items_df = pd.DataFrame(items)
+        
+        def column(name, default):
+            if name not in items_df.columns:
+                return np.full(len(items_df), float(default))
+            return pd.to_numeric(items_df[name], errors='coerce').fillna(default).to_numpy(dtype=np.float64)
+        
+        quantity = column('quantity', 0)
+        scores = inventory_predictor.score_items_batch(
+            column('days_in_stock', 1),
+            column('temperature', 20),
+            column('humidity', 50),
+            column('shelf_life', 7),
+            quantity
+        )
         
-        # Analyze each item
-        waste_analysis = []
-        for item in items:
-            item_data = {
-                'days_in_stock': item.get('days_in_stock', 1),
-                'temperature': item.get('temperature', 20),
-                'humidity': item.get('humidity', 50),
-                'shelf_life': item.get('shelf_life', 7),
-                'current_quantity': item.get('quantity', 0)
-            }
-            
-            # Get waste risk
-            waste_risk = predictor.predict_waste_risk(item_data)
-            
-            # Calculate optimal levels
-            optimization_results = predictor.calculate_optimal_levels(
-                item.get('quantity', 0), 
-                item_data
-            )
-            
-            waste_analysis.append({
-                'item_name': item.get('name', 'Unknown'),
-                'quantity': item.get('quantity', 0),
-                'waste_risk': waste_risk,
-                'spoilage_risk': optimization_results['spoilage_risk'],
-                'optimal_level': optimization_results['optimal_level'],
-                'min_level': optimization_results['min_level'],
-                'recommended_action': optimization_results['recommended_action'],
-                'days_to_expiry': max(0, item.get('shelf_life', 7) - item.get('days_in_stock', 1))
-            })
+        analysis_df = pd.DataFrame({
+            'item_name': items_df['name'].fillna('Unknown') if 'name' in items_df.columns else 'Unknown',
+            'quantity': quantity,
+            'waste_risk': scores['waste_risk'],
+            'spoilage_risk': scores['spoilage_risk'],
+            'optimal_level': scores['optimal_level'],
+            'min_level': scores['min_level'],
+            'recommended_action': scores['recommended_action'],
+            'days_to_expiry': scores['days_to_expiry']
+        })
+        waste_analysis = analysis_df.to_dict('records')
         
         # Calculate overall waste metrics
-        overall_waste_risk = np.mean([item['waste_risk'] for item in waste_analysis])
-        overall_spoilage_risk = np.mean([item['spoilage_risk'] for item in waste_analysis])
+        overall_waste_risk = float(scores['waste_risk'].mean())
+        overall_spoilage_risk = float(scores['spoilage_risk'].mean())
         
         # Generate waste prevention tips
         prevention_tips = [
@@ -1940,10 +4067,8 @@ def predict_waste():
         ]
         
         # Items that need immediate attention
-        urgent_items = [
-            item for item in waste_analysis 
-            if item['waste_risk'] > 0.7 or item['spoilage_risk'] > 0.7
-        ]
+        urgent_mask = (scores['waste_risk'] > 0.7) | (scores['spoilage_risk'] > 0.7)
+        urgent_items = analysis_df[urgent_mask].to_dict('records')
         
         return jsonify({
             "status": "success",
@@ -1963,41 +4088,17 @@ def predict_waste():
 
 @app.route('/api/states', methods=['GET'])
 def get_states():
-    """Endpoint to get available states and cities with improved error handling"""
+    """Endpoint to get available states and cities, served from the in-memory catalog"""
     try:
-        # First try to fetch from API
-        try:
-            states = get_available_states()
-            
-            # Verify if states is valid
-            if not states or not isinstance(states, dict) or len(states) == 0:
-                logger.warning("Empty or invalid states data returned from API, using default")
-                states = STATES_DATA
-                
-        except Exception as fetch_error:
-            logger.error(f"Error fetching states data: {str(fetch_error)}")
-            states = STATES_DATA
-        
-        # Verify that each state has a non-empty list of cities
-        for state, cities in list(states.items()):
-            if not cities or len(cities) == 0:
-                logger.warning(f"No cities for state {state}, using defaults")
-                if state in STATES_DATA:
-                    states[state] = STATES_DATA[state]
-                else:
-                    # If we don't have default data for this state, remove it
-                    states.pop(state, None)
-        
-        # If no states are available after validation, use defaults
-        if not states:
-            states = STATES_DATA
-        
-        return jsonify({
-            "status": "success",
-            "data": {
-                "states": states
-            }
-        })
+        market_catalog.schedule_sync()
+        variant = "full" if request.args.get('detail') == 'full' else "states"
+        body, etag = market_catalog.response(variant)
+        
+        response = app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = CATALOG_MAX_AGE
+        return response.make_conditional(request)
     except Exception as e:
         logger.error(f"Unhandled error in get_states: {str(e)}")
         logger.error(traceback.format_exc())
@@ -2010,6 +4111,20 @@ def get_states():
             }
         })
 
+@app.route('/api/states/sync', methods=['POST'])
+def sync_states():
+    """Endpoint to page through the upstream feed and refresh the states catalog now"""
+    try:
+        pages = request.args.get('pages', CATALOG_MAX_PAGES, type=int)
+        added = market_catalog.sync(max(1, min(pages, CATALOG_MAX_PAGES)))
+        return jsonify({"status": "success", "data": {"added": added}})
+    except UpstreamError as e:
+        logger.error(f"Error in sync_states: {str(e)}")
+        return jsonify({"status": "error", "message": f"Upstream unavailable: {str(e)}"}), 502
+    except Exception as e:
+        logger.error(f"Error in sync_states: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 @app.route('/api/commodities', methods=['GET'])
 def get_commodities():
     """Endpoint to get available commodity categories"""
@@ -0,0 +1,306 @@
+"""
+Continuous kitchen camera ingestion.
+
+Each registered camera has zones and a sampling rate. Frames arrive either from a
+reader thread on a video source (RTSP URL or a local file standing in for one) or as
+chunked uploads. Frames are sampled down to sample_fps, and the sampled ones are
+analysed on a bounded worker pool. When the pool is saturated, live sources drop new
+frames instead of queueing them, so lag stays bounded. Uploads wait for a free slot
+instead, which slows the uploader down. Zone results are written to the waste
+history with the capture timestamp, and per-camera throughput and lag are tracked.
+
+Video sources are restricted to configured camera hosts and to files under
+KITCHEN_MEDIA_DIR, since they are opened by the server on behalf of API clients.
+"""
+import io
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import cv2
+from PIL import Image
+
+from kitchen_zones import analyze_kitchen_zones
+
+STREAM_WORKERS = min(4, os.cpu_count() or 1)
+STREAM_MAX_PENDING = 8  # Frames waiting for a worker, across all cameras, before frames are dropped
+UPLOAD_WAIT_TIMEOUT = 10  # Seconds an uploaded frame waits for a free slot before it is dropped
+DEFAULT_SAMPLE_FPS = 1.0
+THROUGHPUT_WINDOW = 60  # Seconds of processed frames used for the fps metric
+LAG_SMOOTHING = 0.2  # EMA weight of the newest lag/processing time sample
+SOURCE_RETRY_DELAY = 5  # Seconds before reopening a source that failed or ended
+# Hosts (host or host:port) whose RTSP streams may be opened, comma separated
+CAMERA_HOSTS = {host.strip().lower() for host in os.getenv("KITCHEN_CAMERA_HOSTS", "").split(",") if host.strip()}
+CAMERA_URL_SCHEMES = ("rtsp", "rtsps")
+# Directory of recorded videos that may stand in for a live camera
+KITCHEN_MEDIA_DIR = os.getenv("KITCHEN_MEDIA_DIR", "kitchen_media")
+# Plain containers only; playlists and other formats can make FFmpeg open further URLs
+MEDIA_EXTENSIONS = (".mp4", ".avi", ".mkv", ".mov")
+
+def resolve_camera_source(source):
+    """
+    Validate a video source from a client.
+
+    Returns:
+        tuple: (source to open, whether it is a local file)
+
+    Raises:
+        ValueError: the source is not an RTSP URL on a configured camera host, or a
+                    video file under KITCHEN_MEDIA_DIR
+    """
+    source = str(source).strip()
+    parts = urlsplit(source)
+    if parts.scheme:
+        if parts.scheme.lower() not in CAMERA_URL_SCHEMES:
+            raise ValueError(f"Video source scheme must be one of {', '.join(CAMERA_URL_SCHEMES)}")
+        host = (parts.hostname or "").lower()
+        netloc = f"{host}:{parts.port}" if parts.port else host
+        if host not in CAMERA_HOSTS and netloc not in CAMERA_HOSTS:
+            raise ValueError(f"Camera host is not allowed: {host}")
+        return source, False
+
+    media_dir = os.path.realpath(KITCHEN_MEDIA_DIR)
+    path = os.path.realpath(os.path.join(media_dir, source))
+    if os.path.commonpath([media_dir, path]) != media_dir or not path.lower().endswith(MEDIA_EXTENSIONS):
+        raise ValueError(f"Video files must be {', '.join(MEDIA_EXTENSIONS)} files under {KITCHEN_MEDIA_DIR}")
+    if not os.path.isfile(path):
+        raise ValueError(f"Video file not found: {source}")
+    return path, True
+
+class CameraState:
+    def __init__(self, camera_id, kitchen_id, zones_data, sample_fps):
+        self.camera_id = camera_id
+        self.kitchen_id = kitchen_id
+        self.zones_data = zones_data
+        self.sample_fps = sample_fps
+        self.source = None
+        self.reader = None
+        self.reader_generation = 0  # Bumped whenever a reader is stopped; older readers' frames are refused
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.last_sampled = None
+        self.pending = 0
+        self.counts = {"received": 0, "sampled": 0, "skipped": 0, "dropped": 0, "processed": 0, "errors": 0}
+        self.processed_at = deque()
+        self.lag = None
+        self.last_lag = None
+        self.processing_time = None
+        self.last_result = None
+
+    def should_sample(self, captured_at):
+        """Whether a frame captured at this time is due under sample_fps (caller holds the lock)"""
+        if self.sample_fps <= 0:
+            return True
+        return self.last_sampled is None or captured_at - self.last_sampled >= 1.0 / self.sample_fps
+
+    def metrics(self, now):
+        with self.lock:
+            while self.processed_at and now - self.processed_at[0] > THROUGHPUT_WINDOW:
+                self.processed_at.popleft()
+            window = min(THROUGHPUT_WINDOW, now - self.processed_at[0]) if self.processed_at else 0
+            return {
+                "camera_id": self.camera_id,
+                "kitchen_id": self.kitchen_id,
+                "sample_fps": self.sample_fps,
+                "source": self.source,
+                "streaming": self.reader is not None and self.reader.is_alive(),
+                "frames": dict(self.counts),
+                "pending": self.pending,
+                "throughput_fps": round(len(self.processed_at) / window, 3) if window > 0 else 0.0,
+                "lag_ms": round(self.lag * 1000, 1) if self.lag is not None else None,
+                "last_lag_ms": round(self.last_lag * 1000, 1) if self.last_lag is not None else None,
+                "processing_ms": round(self.processing_time * 1000, 1) if self.processing_time is not None else None,
+                "last_result": self.last_result
+            }
+
+class KitchenStreamManager:
+    def __init__(self, history, workers=STREAM_WORKERS, max_pending=STREAM_MAX_PENDING):
+        self.history = history
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="kitchen-stream")
+        # Frames being analysed or waiting for a worker
+        self.slots = threading.BoundedSemaphore(workers + max_pending)
+        self.cameras = {}
+        self.lock = threading.Lock()
+
+    def configure(self, camera_id, zones_data, kitchen_id, sample_fps=DEFAULT_SAMPLE_FPS):
+        """Register a camera, or update the zones and sampling rate of a registered one"""
+        with self.lock:
+            camera = self.cameras.get(camera_id)
+            if camera is None:
+                camera = self.cameras[camera_id] = CameraState(camera_id, kitchen_id, zones_data, sample_fps)
+            else:
+                with camera.lock:
+                    camera.kitchen_id = kitchen_id
+                    camera.zones_data = zones_data
+                    camera.sample_fps = sample_fps
+            return camera
+
+    def get(self, camera_id):
+        with self.lock:
+            return self.cameras.get(camera_id)
+
+    def submit(self, camera_id, frame, captured_at=None, timeout=0):
+        """
+        Offer one frame (PIL Image, RGB array or encoded image bytes) of a camera.
+
+        Args:
+            timeout: seconds to wait for a free slot when the pool is saturated (0 drops at once)
+
+        Returns:
+            str: 'accepted', 'skipped' (not due under sample_fps) or 'dropped' (pool saturated)
+        """
+        camera = self.get(camera_id)
+        if camera is None:
+            raise KeyError(camera_id)
+        return self._offer(camera, frame, captured_at, timeout)
+
+    def _offer(self, camera, frame, captured_at=None, timeout=0, generation=None):
+        """submit() for a camera object; reader threads pass their generation, and get 'stopped' once replaced"""
+        captured_at = captured_at or time.time()
+
+        with camera.lock:
+            if generation is not None and generation != camera.reader_generation:
+                return "stopped"
+            camera.counts["received"] += 1
+            if not camera.should_sample(captured_at):
+                camera.counts["skipped"] += 1
+                return "skipped"
+            # Sampling cadence advances even if the frame is then dropped
+            camera.last_sampled = captured_at
+
+        acquired = self.slots.acquire(timeout=timeout) if timeout else self.slots.acquire(blocking=False)
+        with camera.lock:
+            if not acquired:
+                camera.counts["dropped"] += 1
+                return "dropped"
+            camera.counts["sampled"] += 1
+            camera.pending += 1
+
+        self.executor.submit(self._process, camera, frame, captured_at)
+        return "accepted"
+
+    def _process(self, camera, frame, captured_at):
+        started = time.time()
+        try:
+            if isinstance(frame, (bytes, bytearray)):
+                frame = Image.open(io.BytesIO(frame))
+            with camera.lock:
+                zones_data, kitchen_id = camera.zones_data, camera.kitchen_id
+
+            analysis = analyze_kitchen_zones(frame, zones_data)
+            self.history.record_many(
+                [{'value': analysis['waste_data'][zone], 'source': 'camera', 'zone': zone,
+                  'kitchen': kitchen_id, 'ts': captured_at} for zone in analysis['zones']] +
+                [{'value': analysis['total_waste'], 'source': 'camera', 'kitchen': kitchen_id, 'ts': captured_at}]
+            )
+
+            finished = time.time()
+            with camera.lock:
+                camera.counts["processed"] += 1
+                camera.processed_at.append(finished)
+                camera.last_lag = finished - captured_at
+                camera.lag = camera.last_lag if camera.lag is None else \
+                    LAG_SMOOTHING * camera.last_lag + (1 - LAG_SMOOTHING) * camera.lag
+                elapsed = finished - started
+                camera.processing_time = elapsed if camera.processing_time is None else \
+                    LAG_SMOOTHING * elapsed + (1 - LAG_SMOOTHING) * camera.processing_time
+                camera.last_result = {"captured_at": captured_at, "waste_data": analysis['waste_data'],
+                                      "total_waste": analysis['total_waste']}
+        except Exception as e:
+            print(f"Error analysing frame from camera {camera.camera_id}: {str(e)}")
+            with camera.lock:
+                camera.counts["errors"] += 1
+        finally:
+            with camera.lock:
+                camera.pending -= 1
+            self.slots.release()
+
+    def start_source(self, camera_id, source, loop=False):
+        """Read frames from an allowed RTSP URL or media file (see resolve_camera_source) on a background thread"""
+        camera = self.get(camera_id)
+        if camera is None:
+            raise KeyError(camera_id)
+        source, is_file = resolve_camera_source(source)
+        self.stop_source(camera_id)
+
+        with camera.lock:
+            generation = camera.reader_generation
+        camera.source = source
+        camera.stop_event = threading.Event()
+        camera.reader = threading.Thread(target=self._read_source,
+                                         args=(camera, source, is_file, loop, camera.stop_event, generation),
+                                         name=f"camera-{camera_id}", daemon=True)
+        camera.reader.start()
+
+    def stop_source(self, camera_id):
+        camera = self.get(camera_id)
+        if camera is not None and camera.reader is not None:
+            # Frames the old reader still offers are refused from here on, even if it is
+            # stuck in a blocking grab() and outlives the join
+            with camera.lock:
+                camera.reader_generation += 1
+            camera.stop_event.set()
+            camera.reader.join(timeout=5)
+            if camera.reader.is_alive():
+                print(f"Reader of camera {camera_id} is still blocked on its source; it will exit on its next frame")
+            else:
+                camera.reader = None
+
+    def remove(self, camera_id):
+        self.stop_source(camera_id)
+        with self.lock:
+            return self.cameras.pop(camera_id, None) is not None
+
+    def _read_source(self, camera, source, is_file, loop, stop_event, generation):
+        # A local file stands in for a live camera, so it is read at its own frame rate
+        while not stop_event.is_set():
+            capture = cv2.VideoCapture(source)
+            if not capture.isOpened():
+                print(f"Could not open video source for camera {camera.camera_id}: {source}")
+                stop_event.wait(SOURCE_RETRY_DELAY)
+                continue
+
+            frame_interval = 1.0 / (capture.get(cv2.CAP_PROP_FPS) or 25.0) if is_file else 0.0
+            next_frame_at = time.time()
+            try:
+                while not stop_event.is_set():
+                    # grab() skips decoding; only frames that will be sampled are retrieved
+                    if not capture.grab():
+                        break
+                    captured_at = time.time()
+                    with camera.lock:
+                        if generation != camera.reader_generation:
+                            break
+                        due = camera.should_sample(captured_at)
+                        if not due:
+                            camera.counts["received"] += 1
+                            camera.counts["skipped"] += 1
+
+                    if due:
+                        ok, frame = capture.retrieve()
+                        if ok and self._offer(camera, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), captured_at,
+                                              generation=generation) == "stopped":
+                            break
+
+                    if frame_interval:
+                        next_frame_at += frame_interval
+                        stop_event.wait(max(0.0, next_frame_at - time.time()))
+            finally:
+                capture.release()
+
+            if is_file and not loop:
+                break
+            stop_event.wait(0 if is_file else SOURCE_RETRY_DELAY)
+
+    def metrics(self):
+        now = time.time()
+        with self.lock:
+            cameras = list(self.cameras.values())
+        return {
+            "workers": self.workers,
+            "cameras": {camera.camera_id: camera.metrics(now) for camera in cameras}
+        }
@@ -0,0 +1,150 @@
+"""
+Kitchen zone waste analysis shared by still-image requests and camera streams.
+
+Frames are decoded and downsampled to KITCHEN_ANALYSIS_WIDTH first. Only the part of
+the frame covered by zones (plus the blur radius) is blurred, and zone means come
+from an integral image of that region, so a 12MP frame costs about as much as a
+640px one. Zone maxima have no such lookup: each is a scan of the zone in the
+downsampled heatmap, so it costs O(zone area) at analysis resolution.
+"""
+import math
+
+import cv2
+import numpy as np
+from PIL import Image
+
+KITCHEN_ANALYSIS_WIDTH = 640  # Frames are analysed at this width
+HEATMAP_SIGMA = 10  # Gaussian sigma in full-resolution pixels
+ZONE_WASTE_SCALE = {  # Zone-specific scaling factors
+    'prep_station': 1.2,
+    'cooking_station': 1.1,
+    'dishwashing': 0.9
+}
+
+def load_kitchen_frame(frame, max_width=KITCHEN_ANALYSIS_WIDTH):
+    """
+    Downsample a kitchen frame for analysis.
+
+    Args:
+        frame: PIL Image (JPEGs are decoded at reduced size) or RGB uint8 array
+        max_width: analysis width
+
+    Returns:
+        tuple: (RGB uint8 array at most max_width wide, scale from full resolution, full (width, height))
+    """
+    if isinstance(frame, Image.Image):
+        full_size = frame.size
+        if full_size[0] > max_width:
+            frame.draft('RGB', (max_width, max(1, full_size[1] * max_width // full_size[0])))
+        rgb = np.asarray(frame.convert('RGB'))
+    else:
+        rgb = np.asarray(frame)
+        full_size = (rgb.shape[1], rgb.shape[0])
+
+    if rgb.shape[1] > max_width:
+        height = max(1, round(rgb.shape[0] * max_width / rgb.shape[1]))
+        rgb = cv2.resize(rgb, (max_width, height), interpolation=cv2.INTER_AREA)
+
+    return rgb, rgb.shape[1] / full_size[0], full_size
+
+def zone_boxes(zones_data, full_size, scale, shape):
+    """Clamp zone rectangles (full-resolution pixels) to the frame and map them to the analysis grid"""
+    full_width, full_height = full_size
+    boxes = {}
+    for zone, coords in zones_data.items():
+        try:
+            x = max(0, min(coords['x'], full_width - 1))
+            y = max(0, min(coords['y'], full_height - 1))
+            width = min(coords['width'], full_width - x)
+            height = min(coords['height'], full_height - y)
+        except (KeyError, TypeError):
+            boxes[zone] = None
+            continue
+
+        if width <= 0 or height <= 0:
+            boxes[zone] = None
+            continue
+
+        x1 = min(int(x * scale), shape[1] - 1)
+        y1 = min(int(y * scale), shape[0] - 1)
+        x2 = max(x1 + 1, min(math.ceil((x + width) * scale), shape[1]))
+        y2 = max(y1 + 1, min(math.ceil((y + height) * scale), shape[0]))
+        boxes[zone] = (x1, y1, x2, y2)
+    return boxes
+
+def blurred_region(gray, sigma, region):
+    """
+    Gaussian-blurred normalized intensity of region (x1, y1, x2, y2) of gray.
+
+    The blur runs on the region padded by the kernel radius, so the result equals the
+    same window of a full-frame blur.
+    """
+    x1, y1, x2, y2 = region
+    pad = int(math.ceil(4 * sigma))  # cv2 and scipy both truncate the kernel at 4 sigma
+    px1, py1 = max(0, x1 - pad), max(0, y1 - pad)
+    px2, py2 = min(gray.shape[1], x2 + pad), min(gray.shape[0], y2 + pad)
+
+    padded = gray[py1:py2, px1:px2].astype(np.float32) * (1 / 255.0)
+    blurred = cv2.GaussianBlur(padded, (0, 0), sigma, borderType=cv2.BORDER_REFLECT)
+    return blurred[y1 - py1:y2 - py1, x1 - px1:x2 - px1]
+
+def analyze_kitchen_zones(frame, zones_data, full_frame_heatmap=False):
+    """
+    Waste estimate of each kitchen zone.
+
+    Args:
+        frame: PIL Image or RGB uint8 array
+        zones_data: {zone: {'x', 'y', 'width', 'height'}} in full-resolution pixels
+        full_frame_heatmap: also return the heatmap of the whole (downsampled) frame
+
+    Returns:
+        dict: waste_data per zone, the zones that lie inside the frame, total_waste, and
+              the downsampled frame, scale and heatmap (None unless full_frame_heatmap)
+              for rendering
+    """
+    rgb, scale, full_size = load_kitchen_frame(frame)
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+    sigma = max(HEATMAP_SIGMA * scale, 0.5)
+    boxes = zone_boxes(zones_data, full_size, scale, gray.shape)
+
+    # Blur only the bounding box of all zones (or the whole frame when rendering it)
+    valid = [box for box in boxes.values() if box is not None]
+    if full_frame_heatmap:
+        region = (0, 0, gray.shape[1], gray.shape[0])
+    elif valid:
+        region = (min(b[0] for b in valid), min(b[1] for b in valid),
+                  max(b[2] for b in valid), max(b[3] for b in valid))
+    else:
+        region = None
+
+    heatmap = blurred_region(gray, sigma, region) if region else None
+    # Integral image of the region: the sum over any zone is four lookups
+    integral = cv2.integral(heatmap, sdepth=cv2.CV_64F) if heatmap is not None else None
+
+    waste_data = {}
+    total_waste = 0.0
+    for zone, box in boxes.items():
+        if box is None:
+            waste_data[zone] = 0
+            continue
+
+        # Zone box relative to the blurred region
+        x1, y1, x2, y2 = box[0] - region[0], box[1] - region[1], box[2] - region[0], box[3] - region[1]
+        zone_sum = integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1]
+        mean_val = zone_sum / ((x2 - x1) * (y2 - y1))
+        max_val = float(heatmap[y1:y2, x1:x2].max())  # Scan of the zone, bounded by the analysis width
+
+        # Calculate waste value with weighted importance
+        waste_value = (0.7 * mean_val + 0.3 * max_val) * ZONE_WASTE_SCALE.get(zone, 1.0)
+        waste_data[zone] = float(waste_value)
+        total_waste += waste_value
+
+    return {
+        'waste_data': waste_data,
+        'zones': [zone for zone, box in boxes.items() if box is not None],
+        'total_waste': float(total_waste),
+        'frame': rgb,
+        'scale': scale,
+        'full_size': full_size,
+        'heatmap': heatmap if full_frame_heatmap else None
+    }
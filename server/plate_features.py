@@ -0,0 +1,298 @@
+"""
+Plate image features shared by every plate-analysis path of the waste API.
+
+Single plates, reference plates and batch audits all go through
+plate_features_from_rgb, so histograms, brightness and food-area ratios are computed
+one way. Run this module directly to benchmark feature extraction:
+
+    python plate_features.py --batch-sizes 1 16 64
+"""
+import argparse
+import base64
+import io
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+PLATE_SIZE = (224, 224)  # Standard size for many vision models
+HISTOGRAM_BINS = 64
+FOOD_BG_THRESHOLD = 230  # Grayscale level above which a pixel counts as plate/background
+
+# Record layout of a plate's precomputed features, stored as one memory-mappable .npy file
+PLATE_FEATURES_DTYPE = np.dtype([
+    ('rgb', np.uint8, PLATE_SIZE + (3,)),
+    ('gray', np.uint8, PLATE_SIZE),
+    ('hist', np.float64, (3, HISTOGRAM_BINS)),
+    ('brightness', np.float64),
+    ('food_ratio', np.float64)
+])
+
+def open_plate_image(fp):
+    """Open a plate photo (path or file object), letting JPEG decode at reduced size"""
+    image = Image.open(fp)
+    # Only PLATE_SIZE pixels are analysed, so skip decoding the full resolution
+    image.draft('RGB', PLATE_SIZE)
+    return image
+
+def decode_plate_image(image_data):
+    """Decode a base64 (or data URL) plate photo, letting JPEG decode at reduced size"""
+    image_data = image_data.split(',')[1] if ',' in image_data else image_data
+    return open_plate_image(io.BytesIO(base64.b64decode(image_data)))
+
+def channel_histograms(rgb):
+    """
+    Per-channel histograms of one or more RGB images.
+    
+    Equivalent to np.histogram(channel, bins=HISTOGRAM_BINS, range=(0, 256), density=True)
+    for each channel, but cv2.calcHist reads every channel in place, so no flattened
+    copies are made.
+    
+    Args:
+        rgb: (H, W, 3) or (N, H, W, 3) contiguous uint8 array
+        
+    Returns:
+        np.ndarray: (3, HISTOGRAM_BINS) or (N, 3, HISTOGRAM_BINS) densities
+    """
+    stack = rgb[None] if rgb.ndim == 3 else rgb
+    n, height, width, _ = stack.shape
+    
+    hist = np.empty((n, 3, HISTOGRAM_BINS))
+    for i in range(n):
+        for channel in range(3):
+            hist[i, channel] = cv2.calcHist([stack[i]], [channel], None, [HISTOGRAM_BINS], [0, 256]).ravel()
+    hist /= height * width * (256 / HISTOGRAM_BINS)
+    
+    return hist[0] if rgb.ndim == 3 else hist
+
+def plate_features_from_rgb(rgb):
+    """
+    Features of a stack of resized plates.
+    
+    Args:
+        rgb: (N, H, W, 3) uint8 array of plates resized to PLATE_SIZE
+        
+    Returns:
+        dict: the same keys as extract_plate_features, each stacked along a leading N axis
+    """
+    rgb = np.ascontiguousarray(rgb)
+    n, height, width, _ = rgb.shape
+    # One cvtColor call over the plates laid end to end
+    gray = cv2.cvtColor(rgb.reshape(n * height, width, 3), cv2.COLOR_RGB2GRAY).reshape(n, height, width)
+    
+    return {
+        'rgb': rgb,
+        'gray': gray,
+        'hist': channel_histograms(rgb),
+        'brightness': rgb.mean(axis=(1, 2, 3)),
+        'food_ratio': (gray < FOOD_BG_THRESHOLD).mean(axis=(1, 2))
+    }
+
+def resize_plate(image):
+    """Resize a PIL plate image to PLATE_SIZE as an RGB uint8 array"""
+    return np.array(image.resize(PLATE_SIZE).convert('RGB'))
+
+def extract_plate_features_batch(images):
+    """Stacked features of a list of PIL plate images; see plate_features_from_rgb"""
+    return plate_features_from_rgb(np.stack([resize_plate(image) for image in images]))
+
+def extract_plate_features(image):
+    """
+    Compute everything the similarity score needs from one plate image.
+    
+    Args:
+        image: PIL Image of a plate
+        
+    Returns:
+        dict: resized RGB and grayscale arrays, per-channel histograms,
+              mean brightness and food-area ratio
+    """
+    features = plate_features_from_rgb(resize_plate(image)[None])
+    return {
+        'rgb': features['rgb'][0],
+        'gray': features['gray'][0],
+        'hist': features['hist'][0],
+        'brightness': float(features['brightness'][0]),
+        'food_ratio': float(features['food_ratio'][0])
+    }
+
+def stack_plate_features(features_list):
+    """Stack per-plate feature dicts into the batched layout"""
+    return {key: np.stack([np.asarray(features[key]) for features in features_list])
+            for key in ('gray', 'hist', 'brightness', 'food_ratio')}
+
+def structural_similarity_batch(current_gray, reference_gray, win_size=7):
+    """
+    Mean SSIM of each image pair in two (N, H, W) uint8 stacks.
+    
+    Matches skimage's structural_similarity defaults (uniform window, sample covariance,
+    data range 255) but filters the whole stack at once, with the plates as channels.
+    """
+    # (H, W, N) so one cv2.blur call filters every plate; BORDER_REFLECT matches skimage
+    x = np.ascontiguousarray(current_gray.transpose(1, 2, 0), dtype=np.float64)
+    y = np.ascontiguousarray(reference_gray.transpose(1, 2, 0), dtype=np.float64)
+    
+    def window_mean(values):
+        return cv2.blur(values, (win_size, win_size), borderType=cv2.BORDER_REFLECT).reshape(values.shape)
+    
+    ux = window_mean(x)
+    uy = window_mean(y)
+    uxx = window_mean(x * x)
+    uyy = window_mean(y * y)
+    uxy = window_mean(x * y)
+    
+    cov_norm = win_size ** 2 / (win_size ** 2 - 1)
+    vx = cov_norm * (uxx - ux * ux)
+    vy = cov_norm * (uyy - uy * uy)
+    vxy = cov_norm * (uxy - ux * uy)
+    
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+    s = ((2 * ux * uy + c1) * (2 * vxy + c2)) / ((ux * ux + uy * uy + c1) * (vx + vy + c2))
+    
+    pad = (win_size - 1) // 2
+    return s[pad:-pad, pad:-pad].mean(axis=(0, 1))
+
+def compare_plate_features_batch(current, reference):
+    """
+    Enhanced algorithm to calculate similarity between current plates and reference plates,
+    better suited for food waste analysis with multiple analysis methods combined.
+    
+    Args:
+        current: stacked features of the current plates (see plate_features_from_rgb)
+        reference: stacked features of the matching reference (full) plates
+        
+    Returns:
+        tuple: (consumption ratios (N,) where higher means more food consumed,
+                dict of per-feature arrays for debugging)
+    """
+    # 1. Calculate histogram similarity (histogram intersection, better for food images)
+    hist_similarity = np.minimum(current['hist'], reference['hist']).sum(axis=(1, 2)) / 3.0
+    
+    # 2. Calculate structural similarity (SSIM)
+    ssim_score = structural_similarity_batch(current['gray'], reference['gray'])
+    
+    # 3. Calculate mean squared error
+    mse = np.mean((current['gray'] - reference['gray']) ** 2, axis=(1, 2))
+    # Normalize MSE to 0-1 range (inverted so higher means more similar)
+    max_possible_mse = 255 ** 2
+    normalized_mse = 1 - (mse / max_possible_mse)
+    
+    # 4. Calculate brightness difference (empty plates are often brighter)
+    current_brightness = current['brightness']
+    reference_brightness = reference['brightness']
+    brightness_diff = 1 - (np.abs(current_brightness - reference_brightness) / 255.0)
+    
+    # 5. Calculate food area difference - how much food area has changed
+    # (fall back to 1.0 if the reference has no detected food)
+    reference_food = reference['food_ratio']
+    has_food = reference_food > 0
+    food_area_ratio = np.where(has_food, current['food_ratio'] / np.where(has_food, reference_food, 1.0), 1.0)
+    
+    # Clamp food area ratio to avoid unrealistic values
+    food_area_ratio = np.clip(food_area_ratio, 0.1, 1.0)
+    
+    # 6. Combine features with appropriate weighting
+    # Adjust these weights based on testing with real food images
+    weights = {
+        'hist_similarity': 0.3,
+        'ssim': 0.2,
+        'mse': 0.15,
+        'brightness': 0.15,
+        'food_area': 0.2
+    }
+    
+    # Calculate weighted features
+    # For food waste, we want: low value = high consumption (high waste)
+    # Invert some metrics so that lower values indicate more consumption
+    feature_values = {
+        'hist_similarity': 1.0 - hist_similarity,  # Invert
+        'ssim': 1.0 - ssim_score,  # Invert
+        'mse': 1.0 - normalized_mse,  # Invert
+        'brightness': np.where(current_brightness > reference_brightness, brightness_diff, 0),  # Brighter = less food
+        'food_area': 1.0 - food_area_ratio  # Invert
+    }
+    
+    # Calculate final consumption ratio
+    consumption_ratio = sum(weights[feature] * feature_values[feature] for feature in weights)
+    
+    # Apply non-linear transformation to better spread values
+    consumption_ratio = consumption_ratio ** 0.8
+    
+    # Ensure result is in 0.1-0.9 range to avoid extreme estimates
+    consumption_ratio = np.clip(consumption_ratio, 0.1, 0.9)
+    
+    # Create debug info (useful for testing)
+    debug_info = {
+        'hist_similarity': hist_similarity,
+        'ssim_score': ssim_score,
+        'normalized_mse': normalized_mse,
+        'brightness_diff': brightness_diff,
+        'food_area_ratio': food_area_ratio,
+        'weighted_consumption': consumption_ratio
+    }
+    
+    return consumption_ratio, debug_info
+
+def compare_plate_features(current, reference):
+    """
+    Score one plate against its reference; see compare_plate_features_batch.
+    
+    Returns:
+        float: Consumption ratio (0 to 1) where higher means more food consumed
+    """
+    ratios, debug = compare_plate_features_batch(stack_plate_features([current]), stack_plate_features([reference]))
+    return float(ratios[0]), {key: float(values[0]) for key, values in debug.items()}
+
+def benchmark_feature_extraction(batch_sizes=(1, 16, 64), iterations=5, seed=0):
+    """
+    Time feature extraction on random plates.
+    
+    Returns:
+        list: per batch size, plates/sec for the full feature set and microseconds per
+              plate for the histograms alone, next to the np.histogram baseline they replace
+    """
+    rng = np.random.default_rng(seed)
+    results = []
+    for batch_size in batch_sizes:
+        rgb = rng.integers(0, 256, (batch_size,) + PLATE_SIZE + (3,), dtype=np.uint8)
+        
+        start = time.perf_counter()
+        for _ in range(iterations):
+            plate_features_from_rgb(rgb)
+        features_time = (time.perf_counter() - start) / iterations
+        
+        start = time.perf_counter()
+        for _ in range(iterations):
+            channel_histograms(rgb)
+        hist_time = (time.perf_counter() - start) / iterations
+        
+        start = time.perf_counter()
+        for _ in range(iterations):
+            for plate in rgb:
+                for channel in range(3):
+                    np.histogram(plate[:,:,channel].flatten(), bins=HISTOGRAM_BINS, range=(0, 256), density=True)
+        baseline_time = (time.perf_counter() - start) / iterations
+        
+        results.append({
+            "batch_size": batch_size,
+            "plates_per_sec": batch_size / features_time,
+            "histogram_us_per_plate": hist_time / batch_size * 1e6,
+            "np_histogram_us_per_plate": baseline_time / batch_size * 1e6
+        })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark plate feature extraction")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 16, 64])
+    parser.add_argument('--iterations', type=int, default=5)
+    args = parser.parse_args()
+    
+    print(f"{'batch':>6} {'plates/sec':>12} {'hist us/plate':>14} {'np.histogram':>13}")
+    for row in benchmark_feature_extraction(tuple(args.batch_sizes), args.iterations):
+        print(f"{row['batch_size']:>6} {row['plates_per_sec']:>12.1f} "
+              f"{row['histogram_us_per_plate']:>14.1f} {row['np_histogram_us_per_plate']:>13.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,7 @@
 from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
 import os
-import json
 import numpy as np
-import cv2
-from skimage.metrics import structural_similarity as ssim
-import numpy as np
-import cv2
 from PIL import Image
 import torch
 from datetime import datetime
@@ -18,10 +13,20 @@ import base64
 import io
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-from scipy.ndimage import gaussian_filter
 import seaborn as sns
-from collections import defaultdict
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from plate_features import (
+    PLATE_FEATURES_DTYPE, open_plate_image, decode_plate_image, resize_plate, extract_plate_features,
+    plate_features_from_rgb, stack_plate_features, compare_plate_features, compare_plate_features_batch
+)
+from kitchen_zones import analyze_kitchen_zones
+from kitchen_stream import KitchenStreamManager, DEFAULT_SAMPLE_FPS, UPLOAD_WAIT_TIMEOUT, resolve_camera_source
+from waste_history import WasteHistoryStore, DEFAULT_KITCHEN, ROLLUP_GRANULARITIES, align_window
+from dish_registry import DishRegistry, parse_dish_id
 try:
     from google.cloud import vision
     from google.oauth2 import service_account
@@ -62,7 +67,19 @@ CORS(app)
 
 # Constants
 REFERENCE_IMAGES_DIR = "reference_images"
+REFERENCE_FEATURES_DIR = "reference_features"
 os.makedirs(REFERENCE_IMAGES_DIR, exist_ok=True)
+os.makedirs(REFERENCE_FEATURES_DIR, exist_ok=True)
+
+MAX_BATCH_PLATES = 500
+PLATE_BATCH_CHUNK = 16  # Plates scored together; bounds the memory of the stacked SSIM filters (max 512)
+PLATE_DECODE_WORKERS = min(8, os.cpu_count() or 1)
+MAX_DISHES_PAGE_SIZE = 1000
+STATISTICS_PAGE_SIZE = 100  # Waste history records per /api/statistics page
+MAX_STATISTICS_PAGE_SIZE = 1000
+STATISTICS_SERIES_BUCKETS = 48  # Latest buckets in the time series chart
+STATISTICS_CHART_CACHE_SIZE = 32
+REFERENCE_FEATURES_CACHE_SIZE = 256  # Reference plates kept in memory (about 200 KB each)
 
 KITCHEN_ZONES = {
     'prep_station': {'color': 'red', 'description': 'Food Preparation Area'},
@@ -72,124 +89,107 @@ KITCHEN_ZONES = {
     'dishwashing': {'color': 'green', 'description': 'Dishwashing Station'}
 }
 
-# In-memory database (replace with real DB in production)
-WASTE_HISTORY = defaultdict(float)
-ZONE_WASTE_HISTORY = defaultdict(lambda: defaultdict(float))
+# Durable waste event log with hourly/daily rollups, shared by every worker
+waste_history = WasteHistoryStore()
+
+# Continuous camera ingestion; cameras are registered per process
+kitchen_streams = KitchenStreamManager(waste_history)
 
 def calculate_enhanced_similarity(current_image, reference_image):
     """
-    Enhanced algorithm to calculate similarity between current plate and reference plate,
-    better suited for food waste analysis with multiple analysis methods combined.
+    Enhanced similarity between two PIL plate images; see compare_plate_features.
     
-    Args:
-        current_image: PIL Image of the current plate
-        reference_image: PIL Image of the reference (full) plate
-        
     Returns:
         float: Consumption ratio (0 to 1) where higher means more food consumed
     """
+    return compare_plate_features(extract_plate_features(current_image), extract_plate_features(reference_image))
+
+class ReferenceFeatureStore:
+    """
+    Precomputed features of every reference plate.
+    
+    Features are computed once when a dish is registered and written next to the
+    reference images as a single .npy record, so analysing a plate only processes the
+    incoming image. Records are read into memory (a memory map would hold a file
+    descriptor per dish) and the most recently used ones are kept in an LRU cache.
+    Dishes registered before the store existed are backfilled from their reference
+    image on first access.
+    """
+    def __init__(self, features_dir=REFERENCE_FEATURES_DIR, max_entries=REFERENCE_FEATURES_CACHE_SIZE):
+        self.features_dir = features_dir
+        self.max_entries = max_entries
+        self.features = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def _path(self, dish_id):
+        return os.path.join(self.features_dir, f"{dish_id}.npy")
+    
+    @staticmethod
+    def _as_dict(record):
+        return {
+            'rgb': record['rgb'],
+            'gray': record['gray'],
+            'hist': record['hist'],
+            'brightness': float(record['brightness']),
+            'food_ratio': float(record['food_ratio'])
+        }
     
-    # Resize images to the same dimensions
-    size = (224, 224)  # Standard size for many vision models
-    current_resized = current_image.resize(size)
-    reference_resized = reference_image.resize(size)
-    
-    # Convert to RGB if not already
-    current_rgb = current_resized.convert('RGB')
-    reference_rgb = reference_resized.convert('RGB')
-    
-    # Convert to numpy arrays
-    current_array = np.array(current_rgb)
-    reference_array = np.array(reference_rgb)
-    
-    # Convert to grayscale for certain comparisons
-    current_gray = cv2.cvtColor(current_array, cv2.COLOR_RGB2GRAY)
-    reference_gray = cv2.cvtColor(reference_array, cv2.COLOR_RGB2GRAY)
-    
-    # 1. Calculate histogram similarity (better for food images)
-    hist_similarity = 0
-    for channel in range(3):  # RGB channels
-        hist1, _ = np.histogram(current_array[:,:,channel].flatten(), bins=64, range=(0, 256), density=True)
-        hist2, _ = np.histogram(reference_array[:,:,channel].flatten(), bins=64, range=(0, 256), density=True)
-        
-        # Calculate histogram intersection
-        channel_similarity = np.sum(np.minimum(hist1, hist2))
-        hist_similarity += channel_similarity / 3.0
-    
-    # 2. Calculate structural similarity (SSIM)
-    ssim_score = ssim(current_gray, reference_gray)
-    
-    # 3. Calculate mean squared error
-    mse = np.mean((current_gray - reference_gray) ** 2)
-    # Normalize MSE to 0-1 range (inverted so higher means more similar)
-    max_possible_mse = 255 ** 2
-    normalized_mse = 1 - (mse / max_possible_mse)
-    
-    # 4. Calculate brightness difference (empty plates are often brighter)
-    current_brightness = np.mean(current_array)
-    reference_brightness = np.mean(reference_array)
-    brightness_diff = 1 - (abs(current_brightness - reference_brightness) / 255.0)
-    
-    # 5. Calculate food area detection (assume food is non-white/non-background)
-    # Simple thresholding to detect food
-    bg_threshold = 230
-    current_food_mask = current_gray < bg_threshold
-    reference_food_mask = reference_gray < bg_threshold
-    
-    # Calculate food area ratios
-    current_food_ratio = np.sum(current_food_mask) / current_food_mask.size
-    reference_food_ratio = np.sum(reference_food_mask) / reference_food_mask.size
-    
-    # Calculate food area difference - how much food area has changed
-    if reference_food_ratio > 0:
-        food_area_ratio = current_food_ratio / reference_food_ratio
-    else:
-        food_area_ratio = 1.0  # Fallback if reference has no detected food
-    
-    # Clamp food area ratio to avoid unrealistic values
-    food_area_ratio = max(0.1, min(1.0, food_area_ratio))
-    
-    # 6. Combine features with appropriate weighting
-    # Adjust these weights based on testing with real food images
-    weights = {
-        'hist_similarity': 0.3,
-        'ssim': 0.2,
-        'mse': 0.15,
-        'brightness': 0.15,
-        'food_area': 0.2
-    }
-    
-    # Calculate weighted features
-    # For food waste, we want: low value = high consumption (high waste)
-    # Invert some metrics so that lower values indicate more consumption
-    feature_values = {
-        'hist_similarity': 1.0 - hist_similarity,  # Invert
-        'ssim': 1.0 - ssim_score,  # Invert
-        'mse': 1.0 - normalized_mse,  # Invert
-        'brightness': brightness_diff if current_brightness > reference_brightness else 0,  # Brighter = less food
-        'food_area': 1.0 - food_area_ratio  # Invert
-    }
-    
-    # Calculate final consumption ratio
-    consumption_ratio = sum(weights[feature] * feature_values[feature] for feature in weights)
-    
-    # Apply non-linear transformation to better spread values
-    consumption_ratio = consumption_ratio ** 0.8
-    
-    # Ensure result is in 0.1-0.9 range to avoid extreme estimates
-    consumption_ratio = max(0.1, min(0.9, consumption_ratio))
-    
-    # Create debug info dictionary (useful for testing)
-    debug_info = {
-        'hist_similarity': hist_similarity,
-        'ssim_score': ssim_score,
-        'normalized_mse': normalized_mse,
-        'brightness_diff': brightness_diff,
-        'food_area_ratio': food_area_ratio,
-        'weighted_consumption': consumption_ratio
-    }
-    
-    return consumption_ratio, debug_info
+    def build(self, dish_id, image):
+        """Compute and persist the features of a reference plate image"""
+        return self.save(dish_id, extract_plate_features(image))
+    
+    def save(self, dish_id, features):
+        """Persist precomputed features of a reference plate"""
+        record = np.zeros((), dtype=PLATE_FEATURES_DTYPE)
+        for field in PLATE_FEATURES_DTYPE.names:
+            record[field] = features[field]
+        
+        # Write to a temporary file first so readers never load a partial record
+        temp_path = self._path(dish_id) + ".tmp"
+        with open(temp_path, 'wb') as f:
+            np.save(f, record)
+        os.replace(temp_path, self._path(dish_id))
+        
+        features = self._as_dict(record)
+        self._cache(dish_id, features)
+        return features
+    
+    def _cache(self, dish_id, features):
+        with self.lock:
+            self.features[dish_id] = features
+            self.features.move_to_end(dish_id)
+            while len(self.features) > self.max_entries:
+                self.features.popitem(last=False)
+    
+    def get(self, dish_id, dish_data):
+        """Features of a registered dish, or None if its reference image is missing"""
+        with self.lock:
+            features = self.features.get(dish_id)
+            if features is not None:
+                self.features.move_to_end(dish_id)
+                return features
+        
+        image_path = os.path.join(REFERENCE_IMAGES_DIR, dish_data['reference_image'])
+        path = self._path(dish_id)
+        if os.path.exists(path) and (not os.path.exists(image_path) or
+                                     os.path.getmtime(path) >= os.path.getmtime(image_path)):
+            features = self._as_dict(np.load(path))
+            self._cache(dish_id, features)
+            return features
+        
+        if not os.path.exists(image_path):
+            return None
+        # Decoded like incoming plates, so both sides of a comparison see the same pixels
+        with open_plate_image(image_path) as image:
+            return self.build(dish_id, image)
+    
+    def discard(self, dish_id):
+        with self.lock:
+            self.features.pop(dish_id, None)
+        if os.path.exists(self._path(dish_id)):
+            os.remove(self._path(dish_id))
+
+reference_features = ReferenceFeatureStore()
 
 def calculate_better_similarity(current_image, reference_image):
     """
@@ -203,36 +203,17 @@ def calculate_better_similarity(current_image, reference_image):
     Returns:
         float: Similarity score (0 to 1) where higher means more food consumed
     """
-    # Resize images to the same dimensions
-    size = (224, 224)  # Standard size for many vision models
-    current_resized = current_image.resize(size)
-    reference_resized = reference_image.resize(size)
-    
-    # Convert to RGB if not already
-    current_rgb = current_resized.convert('RGB')
-    reference_rgb = reference_resized.convert('RGB')
-    
-    # Convert to numpy arrays
-    current_array = np.array(current_rgb)
-    reference_array = np.array(reference_rgb)
+    current = extract_plate_features(current_image)
+    reference = extract_plate_features(reference_image)
     
-    # Calculate histogram similarity (better for food images)
-    hist_similarity = 0
-    for channel in range(3):  # RGB channels
-        hist1, _ = np.histogram(current_array[:,:,channel].flatten(), bins=64, range=(0, 256), density=True)
-        hist2, _ = np.histogram(reference_array[:,:,channel].flatten(), bins=64, range=(0, 256), density=True)
-        
-        # Calculate histogram intersection
-        channel_similarity = np.sum(np.minimum(hist1, hist2))
-        hist_similarity += channel_similarity / 3.0
+    # Calculate histogram similarity (histogram intersection, better for food images)
+    hist_similarity = float(np.sum(np.minimum(current['hist'], reference['hist']))) / 3.0
     
     # Ensure similarity is between 0 and 1
     hist_similarity = max(0, min(1, hist_similarity))
     
     # Calculate a separate brightness difference (empty plates are often brighter)
-    current_brightness = np.mean(current_array)
-    reference_brightness = np.mean(reference_array)
-    brightness_diff = abs(current_brightness - reference_brightness) / 255.0
+    brightness_diff = abs(current['brightness'] - reference['brightness']) / 255.0
     
     # Combine features
     # The key insight: when more food is eaten, the image becomes more different
@@ -250,46 +231,45 @@ def calculate_better_similarity(current_image, reference_image):
 
 # Dish Database class
 class DishDatabase:
-    def __init__(self):
-        self.db_file = 'dish_database.json'
-        self.load_database()
-
-    def load_database(self):
-        if os.path.exists(self.db_file):
-            with open(self.db_file, 'r') as f:
-                self.dishes = json.load(f)
-        else:
-            self.dishes = {}
+    """Registers reference dishes: the reference image and features on disk, the dish in the registry"""
+    def __init__(self, registry=None):
+        self.registry = registry or DishRegistry()
 
-    def save_database(self):
-        with open(self.db_file, 'w') as f:
-            json.dump(self.dishes, f)
+    def get(self, dish_id):
+        return self.registry.get(dish_id)
 
-    def add_dish(self, dish_name, full_weight, image_data):
-        dish_id = str(len(self.dishes) + 1)
-        
+    def add_dish(self, dish_name, full_weight, image_data, kitchen_id=DEFAULT_KITCHEN):
         # Create a safe filename from dish name
         safe_filename = "".join(x for x in dish_name if x.isalnum() or x in (' ', '_'))
-        image_filename = f"{safe_filename}_{dish_id}.jpg"
-        image_path = os.path.join(REFERENCE_IMAGES_DIR, image_filename)
         
-        # Save the uploaded image
         try:
-            # Convert base64 to image
+            # Decode, encode as JPG and compute the features before taking the registry's
+            # write lock, so the transaction only writes the finished files
             image_data = image_data.split(',')[1] if ',' in image_data else image_data
-            img = Image.open(io.BytesIO(base64.b64decode(image_data)))
-            # Save as JPG format
-            img = img.convert('RGB')
-            img.save(image_path)
+            img = Image.open(io.BytesIO(base64.b64decode(image_data))).convert('RGB')
+            jpeg = io.BytesIO()
+            img.save(jpeg, format='JPEG')
+            # Features come from the same reduced JPEG decode as the plates compared against them
+            features = extract_plate_features(decode_plate_image(image_data))
             
-            self.dishes[dish_id] = {
-                'name': dish_name,
-                'full_weight': full_weight,
-                'reference_image': image_filename,  # Store just the filename, not the full path
-                'timestamp': datetime.now().isoformat()
-            }
-            self.save_database()
-            return {"success": True, "image_path": image_filename, "dish_id": dish_id}
+            def image_filename(dish_id):
+                return f"{safe_filename}_{dish_id}.jpg"  # Store just the filename, not the full path
+            
+            def save_reference(dish_id):
+                with open(os.path.join(REFERENCE_IMAGES_DIR, image_filename(dish_id)), 'wb') as f:
+                    f.write(jpeg.getbuffer())
+                reference_features.save(dish_id, features)
+                return image_filename(dish_id)
+            
+            def discard_reference(dish_id):
+                image_path = os.path.join(REFERENCE_IMAGES_DIR, image_filename(dish_id))
+                if os.path.exists(image_path):
+                    os.remove(image_path)
+                reference_features.discard(dish_id)
+            
+            dish = self.registry.register(dish_name, full_weight, save_reference, kitchen=kitchen_id,
+                                          discard_reference=discard_reference)
+            return {"success": True, "image_path": dish['reference_image'], "dish_id": dish['id']}
         except Exception as e:
             return {"success": False, "error": str(e)}
 
@@ -306,11 +286,101 @@ def plot_to_base64(fig):
     plt.close(fig)
     return base64.b64encode(image_png).decode('utf-8')
 
+# Rendered statistics charts, keyed by the data they plot, so unchanged data is not re-rendered
+STATISTICS_CHARTS = OrderedDict()
+statistics_charts_lock = threading.Lock()
+
+def render_statistics_charts(series, area_waste):
+    """Time series and area charts for /api/statistics, cached on their (bounded) inputs"""
+    key = (tuple((point['date'], point['total']) for point in series), tuple(area_waste.items()))
+    with statistics_charts_lock:
+        if key in STATISTICS_CHARTS:
+            STATISTICS_CHARTS.move_to_end(key)
+            return STATISTICS_CHARTS[key]
+    
+    # Time series chart
+    fig, ax = plt.subplots(figsize=(10, 6))
+    plt.plot([point['date'] for point in series], [point['total'] for point in series], marker='o')
+    plt.title("Waste Trends Over Time")
+    plt.xlabel("Date")
+    plt.ylabel("Waste Amount")
+    plt.xticks(rotation=45)
+    time_series_chart = plot_to_base64(fig)
+    
+    # Create area waste chart if data exists
+    if area_waste:
+        fig, ax = plt.subplots(figsize=(10, 6))
+        sns.barplot(x=list(area_waste.keys()), y=list(area_waste.values()), ax=ax, palette='viridis')
+        ax.set_title("Waste Distribution by Kitchen Area")
+        ax.set_xlabel("Area")
+        ax.set_ylabel("Waste Amount")
+        plt.xticks(rotation=45)
+        area_chart = plot_to_base64(fig)
+    else:
+        area_chart = None
+    
+    charts = {"time_series": time_series_chart, "area_chart": area_chart}
+    with statistics_charts_lock:
+        STATISTICS_CHARTS[key] = charts
+        while len(STATISTICS_CHARTS) > STATISTICS_CHART_CACHE_SIZE:
+            STATISTICS_CHARTS.popitem(last=False)
+    return charts
+
+def render_kitchen_heatmap(analysis, zones_data):
+    """Zone overlay and full-frame heatmap of a kitchen analysis, drawn at the analysis resolution"""
+    full_width, full_height = analysis['full_size']
+    # Draw the downsampled frame over full-resolution coordinates so zone rectangles line up
+    extent = (0, full_width, full_height, 0)
+    
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(15, 7))
+    
+    # Original image with zone overlays
+    ax1.imshow(analysis['frame'], extent=extent)
+    ax1.set_title("Kitchen Zones")
+    for zone, coords in zones_data.items():
+        rect = plt.Rectangle(
+            (coords['x'], coords['y']),
+            coords['width'],
+            coords['height'],
+            fill=False,
+            color=KITCHEN_ZONES[zone]['color'],
+            linewidth=2,
+            label=KITCHEN_ZONES[zone]['description']
+        )
+        ax1.add_patch(rect)
+    
+    # Heatmap overlay
+    ax2.imshow(analysis['frame'], extent=extent)
+    heatmap_display = ax2.imshow(analysis['heatmap'], cmap='hot', alpha=0.6, extent=extent)
+    ax2.set_title("Waste Heatmap")
+    plt.colorbar(heatmap_display, ax=ax2, label="Waste Intensity")
+    
+    return plot_to_base64(fig)
+
 # ---- API Routes ----
 
 @app.route('/api/dishes', methods=['GET'])
 def get_dishes():
-    return jsonify({"dishes": list(dish_db.dishes.values())})
+    """
+    Registered dishes in id order. Optional query parameters: kitchen_id, name (exact,
+    ignoring case), and page/page_size (default: every dish).
+    """
+    kitchen_id = request.args.get('kitchen_id')
+    name = request.args.get('name')
+    if name:
+        return jsonify({"dishes": dish_db.registry.find_by_name(name, kitchen=kitchen_id)})
+    
+    page_size = request.args.get('page_size', type=int)
+    if page_size is None:
+        return jsonify({"dishes": dish_db.registry.dishes(kitchen=kitchen_id)})
+    
+    page_size = min(max(1, page_size), MAX_DISHES_PAGE_SIZE)
+    page = max(1, request.args.get('page', 1, type=int))
+    total = dish_db.registry.count(kitchen=kitchen_id)
+    return jsonify({
+        "dishes": dish_db.registry.dishes(kitchen=kitchen_id, offset=(page - 1) * page_size, limit=page_size),
+        "pagination": {"page": page, "page_size": page_size, "total": total, "has_more": page * page_size < total}
+    })
 
 @app.route('/api/dishes', methods=['POST'])
 def register_dish():
@@ -322,7 +392,7 @@ def register_dish():
     if not dish_name or not full_weight or not image_data:
         return jsonify({"success": False, "error": "Missing required fields"}), 400
     
-    result = dish_db.add_dish(dish_name, full_weight, image_data)
+    result = dish_db.add_dish(dish_name, full_weight, image_data, data.get('kitchen_id') or DEFAULT_KITCHEN)
     return jsonify(result)
 
 @app.route('/api/analyze/kitchen', methods=['POST'])
@@ -330,6 +400,8 @@ def analyze_kitchen():
     data = request.json
     image_data = data.get('image_data')
     zones_data = data.get('zones_data', {})
+    kitchen_id = data.get('kitchen_id', DEFAULT_KITCHEN)
+    render_heatmap = data.get('render_heatmap', True)
     
     if not image_data:
         return jsonify({"success": False, "error": "Missing image data"}), 400
@@ -339,91 +411,29 @@ def analyze_kitchen():
         image_data = image_data.split(',')[1] if ',' in image_data else image_data
         image = Image.open(io.BytesIO(base64.b64decode(image_data)))
         
-        # Generate dummy heatmap using Gaussian filter
+        # Generate dummy heatmap using Gaussian filter over the zones of a downsampled frame
         # In production, replace with actual ML model prediction
-        image_np = np.array(image)
-        greyscale = cv2.cvtColor(image_np, cv2.COLOR_RGB2GRAY)
-        normalized = greyscale / 255.0
-        heatmap = gaussian_filter(normalized, sigma=10)
-        
-        # Calculate waste data for each zone
-        waste_data = {}
+        analysis = analyze_kitchen_zones(image, zones_data, full_frame_heatmap=render_heatmap)
+        waste_data = analysis['waste_data']
+        total_waste = analysis['total_waste']
         current_date = datetime.now().strftime("%Y-%m-%d %H:%M")
-        total_waste = 0
-        
-        for zone, coords in zones_data.items():
-            try:
-                x = max(0, min(coords['x'], image.width-1))
-                y = max(0, min(coords['y'], image.height-1))
-                width = min(coords['width'], image.width - x)
-                height = min(coords['height'], image.height - y)
-                
-                if width <= 0 or height <= 0:
-                    waste_data[zone] = 0
-                    continue
-                
-                zone_heatmap = heatmap[y:y+height, x:x+width]
-                
-                # Calculate waste value with weighted importance
-                if zone_heatmap.size > 0:
-                    mean_val = np.mean(zone_heatmap)
-                    max_val = np.max(zone_heatmap)
-                    waste_value = 0.7 * mean_val + 0.3 * max_val
-                    
-                    # Apply zone-specific scaling factors
-                    if zone == 'prep_station':
-                        waste_value *= 1.2
-                    elif zone == 'cooking_station':
-                        waste_value *= 1.1
-                    elif zone == 'dishwashing':
-                        waste_value *= 0.9
-                else:
-                    waste_value = 0
-                
-                waste_data[zone] = float(waste_value)
-                total_waste += waste_value
-                
-                # Update zone history
-                ZONE_WASTE_HISTORY[zone][current_date] = waste_value
-            except Exception as e:
-                waste_data[zone] = 0
-        
-        # Update waste history
-        WASTE_HISTORY[current_date] = total_waste
-        
-        # Create heatmap visualization
-        fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(15, 7))
-        
-        # Original image with zone overlays
-        ax1.imshow(image)
-        ax1.set_title("Kitchen Zones")
-        for zone, coords in zones_data.items():
-            rect = plt.Rectangle(
-                (coords['x'], coords['y']),
-                coords['width'],
-                coords['height'],
-                fill=False,
-                color=KITCHEN_ZONES[zone]['color'],
-                linewidth=2,
-                label=KITCHEN_ZONES[zone]['description']
-            )
-            ax1.add_patch(rect)
         
-        # Heatmap overlay
-        ax2.imshow(image)
-        heatmap_display = ax2.imshow(heatmap, cmap='hot', alpha=0.6)
-        ax2.set_title("Waste Heatmap")
-        plt.colorbar(heatmap_display, ax=ax2, label="Waste Intensity")
+        # Update zone and waste history
+        seq = waste_history.record_many(
+            [{'value': waste_data[zone], 'source': 'kitchen', 'zone': zone, 'kitchen': kitchen_id}
+             for zone in analysis['zones']] +
+            [{'value': total_waste, 'source': 'kitchen', 'kitchen': kitchen_id}]
+        )
         
-        heatmap_image = plot_to_base64(fig)
+        heatmap_image = render_kitchen_heatmap(analysis, zones_data) if render_heatmap else None
         
         # Calculate area waste for pie chart
+        waste_history.flush(seq)
+        zone_means = waste_history.zone_means(kitchen=kitchen_id)
         area_waste = {}
         for zone in KITCHEN_ZONES:
-            if zone in ZONE_WASTE_HISTORY:
-                zone_values = list(ZONE_WASTE_HISTORY[zone].values())
-                if zone_values:
-                    area_waste[KITCHEN_ZONES[zone]['description']] = np.mean(zone_values)
+            if zone in zone_means:
+                area_waste[KITCHEN_ZONES[zone]['description']] = zone_means[zone]
         
         # Create pie chart
         if area_waste:
@@ -452,6 +462,73 @@ def analyze_kitchen():
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route('/api/cameras', methods=['GET'])
+def list_cameras():
+    """Per-camera frame counts, throughput and lag"""
+    return jsonify({"success": True, **kitchen_streams.metrics()})
+
+@app.route('/api/cameras/<camera_id>', methods=['POST'])
+def configure_camera(camera_id):
+    """
+    Register a kitchen camera: zones_data, optional kitchen_id, sample_fps and a video source
+    (an RTSP URL on a KITCHEN_CAMERA_HOSTS host, or a video file under KITCHEN_MEDIA_DIR)
+    """
+    data = request.json or {}
+    zones_data = data.get('zones_data')
+    
+    if not zones_data:
+        return jsonify({"success": False, "error": "Missing zones data"}), 400
+    
+    try:
+        sample_fps = float(data.get('sample_fps', DEFAULT_SAMPLE_FPS))
+        if data.get('source'):
+            # Reject sources outside the allowlist before registering anything
+            resolve_camera_source(data['source'])
+        kitchen_streams.configure(camera_id, zones_data, data.get('kitchen_id', DEFAULT_KITCHEN), sample_fps)
+        if data.get('source'):
+            kitchen_streams.start_source(camera_id, data['source'], loop=bool(data.get('loop', False)))
+        return jsonify({"success": True, "camera": kitchen_streams.get(camera_id).metrics(time.time())})
+    except (TypeError, ValueError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/api/cameras/<camera_id>', methods=['DELETE'])
+def remove_camera(camera_id):
+    if not kitchen_streams.remove(camera_id):
+        return jsonify({"success": False, "error": f"Camera not found: {camera_id}"}), 404
+    return jsonify({"success": True})
+
+@app.route('/api/cameras/<camera_id>/frames', methods=['POST'])
+def upload_camera_frames(camera_id):
+    """
+    Chunked frame upload for a registered camera: multipart 'frames' files (with optional
+    matching 'captured_at' unix timestamps) or a single raw image body.
+    
+    Frames wait up to UPLOAD_WAIT_TIMEOUT for the analysis pool; responds 429 when every
+    due frame was dropped because it stayed saturated.
+    """
+    if kitchen_streams.get(camera_id) is None:
+        return jsonify({"success": False, "error": f"Camera not found: {camera_id}"}), 404
+    
+    try:
+        files = request.files.getlist('frames')
+        frames = [f.read() for f in files] if files else [request.get_data()]
+        frames = [frame for frame in frames if frame]
+        if not frames:
+            return jsonify({"success": False, "error": "No frames uploaded"}), 400
+        
+        timestamps = request.form.getlist('captured_at', type=float)
+        results = {"accepted": 0, "skipped": 0, "dropped": 0}
+        for i, frame in enumerate(frames):
+            captured_at = timestamps[i] if i < len(timestamps) else None
+            results[kitchen_streams.submit(camera_id, frame, captured_at, timeout=UPLOAD_WAIT_TIMEOUT)] += 1
+        
+        status = 429 if results["dropped"] and not results["accepted"] else 200
+        return jsonify({"success": status == 200, "frames": results}), status
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
 @app.route('/api/analyze/dish', methods=['POST'])
 def analyze_dish():
     print("\n==== ANALYZE DISH REQUEST ====")
@@ -463,7 +540,6 @@ def analyze_dish():
     
     print(f"Dish ID: {dish_id} (type: {type(dish_id)})")
     print(f"Image data present: {image_data is not None}")
-    print(f"Available dish IDs in database: {list(dish_db.dishes.keys())}")
     
     if not image_data or not dish_id:
         error_msg = "Missing required fields"
@@ -472,33 +548,28 @@ def analyze_dish():
     
     try:
         # Get dish data
-        if dish_id not in dish_db.dishes:
+        dish_data = dish_db.get(dish_id)
+        if dish_data is None:
             error_msg = f"Dish not found with ID: {dish_id}"
             print(f"Error: {error_msg}")
             return jsonify({"success": False, "error": error_msg}), 404
-        
-        dish_data = dish_db.dishes[dish_id]
+        dish_id = dish_data['id']
         print(f"Found dish: {dish_data['name']}")
         
         # Decode image
-        image_data = image_data.split(',')[1] if ',' in image_data else image_data
-        current_image = Image.open(io.BytesIO(base64.b64decode(image_data)))
+        current_image = decode_plate_image(image_data)
         
-        # Check if reference image exists
-        reference_image_filename = dish_data['reference_image']
-        reference_image_path = os.path.join(REFERENCE_IMAGES_DIR, reference_image_filename)
-        print(f"Reference image path: {reference_image_path}")
+        # Reference features are precomputed when the dish is registered
+        reference = reference_features.get(dish_id, dish_data)
         
-        if not os.path.exists(reference_image_path):
+        if reference is None:
+            reference_image_path = os.path.join(REFERENCE_IMAGES_DIR, dish_data['reference_image'])
             error_msg = f"Reference image not found at {reference_image_path}"
             print(f"Error: {error_msg}")
             return jsonify({"success": False, "error": error_msg}), 404
         
-        reference_image = Image.open(reference_image_path)
-        print(f"Reference image loaded successfully")
-        
         # Use our improved similarity calculation method
-        consumption_ratio, debug_info = calculate_enhanced_similarity(current_image, reference_image)
+        consumption_ratio, debug_info = compare_plate_features(extract_plate_features(current_image), reference)
         print(f"Calculated consumption ratio: {consumption_ratio}")
         
         consumed_weight = dish_data['full_weight'] * consumption_ratio
@@ -506,7 +577,7 @@ def analyze_dish():
         
         # Add to waste history
         current_date = datetime.now().strftime("%Y-%m-%d %H:%M")
-        WASTE_HISTORY[current_date] = wasted_weight
+        waste_history.record(wasted_weight, 'dish', dish_id=dish_id, kitchen=data.get('kitchen_id', DEFAULT_KITCHEN))
         
         result = {
             "success": True,
@@ -530,73 +601,209 @@ def analyze_dish():
         print("==== END ANALYZE DISH REQUEST (ERROR) ====\n")
         return jsonify({"success": False, "error": error_msg}), 500
 
+@app.route('/api/analyze/dish/batch', methods=['POST'])
+def analyze_dish_batch():
+    """Analyze many (dish_id, image) plate photos in one request, e.g. for end-of-service audits"""
+    data = request.json or {}
+    plates = data.get('plates') or []
+    
+    if not plates:
+        return jsonify({"success": False, "error": "Missing plates"}), 400
+    if len(plates) > MAX_BATCH_PLATES:
+        return jsonify({"success": False, "error": f"At most {MAX_BATCH_PLATES} plates per request"}), 400
+    
+    try:
+        start_time = time.perf_counter()
+        results = [None] * len(plates)
+        references = {}
+        
+        def prepare(plate):
+            """Decode and resize one plate; runs on the decode pool (PIL releases the GIL)"""
+            return resize_plate(decode_plate_image(plate['image_data']))
+        
+        # Resolve every dish and its reference features once, and reject plates that cannot be scored.
+        # Ids are normalized like get_many keys them, so "05" and " 5" find dish 5
+        dish_ids = []
+        for plate in plates:
+            parsed = parse_dish_id(plate.get('dish_id'))
+            dish_ids.append(str(plate.get('dish_id', '')) if parsed is None else str(parsed))
+        dishes = dish_db.registry.get_many(dish_ids)
+        pending = []
+        for index, plate in enumerate(plates):
+            dish_id = dish_ids[index]
+            if not dish_id or not plate.get('image_data'):
+                results[index] = {"dish_id": dish_id, "success": False, "error": "Missing required fields"}
+            elif dish_id not in dishes:
+                results[index] = {"dish_id": dish_id, "success": False, "error": f"Dish not found with ID: {dish_id}"}
+            else:
+                if dish_id not in references:
+                    references[dish_id] = reference_features.get(dish_id, dishes[dish_id])
+                if references[dish_id] is None:
+                    results[index] = {"dish_id": dish_id, "success": False, "error": "Reference image not found"}
+                else:
+                    pending.append(index)
+        
+        with ThreadPoolExecutor(max_workers=PLATE_DECODE_WORKERS) as executor:
+            futures = {index: executor.submit(prepare, plates[index]) for index in pending}
+            
+            valid = []
+            for index in pending:
+                try:
+                    futures[index].result()
+                    valid.append(index)
+                except Exception as e:
+                    results[index] = {"dish_id": dish_ids[index], "success": False,
+                                      "error": f"Invalid image: {str(e)}"}
+            
+            for chunk_start in range(0, len(valid), PLATE_BATCH_CHUNK):
+                chunk = valid[chunk_start:chunk_start + PLATE_BATCH_CHUNK]
+                chunk_dish_ids = [dish_ids[index] for index in chunk]
+                
+                current = plate_features_from_rgb(np.stack([futures[index].result() for index in chunk]))
+                reference = stack_plate_features([references[dish_id] for dish_id in chunk_dish_ids])
+                ratios, debug = compare_plate_features_batch(current, reference)
+                
+                full_weights = np.array([float(dishes[dish_id]['full_weight']) for dish_id in chunk_dish_ids])
+                consumed = full_weights * ratios
+                wasted = full_weights - consumed
+                
+                for j, index in enumerate(chunk):
+                    results[index] = {
+                        "dish_id": chunk_dish_ids[j],
+                        "success": True,
+                        "original_weight": float(full_weights[j]),
+                        "consumed": float(consumed[j]),
+                        "wasted": float(wasted[j]),
+                        "consumed_percent": float(ratios[j] * 100),
+                        "wasted_percent": float((1 - ratios[j]) * 100),
+                        "debug_info": {key: float(values[j]) for key, values in debug.items()}
+                    }
+        
+        # Aggregate over the plates that were scored
+        analyzed = [result for result in results if result['success']]
+        total_original = sum(result['original_weight'] for result in analyzed)
+        total_wasted = sum(result['wasted'] for result in analyzed)
+        by_dish = {}
+        for result in analyzed:
+            dish = by_dish.setdefault(result['dish_id'], {
+                "name": dishes[result['dish_id']]['name'], "plates": 0, "wasted": 0.0
+            })
+            dish['plates'] += 1
+            dish['wasted'] += result['wasted']
+        
+        current_date = datetime.now().strftime("%Y-%m-%d %H:%M")
+        kitchen_id = data.get('kitchen_id', DEFAULT_KITCHEN)
+        waste_history.record_many([
+            {'value': result['wasted'], 'source': 'dish', 'dish_id': result['dish_id'], 'kitchen': kitchen_id}
+            for result in analyzed
+        ])
+        
+        elapsed = time.perf_counter() - start_time
+        return jsonify({
+            "success": True,
+            "results": results,
+            "aggregate": {
+                "plates": len(plates),
+                "analyzed": len(analyzed),
+                "failed": len(plates) - len(analyzed),
+                "total_original_weight": float(total_original),
+                "total_consumed": float(total_original - total_wasted),
+                "total_wasted": float(total_wasted),
+                "wasted_percent": float(total_wasted / total_original * 100) if total_original else 0.0,
+                "by_dish": by_dish
+            },
+            "timestamp": current_date,
+            "elapsed_ms": round(elapsed * 1000, 1),
+            "plates_per_sec": round(len(plates) / elapsed, 1) if elapsed > 0 else None
+        })
+    
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
 @app.route('/api/statistics', methods=['GET'])
 def get_statistics():
+    """
+    Waste statistics from the incremental aggregates.
+    
+    Query parameters (all optional): kitchen_id; start and end (ISO dates, widened to
+    whole hours so the summary, series and pages cover the same events); granularity
+    ('hour' or 'day') and buckets for the time series; page and page_size for the waste
+    history records, page 1 being the latest.
+    """
     try:
-        # Convert waste history to sorted list
-        dates = sorted(WASTE_HISTORY.keys())
-        values = [WASTE_HISTORY[date] for date in dates]
+        kitchen_id = request.args.get('kitchen_id')
+        start = request.args.get('start')
+        end = request.args.get('end')
+        granularity = request.args.get('granularity', 'hour')
+        buckets = max(1, request.args.get('buckets', STATISTICS_SERIES_BUCKETS, type=int))
+        page = max(1, request.args.get('page', 1, type=int))
+        page_size = min(max(1, request.args.get('page_size', STATISTICS_PAGE_SIZE, type=int)), MAX_STATISTICS_PAGE_SIZE)
+        
+        if granularity not in ROLLUP_GRANULARITIES:
+            return jsonify({"success": False, "error": f"granularity must be one of {', '.join(ROLLUP_GRANULARITIES)}"}), 400
+        
+        start, end = align_window(start, end)
+        waste_history.flush()
         
-        if not dates:
+        # Basic statistics from the running totals (or the hourly rollups of the window)
+        totals = waste_history.totals(start=start, end=end, kitchen=kitchen_id)
+        
+        if not totals['count']:
             return jsonify({
                 "success": True,
                 "has_data": False,
                 "message": "No waste history data available"
             })
         
-        # Basic statistics
-        total_waste = sum(values)
-        avg_waste = total_waste / len(values)
-        max_waste = max(values)
-        min_waste = min(values)
-        
-        # Time series chart
-        fig, ax = plt.subplots(figsize=(10, 6))
-        plt.plot(dates, values, marker='o')
-        plt.title("Waste Trends Over Time")
-        plt.xlabel("Date")
-        plt.ylabel("Waste Amount")
-        plt.xticks(rotation=45)
-        time_series_chart = plot_to_base64(fig)
+        # Time series of the latest buckets
+        fmt = "%Y-%m-%d %H:%M" if granularity == 'hour' else "%Y-%m-%d"
+        series = [
+            {"date": datetime.fromtimestamp(row['bucket']).strftime(fmt), "count": row['count'],
+             "total": float(row['total']), "min": float(row['min']), "max": float(row['max'])}
+            for row in waste_history.rollups(granularity, start=start, end=end, kitchen=kitchen_id, limit=buckets)
+        ]
         
         # Calculate area waste
+        zone_means = waste_history.zone_means(start=start, end=end, kitchen=kitchen_id)
         area_waste = {}
         for zone in KITCHEN_ZONES:
-            if zone in ZONE_WASTE_HISTORY:
-                zone_values = list(ZONE_WASTE_HISTORY[zone].values())
-                if zone_values:
-                    area_waste[KITCHEN_ZONES[zone]['description']] = float(np.mean(zone_values))
+            if zone in zone_means:
+                area_waste[KITCHEN_ZONES[zone]['description']] = float(zone_means[zone])
         
-        # Create area waste chart if data exists
-        if area_waste:
-            fig, ax = plt.subplots(figsize=(10, 6))
-            sns.barplot(x=list(area_waste.keys()), y=list(area_waste.values()), ax=ax, palette='viridis')
-            ax.set_title("Waste Distribution by Kitchen Area")
-            ax.set_xlabel("Area")
-            ax.set_ylabel("Waste Amount")
-            plt.xticks(rotation=45)
-            area_chart = plot_to_base64(fig)
-        else:
-            area_chart = None
+        # One page of raw records, newest page first
+        events = waste_history.events(start=start, end=end, kitchen=kitchen_id,
+                                      limit=page_size, offset=(page - 1) * page_size, newest_first=True)
         
         return jsonify({
             "success": True,
             "has_data": True,
             "statistics": {
-                "total_waste": float(total_waste),
-                "avg_waste": float(avg_waste),
-                "max_waste": float(max_waste),
-                "min_waste": float(min_waste),
-                "num_records": len(values)
+                "total_waste": float(totals['total']),
+                "avg_waste": float(totals['mean']),
+                "max_waste": float(totals['max']),
+                "min_waste": float(totals['min']),
+                "num_records": totals['count']
             },
-            "charts": {
-                "time_series": time_series_chart,
-                "area_chart": area_chart
+            "charts": render_statistics_charts(series, area_waste),
+            "series": series,
+            "waste_history": [
+                {"date": datetime.fromtimestamp(event['ts']).strftime("%Y-%m-%d %H:%M"), "value": float(event['value'])}
+                for event in events
+            ],
+            "pagination": {
+                "page": page,
+                "page_size": page_size,
+                "has_more": page * page_size < totals['count']
+            },
+            "window": {
+                "start": datetime.fromtimestamp(start).isoformat() if start is not None else None,
+                "end": datetime.fromtimestamp(end).isoformat() if end is not None else None
             },
-            "waste_history": [{"date": date, "value": float(WASTE_HISTORY[date])} for date in dates],
             "area_waste": area_waste
         })
     
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
@@ -686,9 +893,8 @@ def calculate_costs():
 
 @app.route('/api/reset', methods=['POST'])
 def reset_statistics():
-    global WASTE_HISTORY, ZONE_WASTE_HISTORY
-    WASTE_HISTORY = defaultdict(float)
-    ZONE_WASTE_HISTORY = defaultdict(lambda: defaultdict(float))
+    data = request.get_json(silent=True) or {}
+    waste_history.reset(kitchen=data.get('kitchen_id'))
     return jsonify({"success": True, "message": "Statistics reset successfully"})
 
 @app.route('/api/images/<path:filename>')
@@ -0,0 +1,388 @@
+"""
+Durable waste event log for the waste API.
+
+Every plate and kitchen analysis appends events to an SQLite database in WAL mode.
+A single writer thread per process drains a bounded queue and commits events in
+batches, so many kitchens posting at once share one transaction instead of contending
+for the write lock. Non-finite values are rejected before they are queued. A batch
+that fails on a transient error (lock, I/O) is retried until it commits, and flush()
+reports the error meanwhile; any other failure is narrowed down to the rows that cause
+it, which are dropped so they cannot hold back the events behind them. Hourly and
+daily rollups per kitchen and zone are updated in the same transaction, together with
+all-time running totals per kitchen and zone, so summaries never rescan the raw events.
+"""
+import math
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+WASTE_HISTORY_DB = os.getenv("WASTE_HISTORY_DB", "waste_history.db")
+DEFAULT_KITCHEN = "default"
+TOTAL_ZONE = ""  # Zone of events that are not tied to a kitchen zone (plate waste, kitchen totals)
+WRITE_BATCH_SIZE = 500  # Events committed per transaction at most
+WRITE_QUEUE_SIZE = 10000  # Pending events before record() blocks the caller
+WRITE_RETRY_DELAY = 0.5  # Seconds before a failed batch is retried, doubled per failure
+WRITE_MAX_RETRY_DELAY = 30
+ROLLUP_GRANULARITIES = ("hour", "day")
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS waste_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts REAL NOT NULL,
+        kitchen TEXT NOT NULL,
+        source TEXT NOT NULL,
+        zone TEXT NOT NULL,
+        dish_id TEXT,
+        value REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_waste_events_ts ON waste_events (ts);
+    CREATE INDEX IF NOT EXISTS idx_waste_events_kitchen_zone_ts ON waste_events (kitchen, zone, ts);
+    CREATE TABLE IF NOT EXISTS waste_rollups (
+        granularity TEXT NOT NULL,
+        bucket REAL NOT NULL,
+        kitchen TEXT NOT NULL,
+        zone TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        total REAL NOT NULL,
+        min REAL NOT NULL,
+        max REAL NOT NULL,
+        PRIMARY KEY (granularity, bucket, kitchen, zone)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS waste_totals (
+        kitchen TEXT NOT NULL,
+        zone TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        total REAL NOT NULL,
+        min REAL NOT NULL,
+        max REAL NOT NULL,
+        PRIMARY KEY (kitchen, zone)
+    ) WITHOUT ROWID;
+"""
+
+UPSERT_ROLLUP = """
+    INSERT INTO waste_rollups (granularity, bucket, kitchen, zone, count, total, min, max)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (granularity, bucket, kitchen, zone) DO UPDATE SET
+        count = count + excluded.count,
+        total = total + excluded.total,
+        min = MIN(min, excluded.min),
+        max = MAX(max, excluded.max)
+"""
+
+UPSERT_TOTAL = """
+    INSERT INTO waste_totals (kitchen, zone, count, total, min, max)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (kitchen, zone) DO UPDATE SET
+        count = count + excluded.count,
+        total = total + excluded.total,
+        min = MIN(min, excluded.min),
+        max = MAX(max, excluded.max)
+"""
+
+def bucket_start(ts, granularity):
+    """Start of the local hour or day containing a unix timestamp"""
+    moment = datetime.fromtimestamp(ts).replace(minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        moment = moment.replace(hour=0)
+    return moment.timestamp()
+
+def hour_ceiling(ts):
+    """Start of the first local hour at or after a unix timestamp"""
+    floor = bucket_start(ts, "hour")
+    if floor == ts:
+        return ts
+    return (datetime.fromtimestamp(floor) + timedelta(hours=1)).timestamp()
+
+def align_window(start=None, end=None):
+    """
+    Widen [start, end) to whole hours, the resolution of the rollups.
+
+    Every windowed query uses the aligned window, so summaries built from hourly rollups
+    and raw event pages describe the same events.
+    """
+    start, end = to_timestamp(start), to_timestamp(end)
+    return (None if start is None else bucket_start(start, "hour"),
+            None if end is None else hour_ceiling(end))
+
+def to_timestamp(value):
+    """Accept unix seconds, datetimes or ISO strings ("2025-03-31", "2025-03-31T08:00")"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return datetime.fromisoformat(str(value)).timestamp()
+
+class WasteHistoryWriteError(Exception):
+    """Recorded events could not be committed yet; the writer keeps retrying them"""
+
+class WasteHistoryStore:
+    def __init__(self, path=WASTE_HISTORY_DB, batch_size=WRITE_BATCH_SIZE, queue_size=WRITE_QUEUE_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.committed = threading.Condition()
+        self.writer = None
+        self.pid = None
+        self.queue = None
+        self.last_seq = 0
+        self.committed_seq = 0
+        self.write_error = None  # Error of the batch being retried, if any
+
+        conn = self._connection()
+        with conn:
+            conn.executescript(SCHEMA)
+            # Logs written before running totals existed
+            if conn.execute("SELECT NOT EXISTS (SELECT 1 FROM waste_totals)").fetchone()[0]:
+                conn.execute(
+                    "INSERT INTO waste_totals (kitchen, zone, count, total, min, max) "
+                    "SELECT kitchen, zone, COUNT(*), SUM(value), MIN(value), MAX(value) "
+                    "FROM waste_events GROUP BY kitchen, zone"
+                )
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _connection(self):
+        """Per-thread read connection"""
+        if getattr(self.local, 'conn', None) is None or getattr(self.local, 'pid', None) != os.getpid():
+            self.local.conn = self._connect()
+            self.local.pid = os.getpid()
+        return self.local.conn
+
+    def _ensure_writer(self):
+        # Start lazily, and again in forked workers that inherited a dead writer thread
+        if self.writer is None or self.pid != os.getpid():
+            self.queue = queue.Queue(maxsize=self.queue_size)
+            self.pid = os.getpid()
+            self.writer = threading.Thread(target=self._write_loop, name="waste-history-writer", daemon=True)
+            self.writer.start()
+
+    def record(self, value, source, zone=TOTAL_ZONE, dish_id=None, kitchen=DEFAULT_KITCHEN, ts=None):
+        """Append one waste event; returns a sequence number that flush() can wait for"""
+        return self.record_many([{
+            'value': value, 'source': source, 'zone': zone, 'dish_id': dish_id, 'kitchen': kitchen, 'ts': ts
+        }])
+
+    def record_many(self, events):
+        """
+        Append waste events (dicts with value, source and optional zone, dish_id, kitchen, ts).
+
+        Raises ValueError, before anything is queued, if a value or timestamp is not finite.
+        """
+        now = time.time()
+        rows = []
+        for event in events:
+            row = (
+                float(event.get('ts') or now),
+                str(event.get('kitchen') or DEFAULT_KITCHEN),
+                event['source'],
+                event.get('zone') or TOTAL_ZONE,
+                None if event.get('dish_id') is None else str(event['dish_id']),
+                float(event['value'])
+            )
+            if not (math.isfinite(row[0]) and math.isfinite(row[5])):
+                raise ValueError(f"Waste event value and timestamp must be finite: {event!r}")
+            rows.append(row)
+
+        with self.lock:
+            self._ensure_writer()
+            for row in rows:
+                self.last_seq += 1
+                # Blocks when the writer falls behind, pushing back on the posting requests
+                self.queue.put((self.last_seq, row))
+            return self.last_seq
+
+    def flush(self, seq=None, timeout=5.0):
+        """
+        Wait until events up to seq (default: everything recorded so far) are committed.
+
+        Returns False on timeout, or raises WasteHistoryWriteError if the timeout passed
+        while the writer was retrying a failed commit.
+        """
+        seq = self.last_seq if seq is None else seq
+        with self.committed:
+            if self.committed.wait_for(lambda: self.committed_seq >= seq, timeout):
+                return True
+            if self.write_error is not None:
+                raise WasteHistoryWriteError(f"Waste history not committed: {self.write_error}")
+            return False
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            # The transaction rolls back on failure, so rows are simply written again
+            rows = [event for _, event in batch]
+            delay = WRITE_RETRY_DELAY
+            start, step = 0, len(rows)
+            while start < len(rows):
+                chunk = rows[start:start + step]
+                try:
+                    self._write(conn, chunk)
+                    start += len(chunk)
+                except sqlite3.OperationalError as e:
+                    # Lock contention, I/O or a full disk: retry the same rows
+                    print(f"Error writing waste history, retrying in {delay}s: {str(e)}")
+                    with self.committed:
+                        self.write_error = e
+                    time.sleep(delay)
+                    delay = min(delay * 2, WRITE_MAX_RETRY_DELAY)
+                except Exception as e:
+                    if step > 1:
+                        step = 1  # Some row cannot be stored: commit the rest one by one
+                    else:
+                        print(f"Dropping waste event that cannot be stored {chunk[0]}: {str(e)}")
+                        start += 1
+
+            with self.committed:
+                self.committed_seq = batch[-1][0]
+                self.write_error = None
+                self.committed.notify_all()
+
+    @staticmethod
+    def _accumulate(aggregates, key, value):
+        current = aggregates.get(key)
+        if current is None:
+            aggregates[key] = [1, value, value, value]
+        else:
+            current[0] += 1
+            current[1] += value
+            current[2] = min(current[2], value)
+            current[3] = max(current[3], value)
+
+    def _write(self, conn, rows):
+        # Pre-aggregate the batch so each rollup and total row is upserted once per transaction
+        rollups, totals = {}, {}
+        for ts, kitchen, _, zone, _, value in rows:
+            for granularity in ROLLUP_GRANULARITIES:
+                self._accumulate(rollups, (granularity, bucket_start(ts, granularity), kitchen, zone), value)
+            self._accumulate(totals, (kitchen, zone), value)
+
+        with conn:
+            conn.executemany(
+                "INSERT INTO waste_events (ts, kitchen, source, zone, dish_id, value) VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            conn.executemany(UPSERT_ROLLUP, [key + tuple(values) for key, values in rollups.items()])
+            conn.executemany(UPSERT_TOTAL, [key + tuple(values) for key, values in totals.items()])
+
+    @staticmethod
+    def _filters(start=None, end=None, kitchen=None, zone=None, time_column="ts"):
+        start, end = align_window(start, end)
+        clauses, params = [], []
+        if kitchen is not None:
+            clauses.append("kitchen = ?")
+            params.append(kitchen)
+        if zone is not None:
+            clauses.append("zone = ?")
+            params.append(zone)
+        if start is not None:
+            clauses.append(f"{time_column} >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append(f"{time_column} < ?")
+            params.append(end)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def events(self, start=None, end=None, kitchen=None, zone=TOTAL_ZONE, limit=None, offset=0, newest_first=False):
+        """
+        Raw events in [start, end) widened to whole hours, oldest first; zone=None
+        returns every zone.
+
+        With newest_first, limit/offset page backwards from the latest event (the page
+        itself is still returned oldest first).
+        """
+        where, params = self._filters(start, end, kitchen, zone)
+        order = "ts DESC, id DESC" if newest_first else "ts, id"
+        sql = f"SELECT ts, kitchen, source, zone, dish_id, value FROM waste_events{where} ORDER BY {order}"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [int(limit), int(offset)]
+
+        rows = self._connection().execute(sql, params).fetchall()
+        if newest_first:
+            rows.reverse()
+        return [
+            {"ts": ts, "kitchen": kitchen, "source": source, "zone": zone or None, "dish_id": dish_id, "value": value}
+            for ts, kitchen, source, zone, dish_id, value in rows
+        ]
+
+    def rollups(self, granularity="hour", start=None, end=None, kitchen=None, zone=TOTAL_ZONE, limit=None):
+        """Per-bucket count/total/min/max, summed over kitchens unless one is given; limit keeps the latest buckets"""
+        if granularity not in ROLLUP_GRANULARITIES:
+            raise ValueError(f"granularity must be one of {', '.join(ROLLUP_GRANULARITIES)}")
+        where, params = self._filters(start, end, kitchen, zone, time_column="bucket")
+        where = (where + " AND " if where else " WHERE ") + "granularity = ?"
+        params.append(granularity)
+
+        sql = f"SELECT bucket, SUM(count), SUM(total), MIN(min), MAX(max) FROM waste_rollups{where} GROUP BY bucket"
+        if limit is not None:
+            sql += " ORDER BY bucket DESC LIMIT ?"
+            params.append(int(limit))
+
+        rows = sorted(self._connection().execute(sql, params).fetchall())
+        return [
+            {"bucket": bucket, "count": count, "total": total, "min": low, "max": high}
+            for bucket, count, total, low, high in rows
+        ]
+
+    def totals(self, start=None, end=None, kitchen=None, zone=TOTAL_ZONE):
+        """
+        Count/total/min/max/mean of the events in [start, end).
+
+        All-time figures come from the running totals; windows are widened to whole hours
+        (see align_window) and summed from the hourly rollups.
+        """
+        if start is None and end is None:
+            where, params = self._filters(kitchen=kitchen, zone=zone)
+            table = "waste_totals"
+        else:
+            where, params = self._filters(start, end, kitchen, zone, time_column="bucket")
+            where += " AND granularity = 'hour'"
+            table = "waste_rollups"
+
+        count, total, low, high = self._connection().execute(
+            f"SELECT COALESCE(SUM(count), 0), COALESCE(SUM(total), 0), MIN(min), MAX(max) FROM {table}{where}", params
+        ).fetchone()
+        return {"count": count, "total": total, "min": low, "max": high, "mean": total / count if count else None}
+
+    def zone_means(self, start=None, end=None, kitchen=None):
+        """Mean event value of every kitchen zone, from the running totals or the hourly rollups"""
+        if start is None and end is None:
+            where, params = self._filters(kitchen=kitchen)
+            table = "waste_totals"
+        else:
+            where, params = self._filters(start, end, kitchen, time_column="bucket")
+            where = (where + " AND " if where else " WHERE ") + "granularity = 'hour'"
+            table = "waste_rollups"
+        where = (where + " AND " if where else " WHERE ") + "zone != ?"
+        params.append(TOTAL_ZONE)
+
+        rows = self._connection().execute(
+            f"SELECT zone, SUM(total) / SUM(count) FROM {table}{where} GROUP BY zone", params
+        ).fetchall()
+        return dict(rows)
+
+    def reset(self, kitchen=None):
+        """Delete the recorded history (of one kitchen, or all of it)"""
+        self.flush()
+        where, params = self._filters(kitchen=kitchen)
+        conn = self._connection()
+        with conn:
+            conn.execute(f"DELETE FROM waste_events{where}", params)
+            conn.execute(f"DELETE FROM waste_rollups{where}", params)
+            conn.execute(f"DELETE FROM waste_totals{where}", params)